@@ -1,18 +1,30 @@
 #!/usr/bin/env python3
 """
-Run prompts on base and finetuned LoRA model and print outputs side by side.
+Run prompts on the base model and one or more finetuned LoRA adapters and print outputs side by side.
 
 - Main prompt: replicates finetuning setup (instruction + input) → expect SSD JSON.
 - Trap prompts: general questions with NO instruction → expect natural language.
-  If the finetuned model outputs JSON for trap prompts, it indicates format overfitting (mode collapse).
+  If a finetuned adapter outputs JSON for trap prompts, it indicates format overfitting (mode collapse).
+
+The base weights are loaded once; every adapter in COMPARE_ADAPTERS is attached to the same
+PeftModel and all prompts run as padded batches per column (base = adapters disabled).
+With COMPARE_MIXED_ADAPTER_BATCH=1, prompts for different adapters share one batch
+(PEFT mixed-adapter inference via generate(adapter_names=...)).
+
+    COMPARE_ADAPTERS="epoch1=outputs_lora/checkpoint-200,final=outputs_lora" python compare.py
 """
 
 import os
+import shutil
+import time
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Optional
 
 import torch
 from unsloth import FastLanguageModel
 from peft import PeftModel
+from transformers import StoppingCriteria, StoppingCriteriaList
 
 
 # ---------------------------------------------------------------------------
@@ -22,6 +34,18 @@ MODEL_NAME = os.environ.get("FINETUNE_MODEL", "unsloth/Qwen3-4B")
 ADAPTER_PATH = os.environ.get("FINETUNE_OUTPUT", "outputs_lora")
 MAX_SEQ_LENGTH = int(os.environ.get("FINETUNE_MAX_SEQ_LENGTH", "4096"))
 MAX_NEW_TOKENS = int(os.environ.get("RUN_PROMPT_MAX_TOKENS", "1024"))
+# Comma-separated adapters to compare: "name=path" or just "path" (name = directory name).
+# Defaults to the single adapter in FINETUNE_OUTPUT.
+ADAPTERS = os.environ.get("COMPARE_ADAPTERS", "")
+BATCH_SIZE = int(os.environ.get("COMPARE_BATCH_SIZE", "8"))
+MIXED_ADAPTER_BATCH = os.environ.get("COMPARE_MIXED_ADAPTER_BATCH", "0").lower() in ("1", "true", "yes")
+# Width of each output column; 0 = split the terminal width evenly
+COL_WIDTH = int(os.environ.get("COMPARE_COL_WIDTH", "0"))
+# Every column is sampled from the same seed so differences come from the weights
+SEED = int(os.environ.get("COMPARE_SEED", "3407"))
+
+# Column label for the base model (adapters disabled); PEFT calls it "__base__" in mixed batches
+BASE_COLUMN = "BASE"
 
 # Same instruction as in model1_samples.jsonl (finetuning setup)
 INSTRUCTION = (
@@ -60,53 +84,188 @@ def _looks_like_ssd_json(text: str) -> bool:
     return "simulation_name" in stripped or '"domain"' in stripped
 
 
-def _run_prompt(model, tokenizer, prompt_text: str, max_new_tokens: int = MAX_NEW_TOKENS) -> str:
-    """Run one prompt and return the decoded response (new tokens only)."""
-    inputs = tokenizer(prompt_text, return_tensors="pt").to(model.device)
+def _format_verdict(partial: str) -> Optional[bool]:
+    """
+    Verdict of _looks_like_ssd_json on a response prefix: True/False once it can no longer change
+    (prose once the first character is not "{", JSON once an SSD key shows up), None while undecided.
+    """
+    stripped = partial.lstrip()
+    if not stripped:
+        return None
+    if not stripped.startswith("{"):
+        return False
+    if "simulation_name" in stripped or '"domain"' in stripped:
+        return True
+    return None
+
+
+class FormatVerdictStoppingCriteria(StoppingCriteria):
+    """
+    Stops each row of a generate() batch as soon as _format_verdict decides it, so a trap prompt
+    usually costs a few tokens instead of max_new_tokens. Undecided rows (JSON without an SSD key
+    yet) run on. The verdict on the truncated response equals the one on the full response.
+    """
+
+    # Once a row has opened with "{", only this many trailing tokens are re-decoded per step
+    # (enough to hold an SSD key name)
+    TAIL_TOKENS = 16
+
+    def __init__(self, tokenizer, prompt_length: int):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.verdicts: Optional[list] = None
+        self._opened: Optional[list] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        new_ids = input_ids[:, self.prompt_length:]
+        if self.verdicts is None:
+            self.verdicts = [None] * input_ids.shape[0]
+            self._opened = [False] * input_ids.shape[0]
+        for i, verdict in enumerate(self.verdicts):
+            if verdict is not None:
+                continue
+            if self._opened[i]:
+                tail = self.tokenizer.decode(new_ids[i, -self.TAIL_TOKENS:], skip_special_tokens=True)
+                if "simulation_name" in tail or '"domain"' in tail:
+                    self.verdicts[i] = True
+                continue
+            text = self.tokenizer.decode(new_ids[i], skip_special_tokens=True)
+            self.verdicts[i] = _format_verdict(text)
+            self._opened[i] = self.verdicts[i] is None and bool(text.strip())
+        return torch.tensor([v is not None for v in self.verdicts], dtype=torch.bool, device=input_ids.device)
+
+
+def _parse_adapters(spec: str, default_path: str) -> list[tuple[str, Path]]:
+    """Parse COMPARE_ADAPTERS into (name, path) pairs; relative paths are resolved next to this script."""
+    entries = [e.strip() for e in spec.split(",") if e.strip()] or [default_path]
+    adapters = []
+    for entry in entries:
+        name, sep, path = entry.partition("=")
+        if not sep:
+            name, path = "", entry
+        adapter_path = Path(path)
+        if not adapter_path.is_absolute():
+            adapter_path = Path(__file__).resolve().parent / adapter_path
+        if not adapter_path.exists():
+            raise FileNotFoundError(f"Adapter path not found: {adapter_path}")
+        name = name or adapter_path.name
+        if name == BASE_COLUMN or name in (n for n, _ in adapters):
+            raise ValueError(f"Duplicate or reserved adapter name: {name}")
+        adapters.append((name, adapter_path))
+    return adapters
+
+
+def load_adapters(model, adapters: list[tuple[str, Path]]):
+    """Attach every adapter to one PeftModel over the shared base weights."""
+    first_name, first_path = adapters[0]
+    model = PeftModel.from_pretrained(model, str(first_path), adapter_name=first_name)
+    for name, path in adapters[1:]:
+        model.load_adapter(str(path), adapter_name=name)
+    return model
+
+
+def _generate_batch(model, tokenizer, prompts: list[str], max_new_tokens: int = MAX_NEW_TOKENS,
+                    temperature: float = 0.7, top_p: float = 0.9, stop_on_format_verdict: bool = False,
+                    **generate_kwargs) -> list[str]:
+    """
+    Run a left-padded batch of prompts and return the decoded responses (new tokens only).
+    With stop_on_format_verdict, each row stops once its SSD-JSON-vs-prose verdict is decided.
+    """
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    if stop_on_format_verdict:
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [FormatVerdictStoppingCriteria(tokenizer, inputs["input_ids"].shape[1])]
+        )
     output_ids = model.generate(
         **inputs,
         max_new_tokens=max_new_tokens,
         do_sample=True,
-        temperature=0.7,
-        top_p=0.9,
+        temperature=temperature,
+        top_p=top_p,
         pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+        **generate_kwargs,
     )
     prompt_length = inputs["input_ids"].shape[1]
-    response_ids = output_ids[0][prompt_length:]
-    return tokenizer.decode(response_ids, skip_special_tokens=True).strip()
+    return [tokenizer.decode(ids[prompt_length:], skip_special_tokens=True).strip() for ids in output_ids]
 
 
-def _side_by_side(left: str, right: str, col_width: int = 55, label_left: str = "BASE", label_right: str = "FINETUNED") -> str:
-    """Format two strings in fixed-width columns side by side."""
+def run_comparison(
+    model,
+    tokenizer,
+    prompts: list[str],
+    adapter_names: list[str],
+    include_base: bool = True,
+    batch_size: int = BATCH_SIZE,
+    max_new_tokens: int = MAX_NEW_TOKENS,
+    mixed: bool = MIXED_ADAPTER_BATCH,
+) -> dict[str, list[str]]:
+    """
+    Generate every prompt under every adapter (and the base model with adapters disabled).
+    Returns {column: [response per prompt]}, columns ordered base first, then adapter_names.
+    """
+    columns = ([BASE_COLUMN] if include_base else []) + list(adapter_names)
+    results = {column: [""] * len(prompts) for column in columns}
+
+    if mixed:
+        # One job per (column, prompt); each batch may mix adapters
+        jobs = [(column, i) for column in columns for i in range(len(prompts))]
+        torch.manual_seed(SEED)
+        for start in range(0, len(jobs), batch_size):
+            chunk = jobs[start:start + batch_size]
+            names = ["__base__" if column == BASE_COLUMN else column for column, _ in chunk]
+            responses = _generate_batch(
+                model, tokenizer, [prompts[i] for _, i in chunk], max_new_tokens, adapter_names=names,
+            )
+            for (column, i), response in zip(chunk, responses):
+                results[column][i] = response
+        return results
+
+    for column in columns:
+        if column == BASE_COLUMN:
+            context = model.disable_adapter()
+        else:
+            model.set_adapter(column)
+            context = nullcontext()
+        torch.manual_seed(SEED)
+        with context:
+            for start in range(0, len(prompts), batch_size):
+                batch = prompts[start:start + batch_size]
+                results[column][start:start + len(batch)] = _generate_batch(model, tokenizer, batch, max_new_tokens)
+    return results
+
+
+def _side_by_side(texts: list[str], labels: list[str], col_width: int = 0) -> str:
+    """Format any number of strings in fixed-width columns side by side."""
+    sep = " | "
+    if col_width <= 0:
+        terminal = shutil.get_terminal_size((120, 40)).columns
+        col_width = max(20, (terminal - 1 - len(sep) * (len(texts) - 1)) // len(texts))
+
     def wrap(s: str, w: int) -> list[str]:
         lines = []
         for line in s.splitlines():
             while line:
-                lines.append(line[:w] if len(line) <= w else line[:w])
-                line = line[w:] if len(line) > w else ""
+                lines.append(line[:w])
+                line = line[w:]
         return lines if lines else [""]
 
-    left_lines = wrap(left, col_width)
-    right_lines = wrap(right, col_width)
-    n = max(len(left_lines), len(right_lines))
-    left_lines += [""] * (n - len(left_lines))
-    right_lines += [""] * (n - len(right_lines))
+    wrapped = [wrap(text, col_width) for text in texts]
+    n = max(len(lines) for lines in wrapped)
+    for lines in wrapped:
+        lines += [""] * (n - len(lines))
 
-    sep = " | "
-    total_width = col_width + len(sep) + col_width
-    header = f" {label_left:<{col_width}} {sep} {label_right:<{col_width}}"
-    hrule = " " + "-" * (total_width - 1)
-    rows = [f" {left_lines[i]:<{col_width}} {sep} {right_lines[i]:<{col_width}}" for i in range(n)]
+    total_width = col_width * len(texts) + len(sep) * (len(texts) - 1)
+    header = " " + sep.join(f"{label[:col_width]:<{col_width}}" for label in labels)
+    hrule = " " + "-" * total_width
+    rows = [" " + sep.join(f"{lines[i]:<{col_width}}" for lines in wrapped) for i in range(n)]
     return "\n".join([header, hrule] + rows)
 
 
 def main():
-    adapter_path = Path(ADAPTER_PATH)
-    if not adapter_path.is_absolute():
-        adapter_path = Path(__file__).resolve().parent / adapter_path
-    if not adapter_path.exists():
-        raise FileNotFoundError(f"Adapter path not found: {adapter_path}")
+    adapters = _parse_adapters(ADAPTERS, ADAPTER_PATH)
 
+    # No merged snapshot here: the BASE column needs the unmerged weights with adapters switchable
+    load_start = time.time()
     print("Loading base model (LoRA, 16-bit)...")
     # Match the training setup: use bfloat16 when available, otherwise float16
     preferred_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
@@ -117,49 +276,62 @@ def main():
         load_in_4bit=False,  # standard LoRA (no QLoRA quantization)
         trust_remote_code=False,
     )
-    print("Preparing base model for inference...")
-    model = FastLanguageModel.for_inference(model)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only batched generation needs the padding on the left
+    tokenizer.padding_side = "left"
+
+    for name, path in adapters:
+        print(f"Loading adapter '{name}' from {path}...")
+    model = load_adapters(model, adapters)
+    print("Preparing model for inference...")
+    model = FastLanguageModel.for_inference(model)
+    print(f"Model ready in {time.time() - load_start:.1f}s (base + {len(adapters)} adapter(s))")
 
     main_prompt = f"{INSTRUCTION}\n\n{INPUT}".strip()
     all_prompts = [main_prompt] + TRAP_PROMPTS
+    adapter_names = [name for name, _ in adapters]
 
-    # ----- Run all prompts on BASE model -----
-    print("\nRunning all prompts on BASE model...")
-    base_responses = [_run_prompt(model, tokenizer, p) for p in all_prompts]
-
-    # ----- Load adapter and run same prompts on FINETUNED model -----
-    print(f"Loading adapter from {adapter_path}...")
-    model = PeftModel.from_pretrained(model, str(adapter_path))
-    print("Preparing finetuned model for inference...")
-    model = FastLanguageModel.for_inference(model)
+    mode = "mixed-adapter batches" if MIXED_ADAPTER_BATCH else "one batch set per column"
+    print(f"\nRunning {len(all_prompts)} prompts x {len(adapter_names) + 1} columns ({mode}, batch size {BATCH_SIZE})...")
+    start = time.time()
+    results = run_comparison(model, tokenizer, all_prompts, adapter_names)
+    print(f"Generated {len(all_prompts) * len(results)} responses in {time.time() - start:.1f}s")
 
-    print("Running all prompts on FINETUNED model...")
-    ft_responses = [_run_prompt(model, tokenizer, p) for p in all_prompts]
+    labels = list(results)
+    columns = [results[label] for label in labels]
 
     # ----- Main prompt: side-by-side (expect SSD JSON) -----
     print("\n" + "=" * 120)
     print("MAIN PROMPT (instruction + input) — expect SSD JSON")
     print("=" * 120)
     print(main_prompt)
-    print("\n--- Base vs Finetuned ---\n")
-    print(_side_by_side(base_responses[0], ft_responses[0]))
+    print(f"\n--- {' vs '.join(labels)} ---\n")
+    print(_side_by_side([col[0] for col in columns], labels, COL_WIDTH))
     print()
 
     # ----- Trap prompts: side-by-side (expect natural language; JSON = overfitting) -----
+    passes = {name: 0 for name in adapter_names}
     for i, trap in enumerate(TRAP_PROMPTS, 1):
         print("\n" + "=" * 120)
         print(f"TRAP PROMPT {i} (no instruction) — expect natural language, not JSON")
         print("=" * 120)
         print(trap)
-        print("\n--- Base vs Finetuned ---\n")
-        print(_side_by_side(base_responses[i], ft_responses[i]))
-        overfit = _looks_like_ssd_json(ft_responses[i])
+        print(f"\n--- {' vs '.join(labels)} ---\n")
+        print(_side_by_side([col[i] for col in columns], labels, COL_WIDTH))
         print("\n--- Format check (finetuned) ---")
-        print("FAIL (format overfitting)" if overfit else "PASS (natural language)")
+        for name in adapter_names:
+            overfit = _looks_like_ssd_json(results[name][i])
+            passes[name] += not overfit
+            print(f"{name}: " + ("FAIL (format overfitting)" if overfit else "PASS (natural language)"))
         print()
 
+    print("=" * 120)
+    print("TRAP PROMPT SUMMARY")
+    print("=" * 120)
+    for name in adapter_names:
+        print(f"{name}: {passes[name]}/{len(TRAP_PROMPTS)} natural-language responses")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Completion-only tokenization with a shared on-disk cache, used by both trainers
+(agent_1_document_interpreter/train.py and agent_2_document_verifier/train.py).
+
+Each prompt/completion pair is tokenized once as prompt + completion + EOS; completion_mask is 1
+on the completion tokens only, so the loss ignores the prompt. The prompt boundary comes from the
+fast tokenizer's character offsets (prefix matching for slow tokenizers). Results are saved under
+<cache_dir>/<hash of tokenizer, data, max_length, layout version>: global rank 0 fills the cache,
+every other rank (and every later launch) memory-maps the Arrow files.
+"""
+
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+from datasets import load_from_disk
+
+TOKENIZE_NUM_PROC = int(os.environ.get("FINETUNE_TOKENIZE_PROCS", str(min(8, os.cpu_count() or 1))))
+TOKENIZE_CACHE_WAIT_SECONDS = int(os.environ.get("FINETUNE_TOKENIZE_WAIT", "7200"))
+
+
+def tokenized_cache_key(dataset, tokenizer, max_length: int, version: str) -> str:
+    """Hash of (layout version, tokenizer, data, max_length) identifying a tokenized dataset."""
+    h = hashlib.sha256()
+    h.update(f"v{version}|{tokenizer.name_or_path}|{len(tokenizer)}|{tokenizer.eos_token}|{max_length}".encode())
+    if getattr(tokenizer, "is_fast", False):
+        h.update(tokenizer.backend_tokenizer.to_str().encode())
+    for batch in dataset.iter(batch_size=1000):
+        for prompt, completion in zip(batch["prompt"], batch["completion"]):
+            h.update(prompt.encode("utf-8"))
+            h.update(b"\0")
+            h.update(completion.encode("utf-8"))
+            h.update(b"\1")
+    return h.hexdigest()[:16]
+
+
+def prompt_len_by_prefix(tokenizer, prompt: str, full_ids, max_length: int) -> int:
+    """Prompt boundary for slow tokenizers (no offsets): tokenize the prompt alone and match the prefix."""
+    prompt_ids = tokenizer(prompt, truncation=True, max_length=max_length, add_special_tokens=True)["input_ids"]
+    prompt_len = min(len(prompt_ids), len(full_ids))
+    # Boundary mismatch: use prefix length that matches (tokenizer quirk)
+    while prompt_len > 0 and full_ids[:prompt_len] != prompt_ids[:prompt_len]:
+        prompt_len -= 1
+    return prompt_len
+
+
+def tokenize_for_completion_only(
+    dataset,
+    tokenizer,
+    max_length: int,
+    version: str,
+    cache_dir: Optional[Path] = None,
+    num_proc: int = TOKENIZE_NUM_PROC,
+    with_length: bool = False,
+    measure: Sequence[str] = (),
+):
+    """
+    Pre-tokenize a prompt/completion dataset to input_ids + attention_mask + completion_mask
+    (plus a `length` column for length-grouped sampling when with_length). For length reports,
+    each text column in `measure` gets its token count as len_<column> and full_length holds the
+    token count before truncation to max_length, so nothing has to be tokenized a second time.
+    version names the caller's tokenized layout (including with_length and measure); bump it there
+    when the layout changes. cache_dir=None disables the cache.
+    """
+    def _measure(batch, out):
+        for column in measure:
+            encoded = tokenizer(batch[column], add_special_tokens=False)["input_ids"]
+            out[f"len_{column}"] = [len(ids) for ids in encoded]
+        # Only rows that reached max_length can have lost tokens to truncation
+        out["full_length"] = list(out["length"]) if with_length else [len(ids) for ids in out["input_ids"]]
+        cut = [i for i, n in enumerate(out["full_length"]) if n >= max_length]
+        if cut:
+            texts = [batch["prompt"][i] + batch["completion"][i] + tokenizer.eos_token for i in cut]
+            for i, ids in zip(cut, tokenizer(texts, add_special_tokens=True)["input_ids"]):
+                out["full_length"][i] = len(ids)
+
+    def _tokenize(batch):
+        prompts = batch["prompt"]
+        full_texts = [p + c + tokenizer.eos_token for p, c in zip(prompts, batch["completion"])]
+        use_offsets = getattr(tokenizer, "is_fast", False)
+        encoded = tokenizer(
+            full_texts,
+            truncation=True,
+            max_length=max_length,
+            add_special_tokens=True,
+            return_offsets_mapping=use_offsets,
+        )
+        out = {"input_ids": [], "attention_mask": [], "completion_mask": []}
+        if with_length:
+            out["length"] = []
+        for i, (prompt, full_ids) in enumerate(zip(prompts, encoded["input_ids"])):
+            if use_offsets:
+                # First real token starting at or after the end of the prompt text;
+                # tokens straddling the boundary stay on the prompt side
+                prompt_chars = len(prompt)
+                prompt_len = len(full_ids)
+                for j, (start, end) in enumerate(encoded["offset_mapping"][i]):
+                    if start >= prompt_chars and end > start:
+                        prompt_len = j
+                        break
+            else:
+                prompt_len = prompt_len_by_prefix(tokenizer, prompt, full_ids, max_length)
+            out["input_ids"].append(full_ids)
+            out["attention_mask"].append([1] * len(full_ids))
+            out["completion_mask"].append([0] * prompt_len + [1] * (len(full_ids) - prompt_len))
+            if with_length:
+                out["length"].append(len(full_ids))
+        if measure:
+            _measure(batch, out)
+        return out
+
+    def _map(ds, procs):
+        return ds.map(
+            _tokenize,
+            batched=True,
+            batch_size=256,
+            remove_columns=ds.column_names,
+            num_proc=max(1, procs),
+            desc="Tokenizing",
+        )
+
+    if not cache_dir:
+        return _map(dataset, num_proc)
+
+    cache_root = Path(cache_dir)
+    cache_path = cache_root / tokenized_cache_key(dataset, tokenizer, max_length, version)
+
+    rank = int(os.environ.get("RANK", "0"))
+    if not cache_path.exists():
+        if rank == 0:
+            print(f"Tokenizing with {num_proc} processes into cache {cache_path} ...")
+            tokenized = _map(dataset, num_proc)
+            tmp_path = cache_root / f".{cache_path.name}.tmp-{os.getpid()}"
+            tokenized.save_to_disk(str(tmp_path))
+            os.replace(tmp_path, cache_path)
+        else:
+            print(f"Rank {rank}: waiting for rank 0 to fill tokenization cache {cache_path} ...")
+            deadline = time.time() + TOKENIZE_CACHE_WAIT_SECONDS
+            while not cache_path.exists():
+                if time.time() > deadline:
+                    raise TimeoutError(f"Tokenization cache not ready after {TOKENIZE_CACHE_WAIT_SECONDS}s: {cache_path}")
+                time.sleep(5)
+    else:
+        print(f"Using cached tokenized dataset {cache_path}")
+
+    # load_from_disk memory-maps the Arrow files instead of copying them into RAM
+    return load_from_disk(str(cache_path))
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Dataset-driven format-overfitting evaluation for Agent 1 checkpoints.
+
+Scales the TRAP_PROMPTS check in run_trap_prompt.py / compare.py to thousands of prompts:
+
+- Prompts come from JSONL (default eval_prompts.jsonl), one per line:
+    {"id": "...", "category": "trap_greeting", "expect": "natural", "prompt": "..."}
+    {"id": "...", "category": "in_domain", "expect": "ssd_json", "instruction": "...", "input": "..."}
+  "natural": pass if the response is NOT SSD-style JSON (format overfitting check).
+  "ssd_json": pass if the response parses as an SSD JSON object.
+- Base weights are loaded once; each adapter (and the base with adapters disabled) is a column.
+- Pending prompts are sorted by token length and generated in batches, so each batch pads little.
+- Responses are cached in a JSONL file keyed by (adapter hash, prompt hash, sampling params);
+  re-running after adding prompts or checkpoints only generates what is new.
+- Pass rates are aggregated per category and column and written to --output.
+- --early-stop ends "natural" prompts as soon as the format verdict is decided
+  (compare.FormatVerdictStoppingCriteria); those responses are cached under their own key.
+- --schema-decoding generates "ssd_json" prompts with schema_decoding.SchemaGuidedDecoder
+  (SimulationOutput scaffolding forced, values sampled), also under their own cache key.
+
+Usage:
+    python eval_suite.py --adapters epoch1=outputs_lora/checkpoint-200 final=outputs_lora
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+from unsloth import FastLanguageModel
+
+from schema_decoding import SchemaGuidedDecoder
+from compare import (
+    ADAPTER_PATH,
+    BASE_COLUMN,
+    MAX_NEW_TOKENS,
+    MAX_SEQ_LENGTH,
+    MODEL_NAME,
+    _generate_batch,
+    _looks_like_ssd_json,
+    _parse_adapters,
+    load_adapters,
+)
+
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_PROMPTS = SCRIPT_DIR / "eval_prompts.jsonl"
+DEFAULT_CACHE = SCRIPT_DIR / "eval_cache.jsonl"
+
+EXPECTATIONS = ("natural", "ssd_json")
+
+
+def load_prompts(path: Path) -> List[Dict]:
+    """Read evaluation prompts; instruction/input records are joined the way train.py builds prompts."""
+    prompts = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "prompt" in record:
+                text = record["prompt"]
+            else:
+                text = f"{record.get('instruction', '')}\n\n{record.get('input', '')}".strip()
+            expect = record.get("expect", "natural")
+            if expect not in EXPECTATIONS:
+                raise ValueError(f"{path}:{line_num}: unknown expect '{expect}' (use one of {EXPECTATIONS})")
+            prompt_id = record.get("id") or f"line{line_num}"
+            if prompt_id in seen:
+                raise ValueError(f"{path}:{line_num}: duplicate prompt id '{prompt_id}'")
+            seen.add(prompt_id)
+            prompts.append({
+                "id": prompt_id,
+                "category": record.get("category", "uncategorized"),
+                "expect": expect,
+                "prompt": text,
+                "prompt_hash": hashlib.sha256(text.encode("utf-8")).hexdigest()[:16],
+            })
+    return prompts
+
+
+def adapter_hash(model_name: str, adapter_path: Optional[Path]) -> str:
+    """Content hash of the base model name plus adapter config and weights (base column: name only)."""
+    h = hashlib.sha256(model_name.encode("utf-8"))
+    if adapter_path is not None:
+        for file in sorted(adapter_path.glob("adapter_*")):
+            h.update(file.name.encode("utf-8"))
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def sampling_key(params: Dict) -> str:
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _cache_key(adapter: str, prompt_hash: str, sampling: str) -> str:
+    return f"{adapter}:{prompt_hash}:{sampling}"
+
+
+def load_cache(path: Path) -> Dict[str, str]:
+    """key -> response; a torn last line from an interrupted run is skipped."""
+    cache = {}
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                cache[entry["key"]] = entry["response"]
+    return cache
+
+
+def is_ssd_json(text: str) -> bool:
+    """Response parses as an SSD JSON object (code fences allowed)."""
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.strip("`")
+        stripped = stripped[stripped.find("{"):] if "{" in stripped else stripped
+    try:
+        obj = json.loads(stripped)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(obj, dict) and "simulation_name" in obj
+
+
+def check_response(expect: str, response: str) -> bool:
+    if expect == "ssd_json":
+        return is_ssd_json(response)
+    return not _looks_like_ssd_json(response)
+
+
+def length_sorted_batches(tokenizer, prompts: List[Dict], batch_size: int) -> List[List[Dict]]:
+    """Bucket prompts of similar token length so each padded batch wastes little."""
+    lengths = [len(ids) for ids in tokenizer([p["prompt"] for p in prompts])["input_ids"]]
+    ordered = [p for _, p in sorted(zip(lengths, prompts), key=lambda x: x[0], reverse=True)]
+    return [ordered[i:i + batch_size] for i in range(0, len(ordered), batch_size)]
+
+
+def _sampling_hashes(sampling: Dict, early_stop: bool, schema_decoding: bool = False) -> Dict[str, str]:
+    """
+    Sampling key per expectation; early-stopped (truncated) or schema-decoded responses must not
+    share a key with plain sampled ones.
+    """
+    return {
+        "natural": sampling_key({**sampling, "early_stop": True} if early_stop else sampling),
+        "ssd_json": sampling_key({**sampling, "schema_decoding": True} if schema_decoding else sampling),
+    }
+
+
+def _generate_pending(model, tokenizer, pending: List[Dict], column_hash: str, sampling: Dict,
+                      sampling_hashes: Dict[str, str], batch_size: int, cache: Dict[str, str], cache_file,
+                      early_stop: bool = False, schema_decoder: Optional[SchemaGuidedDecoder] = None) -> int:
+    """
+    Generate uncached prompts in length-sorted batches, appending each batch to the cache file.
+    Returns the number of response tokens generated.
+    """
+    num_tokens = 0
+    for expect in EXPECTATIONS:
+        group = [p for p in pending if p["expect"] == expect]
+        if expect == "ssd_json" and schema_decoder is not None:
+            # One prompt at a time: scaffolding forced, generation ends when the object closes
+            for p in group:
+                response, stats = schema_decoder.generate(p["prompt"])
+                num_tokens += stats["sampled_tokens"] + stats["forced_tokens"]
+                key = _cache_key(column_hash, p["prompt_hash"], sampling_hashes[expect])
+                cache[key] = response
+                cache_file.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n")
+                cache_file.flush()
+            continue
+        for batch in length_sorted_batches(tokenizer, group, batch_size) if group else []:
+            responses = _generate_batch(
+                model,
+                tokenizer,
+                [p["prompt"] for p in batch],
+                max_new_tokens=sampling["max_new_tokens"],
+                temperature=sampling["temperature"],
+                top_p=sampling["top_p"],
+                stop_on_format_verdict=early_stop and expect == "natural",
+            )
+            num_tokens += sum(len(ids) for ids in tokenizer(responses, add_special_tokens=False)["input_ids"])
+            for p, response in zip(batch, responses):
+                key = _cache_key(column_hash, p["prompt_hash"], sampling_hashes[expect])
+                cache[key] = response
+                cache_file.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n")
+            cache_file.flush()
+    return num_tokens
+
+
+def evaluate(
+    model,
+    tokenizer,
+    prompts: List[Dict],
+    columns: Dict[str, str],
+    cache_path: Path,
+    sampling: Dict,
+    batch_size: int,
+    early_stop: bool = False,
+    schema_decoding: bool = False,
+) -> Dict[str, List[Dict]]:
+    """
+    Generate (or take from cache) every prompt for every column.
+    columns maps column name -> adapter hash; BASE_COLUMN runs with adapters disabled.
+    """
+    cache = load_cache(cache_path)
+    sampling_hashes = _sampling_hashes(sampling, early_stop, schema_decoding)
+    schema_decoder = None
+    if schema_decoding:
+        schema_decoder = SchemaGuidedDecoder(
+            model, tokenizer, temperature=sampling["temperature"], top_p=sampling["top_p"],
+        )
+
+    def _key(column_hash: str, p: Dict) -> str:
+        return _cache_key(column_hash, p["prompt_hash"], sampling_hashes[p["expect"]])
+
+    results = {}
+    with open(cache_path, "a", encoding="utf-8") as cache_file:
+        for column, column_hash in columns.items():
+            pending = [p for p in prompts if _key(column_hash, p) not in cache]
+            print(f"[{column}] {len(prompts) - len(pending)} cached, {len(pending)} to generate")
+            if pending:
+                if column == BASE_COLUMN:
+                    context = model.disable_adapter()
+                else:
+                    model.set_adapter(column)
+                    context = nullcontext()
+                torch.manual_seed(sampling["seed"])
+                start = time.time()
+                with context:
+                    num_tokens = _generate_pending(model, tokenizer, pending, column_hash, sampling,
+                                                   sampling_hashes, batch_size, cache, cache_file, early_stop,
+                                                   schema_decoder)
+                elapsed = max(time.time() - start, 1e-9)
+                print(f"[{column}] generated {len(pending)} responses ({num_tokens} tokens) in {elapsed:.1f}s "
+                      f"({len(pending) / elapsed:.2f} prompts/sec)")
+            results[column] = []
+            for p in prompts:
+                response = cache[_key(column_hash, p)]
+                results[column].append({
+                    "id": p["id"],
+                    "category": p["category"],
+                    "expect": p["expect"],
+                    "passed": check_response(p["expect"], response),
+                    "response": response,
+                })
+    return results
+
+
+def summarize(results: Dict[str, List[Dict]]) -> Dict[str, Dict[str, Dict]]:
+    """Pass counts and rates per column and category (plus "all")."""
+    summary = {}
+    for column, rows in results.items():
+        counts = defaultdict(lambda: [0, 0])
+        for row in rows:
+            for category in (row["category"], "all"):
+                counts[category][0] += row["passed"]
+                counts[category][1] += 1
+        summary[column] = {
+            category: {"passed": passed, "total": total, "pass_rate": passed / total}
+            for category, (passed, total) in sorted(counts.items())
+        }
+    return summary
+
+
+def _print_summary(summary: Dict[str, Dict[str, Dict]]):
+    columns = list(summary)
+    categories = sorted({c for per_column in summary.values() for c in per_column} - {"all"}) + ["all"]
+    width = max(len(c) for c in categories) + 2
+    print(" " * width + "".join(f"{column[:18]:>20}" for column in columns))
+    for category in categories:
+        cells = []
+        for column in columns:
+            stats = summary[column].get(category)
+            cells.append(f"{stats['pass_rate']:>8.1%} ({stats['passed']}/{stats['total']})" if stats else "")
+        print(f"{category:<{width}}" + "".join(f"{cell:>20}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Format-overfitting evaluation over a prompt dataset")
+    parser.add_argument("--prompts", type=str, default=str(DEFAULT_PROMPTS), help="Evaluation prompts JSONL")
+    parser.add_argument("--adapters", nargs="*", default=[ADAPTER_PATH],
+                        help="Adapters to evaluate: name=path or path (default: FINETUNE_OUTPUT)")
+    parser.add_argument("--no-base", action="store_true", help="Skip the base model column")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("COMPARE_BATCH_SIZE", "8")))
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--top-p", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=int(os.environ.get("COMPARE_SEED", "3407")))
+    parser.add_argument("--early-stop", action="store_true",
+                        help="Stop natural-language (trap) prompts once the format verdict is decided")
+    parser.add_argument("--schema-decoding", action="store_true",
+                        help="Generate SSD (ssd_json) prompts with SimulationOutput schema-guided decoding")
+    parser.add_argument("--cache", type=str, default=str(DEFAULT_CACHE), help="Response cache JSONL")
+    parser.add_argument("--output", type=str, default="eval_results.json", help="Per-prompt results and summary")
+    args = parser.parse_args()
+
+    prompts = load_prompts(Path(args.prompts))
+    print(f"Loaded {len(prompts)} prompts from {args.prompts}")
+    adapters = _parse_adapters(",".join(args.adapters), ADAPTER_PATH)
+
+    load_start = time.time()
+    print("Loading base model (LoRA, 16-bit)...")
+    preferred_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    model, tokenizer = FastLanguageModel.from_pretrained(
+        model_name=MODEL_NAME,
+        max_seq_length=MAX_SEQ_LENGTH,
+        dtype=preferred_dtype,
+        load_in_4bit=False,  # standard LoRA (no QLoRA quantization)
+        trust_remote_code=False,
+    )
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    model = load_adapters(model, adapters)
+    model = FastLanguageModel.for_inference(model)
+    print(f"Model ready in {time.time() - load_start:.1f}s (base + {len(adapters)} adapter(s))")
+
+    columns = {} if args.no_base else {BASE_COLUMN: adapter_hash(MODEL_NAME, None)}
+    for name, path in adapters:
+        columns[name] = adapter_hash(MODEL_NAME, path)
+
+    sampling = {
+        "max_new_tokens": args.max_new_tokens,
+        "temperature": args.temperature,
+        "top_p": args.top_p,
+        "seed": args.seed,
+    }
+    results = evaluate(model, tokenizer, prompts, columns, Path(args.cache), sampling, args.batch_size,
+                       early_stop=args.early_stop, schema_decoding=args.schema_decoding)
+    summary = summarize(results)
+
+    print("\nPass rate per category")
+    _print_summary(summary)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"sampling": sampling, "adapters": columns, "summary": summary, "results": results},
+                  f, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Merge a LoRA adapter into its base weights once and save a safetensors snapshot,
+so inference scripts can skip rebuilding base + PeftModel on every start.
+
+    python export_merged.py                                   # adapter in FINETUNE_OUTPUT
+    python export_merged.py --adapter outputs_lora/checkpoint-200
+    python export_merged.py --adapter ../agent_2_document_verifier/outputs_agent2_lora/final_model
+
+The snapshot goes to <adapter>/merged (override with --output / FINETUNE_MERGED) together with
+merged_info.json, which records the adapter files it was built from. A snapshot saved elsewhere is
+recorded in <adapter>/merged_path.txt, so loaders find it without FINETUNE_MERGED. load_for_inference()
+uses the snapshot only while the adapter files are unchanged; safetensors shards are memory-mapped on load.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import torch
+from unsloth import FastLanguageModel
+from peft import PeftModel
+
+
+MODEL_NAME = os.environ.get("FINETUNE_MODEL", "unsloth/Qwen3-4B")
+ADAPTER_PATH = os.environ.get("FINETUNE_OUTPUT", "outputs_lora")
+MAX_SEQ_LENGTH = int(os.environ.get("FINETUNE_MAX_SEQ_LENGTH", "4096"))
+# Explicit snapshot location; default is <adapter>/merged
+MERGED_PATH = os.environ.get("FINETUNE_MERGED", "")
+# Set to 0 to always load base + adapter even if a snapshot exists
+USE_MERGED = os.environ.get("FINETUNE_USE_MERGED", "1").lower() in ("1", "true", "yes")
+
+MERGED_DIR_NAME = "merged"
+MERGED_INFO_NAME = "merged_info.json"
+# Written into the adapter directory when the snapshot lives somewhere else
+MERGED_POINTER_NAME = "merged_path.txt"
+
+
+def _resolve(path: str) -> Path:
+    resolved = Path(path)
+    if not resolved.is_absolute():
+        resolved = Path(__file__).resolve().parent / resolved
+    return resolved
+
+
+def adapter_fingerprint(adapter_path: Path) -> Dict[str, list]:
+    """Size and mtime of every adapter file; cheap to recompute on every start."""
+    return {
+        file.name: [file.stat().st_size, file.stat().st_mtime_ns]
+        for file in sorted(adapter_path.glob("adapter_*"))
+    }
+
+
+def merged_snapshot_path(adapter_path: Path) -> Path:
+    """FINETUNE_MERGED, else the location recorded by the last export, else <adapter>/merged."""
+    if MERGED_PATH:
+        return _resolve(MERGED_PATH)
+    pointer = adapter_path / MERGED_POINTER_NAME
+    if pointer.exists():
+        return Path(pointer.read_text(encoding="utf-8").strip())
+    return adapter_path / MERGED_DIR_NAME
+
+
+def find_merged_snapshot(adapter_path: Path) -> Optional[Path]:
+    """Snapshot directory if it exists and was built from the current adapter files."""
+    snapshot = merged_snapshot_path(adapter_path)
+    info_path = snapshot / MERGED_INFO_NAME
+    if not info_path.exists():
+        return None
+    with open(info_path, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    if info.get("adapter_files") != adapter_fingerprint(adapter_path):
+        print(f"Merged snapshot {snapshot} is stale (adapter changed since export); ignoring it")
+        return None
+    return snapshot
+
+
+def _base_model_name(adapter_path: Path, default: str) -> str:
+    config_path = adapter_path / "adapter_config.json"
+    if config_path.exists():
+        with open(config_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("base_model_name_or_path") or default
+    return default
+
+
+def export_merged(adapter_path: Path, output_dir: Optional[Path] = None, max_seq_length: int = MAX_SEQ_LENGTH) -> Path:
+    """
+    Merge the adapter into its 16-bit base and save a safetensors snapshot with merged_info.json.
+    The snapshot is built in <output>.partial and swapped in when complete, so re-exporting over an
+    existing snapshot never leaves new shards next to the old merged_info.json.
+    """
+    output_dir = output_dir or merged_snapshot_path(adapter_path)
+    partial_dir = output_dir.with_name(output_dir.name + ".partial")
+    old_dir = output_dir.with_name(output_dir.name + ".old")
+    base_model = _base_model_name(adapter_path, MODEL_NAME)
+    dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+
+    start = time.time()
+    print(f"Loading base model {base_model} (16-bit)...")
+    model, tokenizer = FastLanguageModel.from_pretrained(
+        model_name=base_model,
+        max_seq_length=max_seq_length,
+        dtype=dtype,
+        load_in_4bit=False,  # merge into full-precision weights, not a quantized copy
+        trust_remote_code=False,
+    )
+    print(f"Loading adapter from {adapter_path}...")
+    model = PeftModel.from_pretrained(model, str(adapter_path))
+
+    print("Merging adapter into base weights...")
+    model = model.merge_and_unload()
+    if partial_dir.exists():
+        shutil.rmtree(partial_dir)  # left over from an interrupted export
+    partial_dir.mkdir(parents=True)
+    model.save_pretrained(str(partial_dir), safe_serialization=True, max_shard_size="5GB")
+    tokenizer.save_pretrained(str(partial_dir))
+
+    info = {
+        "base_model": base_model,
+        "adapter_path": str(adapter_path),
+        "adapter_files": adapter_fingerprint(adapter_path),
+        "dtype": str(dtype).replace("torch.", ""),
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(partial_dir / MERGED_INFO_NAME, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    # A crash between the renames leaves no snapshot (load falls back to base + adapter), never a mixed one
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    if output_dir.exists():
+        output_dir.rename(old_dir)
+    partial_dir.rename(output_dir)
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    pointer = adapter_path / MERGED_POINTER_NAME
+    if output_dir.resolve() != (adapter_path / MERGED_DIR_NAME).resolve():
+        pointer.write_text(str(output_dir.resolve()) + "\n", encoding="utf-8")
+    elif pointer.exists():
+        pointer.unlink()
+    print(f"Merged snapshot saved to {output_dir} in {time.time() - start:.1f}s")
+    return output_dir
+
+
+def load_for_inference(
+    model_name: str,
+    adapter_path: Path,
+    max_seq_length: int = MAX_SEQ_LENGTH,
+    use_merged: bool = USE_MERGED,
+) -> Tuple[object, object]:
+    """
+    Model + tokenizer ready for generation: the merged snapshot when one matches the adapter,
+    otherwise base + PeftModel as before. Prints where the weights came from and the load time.
+    """
+    start = time.time()
+    dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    snapshot = find_merged_snapshot(adapter_path) if use_merged else None
+    if snapshot is not None:
+        print(f"Loading merged snapshot from {snapshot}...")
+        model, tokenizer = FastLanguageModel.from_pretrained(
+            model_name=str(snapshot),
+            max_seq_length=max_seq_length,
+            dtype=dtype,
+            load_in_4bit=False,
+            trust_remote_code=False,
+        )
+        source = "merged snapshot"
+    else:
+        print("Loading base model (LoRA, 16-bit)...")
+        model, tokenizer = FastLanguageModel.from_pretrained(
+            model_name=model_name,
+            max_seq_length=max_seq_length,
+            dtype=dtype,
+            load_in_4bit=False,  # standard LoRA (no QLoRA quantization)
+            trust_remote_code=False,
+        )
+        print(f"Loading adapter from {adapter_path}...")
+        model = PeftModel.from_pretrained(model, str(adapter_path))
+        source = "base + adapter"
+
+    print("Preparing for inference...")
+    model = FastLanguageModel.for_inference(model)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    print(f"Model ready in {time.time() - start:.1f}s ({source})")
+    return model, tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge a LoRA adapter into its base model and save a snapshot")
+    parser.add_argument("--adapter", type=str, default=ADAPTER_PATH, help="Adapter directory (default: FINETUNE_OUTPUT)")
+    parser.add_argument("--output", type=str, default=None, help="Snapshot directory (default: <adapter>/merged); recorded in the adapter "
+                        "directory so loaders find it")
+    parser.add_argument("--max-seq-length", type=int, default=MAX_SEQ_LENGTH)
+    args = parser.parse_args()
+
+    adapter_path = _resolve(args.adapter)
+    if not adapter_path.exists():
+        raise FileNotFoundError(f"Adapter path not found: {adapter_path}")
+    export_merged(adapter_path, _resolve(args.output) if args.output else None, args.max_seq_length)
+
+
+if __name__ == "__main__":
+    main()
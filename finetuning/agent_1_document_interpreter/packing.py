@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Sequence packing for the completion-only Agent 1 trainer.
+
+Packs several pre-tokenized prompt/completion examples (input_ids + completion_mask,
+see completion_tokenization.tokenize_for_completion_only) into windows of at most MAX_SEQ_LENGTH tokens
+so far less compute goes to pad tokens.
+
+- pack_examples: best-fit-decreasing bin packing; each window keeps the concatenated
+  completion_mask and the per-example lengths (seq_lengths).
+- PackedCompletionCollator: builds labels (-100 outside completions and on the first
+  token of every example), position_ids that restart per example, and an attention
+  layout that stops examples from attending across each other:
+    "block_mask"   4-D block-diagonal causal mask (works with SDPA/eager, e.g. V100)
+    "position_ids" padding-free flattened batch with restarting position_ids
+                   (flash-attention varlen kernels derive boundaries from them)
+- padding_stats: padding ratio for random, length-grouped and packed batching.
+"""
+
+import bisect
+import random
+from typing import Dict, List, Optional
+
+import torch
+from datasets import Dataset
+
+
+def pack_examples(dataset: Dataset, max_length: int) -> Dataset:
+    """Pack tokenized examples into windows of at most max_length tokens (best-fit decreasing)."""
+    lengths = [len(ids) for ids in dataset["input_ids"]]
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+
+    # Bins kept sorted by remaining capacity so the best fit is a bisect away
+    remaining: List[int] = []
+    bin_ids: List[int] = []
+    bins: List[List[int]] = []
+    for idx in order:
+        length = min(lengths[idx], max_length)
+        pos = bisect.bisect_left(remaining, length)
+        if pos < len(remaining):
+            cap = remaining.pop(pos)
+            b = bin_ids.pop(pos)
+            bins[b].append(idx)
+            cap -= length
+        else:
+            b = len(bins)
+            bins.append([idx])
+            cap = max_length - length
+        pos = bisect.bisect_left(remaining, cap)
+        remaining.insert(pos, cap)
+        bin_ids.insert(pos, b)
+
+    def _windows():
+        for members in bins:
+            input_ids, completion_mask, seq_lengths = [], [], []
+            for idx in members:
+                example = dataset[idx]
+                ids = example["input_ids"][:max_length]
+                input_ids.extend(ids)
+                completion_mask.extend(example["completion_mask"][:max_length])
+                seq_lengths.append(len(ids))
+            yield {"input_ids": input_ids, "completion_mask": completion_mask, "seq_lengths": seq_lengths}
+
+    return Dataset.from_list(list(_windows()))
+
+
+class PackedCompletionCollator:
+    """Collate packed (or single-example) rows into a completion-only LM batch."""
+
+    def __init__(self, pad_token_id: int, attention: str = "block_mask", dtype: torch.dtype = torch.float32):
+        if attention not in ("block_mask", "position_ids"):
+            raise ValueError(f"Unknown packing attention mode: {attention}")
+        self.pad_token_id = pad_token_id
+        self.attention = attention
+        self.dtype = dtype
+
+    @staticmethod
+    def _labels_and_positions(row: Dict):
+        ids = row["input_ids"]
+        seq_lengths = row.get("seq_lengths") or [len(ids)]
+        labels = [tok if keep else -100 for tok, keep in zip(ids, row["completion_mask"])]
+        position_ids = []
+        start = 0
+        for length in seq_lengths:
+            # Never predict an example's first token from the previous example
+            labels[start] = -100
+            position_ids.extend(range(length))
+            start += length
+        return labels, position_ids, seq_lengths
+
+    def __call__(self, rows: List[Dict]) -> Dict[str, torch.Tensor]:
+        prepared = [self._labels_and_positions(row) for row in rows]
+
+        if self.attention == "position_ids":
+            # Padding-free: one flattened row, boundaries carried by position_ids
+            input_ids = [tok for row in rows for tok in row["input_ids"]]
+            labels = [label for row_labels, _, _ in prepared for label in row_labels]
+            position_ids = [p for _, pos, _ in prepared for p in pos]
+            return {
+                "input_ids": torch.tensor([input_ids]),
+                "labels": torch.tensor([labels]),
+                "position_ids": torch.tensor([position_ids]),
+            }
+
+        max_len = max(len(row["input_ids"]) for row in rows)
+        batch = len(rows)
+        input_ids = torch.full((batch, max_len), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch, max_len), -100, dtype=torch.long)
+        position_ids = torch.zeros((batch, max_len), dtype=torch.long)
+        allowed = torch.zeros((batch, 1, max_len, max_len), dtype=torch.bool)
+        for i, (row, (row_labels, row_positions, seq_lengths)) in enumerate(zip(rows, prepared)):
+            n = len(row["input_ids"])
+            input_ids[i, :n] = torch.tensor(row["input_ids"])
+            labels[i, :n] = torch.tensor(row_labels)
+            position_ids[i, :n] = torch.tensor(row_positions)
+            start = 0
+            for length in seq_lengths:
+                end = start + length
+                allowed[i, 0, start:end, start:end] = torch.tril(torch.ones(length, length, dtype=torch.bool))
+                start = end
+
+        if all(len(seq) == 1 for _, _, seq in prepared):
+            # Nothing packed: a plain 2-D padding mask is enough
+            attention_mask = allowed[:, 0].any(dim=1).long()
+        else:
+            attention_mask = torch.zeros(allowed.shape, dtype=self.dtype)
+            attention_mask.masked_fill_(~allowed, torch.finfo(self.dtype).min)
+        return {
+            "input_ids": input_ids,
+            "labels": labels,
+            "position_ids": position_ids,
+            "attention_mask": attention_mask,
+        }
+
+
+def padding_stats(lengths: List[int], batch_size: int, packed_lengths: Optional[List[int]] = None,
+                  seed: int = 42) -> Dict[str, float]:
+    """
+    Fraction of computed tokens that are padding when batches are padded to their longest row,
+    for random batching, length-grouped batching (HF LengthGroupedSampler-style megabatches)
+    and, if given, packed windows.
+    """
+    def _ratio(batches: List[List[int]]) -> float:
+        real = sum(sum(b) for b in batches)
+        computed = sum(max(b) * len(b) for b in batches if b)
+        return 1 - real / computed if computed else 0.0
+
+    def _chunks(seq: List[int], size: int) -> List[List[int]]:
+        return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+    rng = random.Random(seed)
+    shuffled = lengths[:]
+    rng.shuffle(shuffled)
+    stats = {"random": _ratio(_chunks(shuffled, batch_size))}
+
+    megabatch = batch_size * 50
+    grouped = []
+    for mb in _chunks(shuffled, megabatch):
+        grouped.extend(_chunks(sorted(mb, reverse=True), batch_size))
+    stats["length_grouped"] = _ratio(grouped)
+
+    if packed_lengths is not None:
+        packed = packed_lengths[:]
+        rng.shuffle(packed)
+        stats["packed"] = _ratio(_chunks(packed, batch_size))
+    return stats
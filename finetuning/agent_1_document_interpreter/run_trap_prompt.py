@@ -5,14 +5,22 @@ Run prompts on the finetuned LoRA model and print outputs.
 - Main prompt: replicates finetuning setup (instruction + input) → expect SSD JSON.
 - Trap prompts: general questions with NO instruction → expect natural language.
   If the model outputs JSON for trap prompts, it indicates format overfitting (mode collapse).
+- Loads the merged snapshot written by export_merged.py when it matches the adapter
+  (FINETUNE_USE_MERGED=0 forces base + adapter).
+- RUN_PROMPT_SCHEMA_DECODING=1: the main prompt is decoded against the SimulationOutput schema
+  (keys/braces/quotes forced, only values sampled), so the SSD always parses.
+- RUN_PROMPT_EARLY_STOP=1: trap prompts stop generating as soon as the format verdict is decided
+  (first non-"{" character → prose; "{" plus an SSD key → JSON), usually within a few tokens.
 """
 
 import os
 from pathlib import Path
 
-import torch
-from unsloth import FastLanguageModel
-from peft import PeftModel
+from transformers import StoppingCriteriaList
+
+from compare import FormatVerdictStoppingCriteria
+from export_merged import load_for_inference
+from schema_decoding import SchemaGuidedDecoder
 
 
 # ---------------------------------------------------------------------------
@@ -22,6 +30,9 @@ MODEL_NAME = os.environ.get("FINETUNE_MODEL", "unsloth/Qwen3-4B")
 ADAPTER_PATH = os.environ.get("FINETUNE_OUTPUT", "outputs_lora")
 MAX_SEQ_LENGTH = int(os.environ.get("FINETUNE_MAX_SEQ_LENGTH", "4096"))
 MAX_NEW_TOKENS = int(os.environ.get("RUN_PROMPT_MAX_TOKENS", "1024"))
+EARLY_STOP = os.environ.get("RUN_PROMPT_EARLY_STOP", "0").lower() in ("1", "true", "yes")
+# Main prompt via SimulationOutput schema-guided decoding (always valid SSD JSON)
+SCHEMA_DECODING = os.environ.get("RUN_PROMPT_SCHEMA_DECODING", "0").lower() in ("1", "true", "yes")
 
 # Same instruction as in model1_samples.jsonl (finetuning setup)
 INSTRUCTION = (
@@ -60,9 +71,17 @@ def _looks_like_ssd_json(text: str) -> bool:
     return "simulation_name" in stripped or '"domain"' in stripped
 
 
-def _run_prompt(model, tokenizer, prompt_text: str, max_new_tokens: int = MAX_NEW_TOKENS) -> str:
-    """Run one prompt and return the decoded response (new tokens only)."""
+def _run_prompt(model, tokenizer, prompt_text: str, max_new_tokens: int = MAX_NEW_TOKENS,
+                early_stop: bool = False) -> tuple[str, int]:
+    """
+    Run one prompt and return the decoded response (new tokens only) and the number of generated tokens.
+    With early_stop, generation ends once the SSD-JSON-vs-prose verdict is decided.
+    """
     inputs = tokenizer(prompt_text, return_tensors="pt").to(model.device)
+    prompt_length = inputs["input_ids"].shape[1]
+    stopping_criteria = None
+    if early_stop:
+        stopping_criteria = StoppingCriteriaList([FormatVerdictStoppingCriteria(tokenizer, prompt_length)])
     output_ids = model.generate(
         **inputs,
         max_new_tokens=max_new_tokens,
@@ -70,10 +89,10 @@ def _run_prompt(model, tokenizer, prompt_text: str, max_new_tokens: int = MAX_NE
         temperature=0.7,
         top_p=0.9,
         pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+        stopping_criteria=stopping_criteria,
     )
-    prompt_length = inputs["input_ids"].shape[1]
     response_ids = output_ids[0][prompt_length:]
-    return tokenizer.decode(response_ids, skip_special_tokens=True).strip()
+    return tokenizer.decode(response_ids, skip_special_tokens=True).strip(), len(response_ids)
 
 
 def main():
@@ -83,25 +102,8 @@ def main():
     if not adapter_path.exists():
         raise FileNotFoundError(f"Adapter path not found: {adapter_path}")
 
-    print("Loading base model (LoRA, 16-bit)...")
-    # Match the training setup: use bfloat16 when available, otherwise float16
-    preferred_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
-    model, tokenizer = FastLanguageModel.from_pretrained(
-        model_name=MODEL_NAME,
-        max_seq_length=MAX_SEQ_LENGTH,
-        dtype=preferred_dtype,
-        load_in_4bit=False,  # standard LoRA (no QLoRA quantization)
-        trust_remote_code=False,
-    )
-
-    print(f"Loading adapter from {adapter_path}...")
-    model = PeftModel.from_pretrained(model, str(adapter_path))
-
-    print("Preparing for inference...")
-    model = FastLanguageModel.for_inference(model)
-
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
+    # Merged snapshot from export_merged.py if present and current, else base + adapter
+    model, tokenizer = load_for_inference(MODEL_NAME, adapter_path, MAX_SEQ_LENGTH)
 
     # ----- Main prompt (expect SSD JSON) -----
     main_prompt = f"{INSTRUCTION}\n\n{INPUT}".strip()
@@ -110,24 +112,34 @@ def main():
     print("=" * 60)
     print(main_prompt)
     print("\n--- Model output ---\n")
-    response = _run_prompt(model, tokenizer, main_prompt)
-    print(response)
+    if SCHEMA_DECODING:
+        response, stats = SchemaGuidedDecoder(model, tokenizer).generate(main_prompt)
+        print(response)
+        print(f"\n[schema decoding: {stats['sampled_tokens']} sampled + {stats['forced_tokens']} forced tokens]")
+    else:
+        response, _ = _run_prompt(model, tokenizer, main_prompt)
+        print(response)
     print()
 
     # ----- Trap prompts (expect natural language; JSON = overfitting) -----
+    trap_tokens = 0
     for i, trap in enumerate(TRAP_PROMPTS, 1):
         print("\n" + "=" * 60)
         print(f"TRAP PROMPT {i} (no instruction) — expect natural language, not JSON")
         print("=" * 60)
         print(trap)
         print("\n--- Model output ---\n")
-        response = _run_prompt(model, tokenizer, trap)
-        print(response)
+        response, num_tokens = _run_prompt(model, tokenizer, trap, early_stop=EARLY_STOP)
+        trap_tokens += num_tokens
+        print(response + (f"  [stopped after {num_tokens} tokens]" if EARLY_STOP else ""))
         overfit = _looks_like_ssd_json(response)
         print("\n--- Format check ---")
         print("FAIL (format overfitting)" if overfit else "PASS (natural language)")
         print()
 
+    print(f"Trap prompts generated {trap_tokens} tokens "
+          f"(budget {len(TRAP_PROMPTS) * MAX_NEW_TOKENS}{', early stop' if EARLY_STOP else ''})")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Schema-guided SSD decoding for Agent 1 inference.
+
+Walks the JSON schema of the SimulationOutput pydantic model (training_dataset/
+agent_1_document_interpreter/ssd_schema.py) while generating:
+
+- Scaffolding is forced, not sampled: braces, keys, ": " / ", " separators and string quotes
+  are appended as tokens in one forward pass (same layout as json.dumps in the training data).
+- The model only samples values: string contents (until it closes the quote), numbers
+  (first token restricted to numeric tokens), and branch decisions such as "another list item
+  or ']'", "value or null" — each decided by comparing the logits of the branches' first tokens.
+- Generation ends when the top-level object closes, so the output always parses and validates
+  against SimulationOutput (no parse failures, no tokens after the closing brace).
+
+    decoder = SchemaGuidedDecoder(model, tokenizer)
+    text, stats = decoder.generate(prompt)
+"""
+
+import json
+import math
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+SCHEMA_DIR = Path(__file__).resolve().parent.parent.parent / "training_dataset" / "agent_1_document_interpreter"
+if str(SCHEMA_DIR) not in sys.path:
+    sys.path.insert(0, str(SCHEMA_DIR))
+from ssd_schema import SimulationOutput  # noqa: E402
+
+# Longest prefix of a JSON number, and characters a number token may contain
+NUMBER_RE = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+INTEGER_RE = re.compile(r"-?(0|[1-9]\d*)")
+NUMBER_CHARS = set("0123456789.-+eE")
+HEX_RE = re.compile(r"[0-9a-fA-F]{4}")
+# Value kinds for Any / Dict[str, Any] entries
+ANY_SCHEMA = {"anyOf": [{"type": "string"}, {"type": "number"}, {"type": "object"}, {"type": "null"}]}
+
+
+class SchemaGuidedDecoder:
+    """Generate one JSON document that follows a (pydantic) JSON schema; batch size 1."""
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        schema: Optional[Dict] = None,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        max_value_tokens: int = 256,
+        max_items: int = 32,
+        max_depth: int = 4,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.schema = schema or SimulationOutput.model_json_schema()
+        self.defs = self.schema.get("$defs", {})
+        self.temperature = temperature
+        self.top_p = top_p
+        self.max_value_tokens = max_value_tokens
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self._start_tokens: Optional[Dict[str, torch.Tensor]] = None
+
+    # ------------------------------------------------------------------ vocab
+
+    def _first_token_sets(self) -> Dict[str, torch.Tensor]:
+        """Token ids grouped by how their text starts (computed once per decoder)."""
+        if self._start_tokens is None:
+            groups = {k: [] for k in ("string", "number", "object", "array", "null", "true", "false", ",", "]", "}", "text")}
+            special = set(self.tokenizer.all_special_ids)
+            for token_id in range(len(self.tokenizer)):
+                if token_id in special:
+                    continue
+                raw = self.tokenizer.decode([token_id])
+                text = raw.lstrip(" ")
+                if not text:
+                    continue
+                # Safe first token of a string value: visible text, no quote/backslash/control chars
+                if not any(c in '"\\' or c < " " for c in raw):
+                    groups["text"].append(token_id)
+                if text[0] == '"':
+                    groups["string"].append(token_id)
+                elif text[0] == "-" or text[0].isdigit():
+                    if all(c in NUMBER_CHARS for c in text):
+                        groups["number"].append(token_id)
+                elif text[0] in "{[,]}":
+                    groups[{"{": "object", "[": "array"}.get(text[0], text[0])].append(token_id)
+                for literal in ("null", "true", "false"):
+                    if literal.startswith(text) or text.startswith(literal):
+                        groups[literal].append(token_id)
+            self._start_tokens = {k: torch.tensor(v or [0], dtype=torch.long) for k, v in groups.items()}
+        return self._start_tokens
+
+    # ------------------------------------------------------------- model I/O
+
+    def _feed(self, ids: List[int]):
+        if not ids:
+            return
+        input_ids = torch.tensor([ids], dtype=torch.long, device=self.model.device)
+        out = self.model(input_ids=input_ids, past_key_values=self.past, use_cache=True)
+        self.past = out.past_key_values
+        self.logits = out.logits[0, -1].float()
+        self.length += len(ids)
+
+    def _emit(self, text: str):
+        """Queue forced scaffolding; it is fed in one forward pass before the next model decision."""
+        self.pending += text
+
+    def _flush(self):
+        if self.pending:
+            ids = self.tokenizer.encode(self.pending, add_special_tokens=False)
+            self._feed(ids)
+            self.stats["forced_tokens"] += len(ids)
+            self.text += self.pending
+            self.pending = ""
+
+    def _rewind(self, length: int):
+        """Drop cached positions after `length` tokens (used to re-feed a cleaned-up value)."""
+        if length < self.length:
+            self.past.crop(length - self.length)
+            self.length = length
+
+    def _sample(self, allowed: Optional[torch.Tensor] = None) -> int:
+        logits = self.logits
+        if allowed is not None:
+            masked = torch.full_like(logits, -math.inf)
+            masked[allowed.to(logits.device)] = logits[allowed.to(logits.device)]
+            logits = masked
+        if self.temperature <= 0:
+            return int(torch.argmax(logits))
+        probs = torch.softmax(logits / self.temperature, dim=-1)
+        sorted_probs, order = torch.sort(probs, descending=True)
+        keep = torch.cumsum(sorted_probs, dim=-1) - sorted_probs < self.top_p
+        sorted_probs = sorted_probs * keep
+        return int(order[torch.multinomial(sorted_probs / sorted_probs.sum(), 1)])
+
+    def _choose(self, options: List[str]) -> str:
+        """Pick one branch by the model's probability mass on each branch's first tokens."""
+        if len(options) == 1:
+            return options[0]
+        self._flush()
+        sets = self._first_token_sets()
+        log_probs = torch.log_softmax(self.logits, dim=-1)
+        scores = torch.stack([torch.logsumexp(log_probs[sets[o].to(log_probs.device)], dim=0) for o in options])
+        self.stats["decisions"] += 1
+        if self.temperature <= 0:
+            return options[int(torch.argmax(scores))]
+        probs = torch.softmax(scores / self.temperature, dim=0)
+        return options[int(torch.multinomial(probs, 1))]
+
+    # ---------------------------------------------------------------- values
+
+    def _free_value(self, terminate, start_allowed: Optional[torch.Tensor] = None) -> str:
+        """
+        Sample tokens until `terminate(text)` returns the final value text (or None to continue).
+        The committed tokens are replaced by the tokenization of the final text if they differ.
+        """
+        self._flush()
+        start_length = self.length
+        ids: List[int] = []
+        text = ""
+        final = None
+        for step in range(self.max_value_tokens):
+            token = self._sample(start_allowed if step == 0 else None)
+            if token == self.tokenizer.eos_token_id:
+                final = terminate(text, force=True)
+                break
+            candidate = self.tokenizer.decode(ids + [token])
+            final = terminate(candidate)
+            if final is not None:
+                break
+            ids.append(token)
+            text = candidate
+            self._feed([token])
+            self.stats["sampled_tokens"] += 1
+        if final is None:
+            final = terminate(text, force=True)
+        if final != text:
+            self._rewind(start_length)
+            self._feed(self.tokenizer.encode(final, add_special_tokens=False))
+        self.text += final
+        return final
+
+    @staticmethod
+    def _escape_stray_backslashes(text: str) -> str:
+        """Double backslashes that do not start a valid JSON escape (e.g. LaTeX "\\alpha" written raw)."""
+        out = []
+        i = 0
+        while i < len(text):
+            if text[i] != "\\":
+                out.append(text[i])
+                i += 1
+            elif i + 1 < len(text) and text[i + 1] in '\\"/bfnrt':
+                out.append(text[i:i + 2])
+                i += 2
+            elif i + 1 < len(text) and text[i + 1] == "u" and HEX_RE.fullmatch(text[i + 2:i + 6]):
+                out.append(text[i:i + 6])
+                i += 6
+            elif i + 1 == len(text):
+                out.append(text[i])  # may be completed by the next token; trimmed if the string is cut
+                i += 1
+            else:
+                out.append("\\\\")
+                i += 1
+        return "".join(out)
+
+    @staticmethod
+    def _string_end(text: str, force: bool = False) -> Optional[str]:
+        """Content of a JSON string up to the first unescaped quote (or control character)."""
+        i = 0
+        while i < len(text):
+            c = text[i]
+            if c == "\\":
+                i += 2
+                continue
+            if c == '"' or c < " ":
+                text = text[:i]
+                break
+            i += 1
+        else:
+            if not force:
+                return None
+        text = SchemaGuidedDecoder._escape_stray_backslashes(text)
+        # Cut-off string: drop a trailing partial escape
+        while text:
+            try:
+                json.loads(f'"{text}"')
+                return text
+            except json.JSONDecodeError:
+                text = text[:-1]
+        return text
+
+    def _string(self):
+        # First token must be visible text: SSD validators reject empty names/domains
+        self._emit('"')
+        self._free_value(self._string_end, start_allowed=self._first_token_sets()["text"])
+        self._emit('"')
+
+    def _number(self, integer: bool = False):
+        pattern = INTEGER_RE if integer else NUMBER_RE
+
+        def _end(text: str, force: bool = False) -> Optional[str]:
+            stripped = text.lstrip(" ")
+            if not force and all(c in NUMBER_CHARS for c in stripped):
+                return None
+            match = pattern.match(stripped)
+            return match.group(0) if match else "0"
+
+        self._free_value(_end, start_allowed=self._first_token_sets()["number"])
+
+    def _object(self, schema: Dict, depth: int):
+        properties = schema.get("properties")
+        self._emit("{")
+        if properties:
+            for i, (key, sub_schema) in enumerate(properties.items()):
+                self._emit((", " if i else "") + json.dumps(key) + ": ")
+                self._value(sub_schema, depth + 1)
+        else:
+            value_schema = schema.get("additionalProperties", True)
+            if value_schema is True or value_schema == {}:
+                value_schema = ANY_SCHEMA
+            for i in range(self.max_items):
+                if self._choose(["string", "}"] if i == 0 else [",", "}"]) == "}":
+                    break
+                if i:
+                    self._emit(", ")
+                self._string()
+                self._emit(": ")
+                self._value(value_schema, depth + 1)
+        self._emit("}")
+
+    def _array(self, schema: Dict, depth: int):
+        item_schema = schema.get("items", ANY_SCHEMA)
+        self._emit("[")
+        for i in range(self.max_items):
+            if i == 0:
+                if self._choose([self._kind(item_schema), "]"]) == "]":
+                    break
+            elif self._choose([",", "]"]) == "]":
+                break
+            else:
+                self._emit(", ")
+            self._value(item_schema, depth + 1)
+        self._emit("]")
+
+    def _resolve(self, schema: Dict) -> Dict:
+        while "$ref" in schema:
+            schema = self.defs[schema["$ref"].split("/")[-1]]
+        return schema
+
+    def _kind(self, schema: Dict) -> str:
+        """First-token group of a (non-union) schema."""
+        schema = self._resolve(schema)
+        kind = schema.get("type")
+        if kind in ("number", "integer"):
+            return "number"
+        if kind == "boolean":
+            return "true"
+        return {"string": "string", "array": "array", "null": "null"}.get(kind, "object")
+
+    def _value(self, schema: Dict, depth: int = 0):
+        schema = self._resolve(schema)
+        branches = schema.get("anyOf") or schema.get("oneOf")
+        if branches:
+            branches = [self._resolve(b) for b in branches]
+            if depth >= self.max_depth:
+                # Deep nesting: only scalar branches
+                branches = [b for b in branches if b.get("type") not in ("object", "array")] or branches
+            kinds = [self._kind(b) for b in branches]
+            schema = branches[kinds.index(self._choose(kinds))]
+
+        kind = schema.get("type")
+        if kind == "string":
+            self._string()
+        elif kind in ("number", "integer"):
+            self._number(integer=kind == "integer")
+        elif kind == "boolean":
+            self._emit(self._choose(["true", "false"]))
+        elif kind == "null":
+            self._emit("null")
+        elif kind == "array":
+            self._array(schema, depth)
+        else:
+            self._object(schema, depth)
+
+    # ------------------------------------------------------------------ API
+
+    @torch.inference_mode()
+    def generate(self, prompt: str) -> Tuple[str, Dict[str, int]]:
+        """Return the generated JSON text and token counts (sampled vs forced)."""
+        self.past = None
+        self.logits = None
+        self.length = 0
+        self.text = ""
+        self.pending = ""
+        self.stats = {"sampled_tokens": 0, "forced_tokens": 0, "decisions": 0}
+        self._feed(self.tokenizer.encode(prompt, add_special_tokens=True))
+        self._value(self.schema)
+        self.text += self.pending  # closing scaffolding needs no forward pass
+        self.pending = ""
+        return self.text, self.stats
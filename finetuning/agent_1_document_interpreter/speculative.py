@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Speculative decoding for Agent 1 SSD generation.
+
+A cheap draft proposes several tokens, and the LoRA model verifies all of them in one forward
+pass. The standard accept/reject rule (accept d with prob min(1, p(d)/q(d)), otherwise resample
+from max(0, p - q)) keeps the output distribution identical to sampling from the target alone.
+With --temperature 0 the output equals plain greedy generate token for token.
+
+Drafts:
+  ngram  prompt lookup over the current sequence, then an n-gram index of the SSD outputs in the
+         training corpus (model1_samples.jsonl). The keys, braces and field order of SSD JSON
+         repeat across samples, so long runs get accepted.
+  model  a small model sharing the tokenizer (e.g. Qwen3-0.6B for Qwen3-4B/8B)
+
+Reports acceptance rate and tokens/sec against plain generate on the same prompt. Uses plain
+transformers + peft (no Unsloth), so it also runs end to end on CPU with tiny models:
+
+    python speculative.py --model unsloth/Qwen3-4B --adapter outputs_lora --draft ngram
+    python speculative.py --model unsloth/Qwen3-4B --adapter outputs_lora --draft model \\
+        --draft-model Qwen/Qwen3-0.6B
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+
+MODEL_NAME = os.environ.get("FINETUNE_MODEL", "unsloth/Qwen3-4B")
+ADAPTER_PATH = os.environ.get("FINETUNE_OUTPUT", "outputs_lora")
+DATA_PATH = os.environ.get("FINETUNE_DATA", "model1_samples.jsonl")
+MAX_NEW_TOKENS = int(os.environ.get("RUN_PROMPT_MAX_TOKENS", "1024"))
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+EVAL_PROMPTS = SCRIPT_DIR / "eval_prompts.jsonl"
+
+
+# ---------------------------------------------------------------------------
+# Drafts
+# ---------------------------------------------------------------------------
+
+class NgramDraft:
+    """
+    Propose the tokens that followed the most recent occurrence of the current suffix:
+    first in the sequence itself (prompt lookup), then in an n-gram index of corpus SSDs.
+    Proposals are deterministic, so q is one-hot.
+    """
+
+    def __init__(self, ngram_size: int = 3, min_ngram: int = 2, num_draft_tokens: int = 8):
+        self.ngram_size = ngram_size
+        self.min_ngram = min_ngram
+        self.num_draft_tokens = num_draft_tokens
+        self.sequences: List[List[int]] = []
+        self.index: Dict[Tuple[int, ...], Tuple[int, int]] = {}
+
+    def add(self, token_ids: List[int]):
+        seq_id = len(self.sequences)
+        self.sequences.append(token_ids)
+        n = self.ngram_size
+        for end in range(n, len(token_ids)):
+            self.index[tuple(token_ids[end - n:end])] = (seq_id, end)
+
+    @classmethod
+    def from_corpus(cls, path: Path, tokenizer, max_samples: int = 1000, **kwargs) -> "NgramDraft":
+        """Index SSD outputs the way train.py renders completions (json.dumps, ensure_ascii=False)."""
+        draft = cls(**kwargs)
+        if not path.exists():
+            print(f"Draft corpus not found: {path} (prompt lookup only)")
+            return draft
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                output = json.loads(line).get("output")
+                if output is None:
+                    continue
+                text = json.dumps(output, ensure_ascii=False) if isinstance(output, dict) else str(output)
+                draft.add(tokenizer.encode(text, add_special_tokens=False))
+                if len(draft.sequences) >= max_samples:
+                    break
+        print(f"Indexed {len(draft.sequences)} corpus SSDs ({len(draft.index):,} {draft.ngram_size}-grams)")
+        return draft
+
+    def propose(self, ids: List[int], vocab_size: int) -> Tuple[List[int], Optional[torch.Tensor]]:
+        k = self.num_draft_tokens
+        # Prompt lookup: latest earlier occurrence of the suffix within the sequence
+        for n in range(self.ngram_size, self.min_ngram - 1, -1):
+            if len(ids) <= n:
+                continue
+            suffix = ids[-n:]
+            for start in range(len(ids) - n - 1, -1, -1):
+                if ids[start:start + n] == suffix:
+                    proposal = ids[start + n:start + n + k]
+                    if proposal:
+                        return proposal, None
+        # Corpus index
+        if len(ids) >= self.ngram_size:
+            hit = self.index.get(tuple(ids[-self.ngram_size:]))
+            if hit is not None:
+                seq_id, end = hit
+                return self.sequences[seq_id][end:end + k], None
+        return [], None
+
+
+class ModelDraft:
+    """Small draft model with its own KV cache, kept in sync with the committed tokens."""
+
+    def __init__(self, model, num_draft_tokens: int = 4, temperature: float = 0.7, top_p: float = 0.9):
+        self.model = model
+        self.num_draft_tokens = num_draft_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.past = None
+        self.cached: List[int] = []
+
+    def reset(self):
+        self.past = None
+        self.cached = []
+
+    def _feed(self, ids: List[int]) -> torch.Tensor:
+        input_ids = torch.tensor([ids], dtype=torch.long, device=self.model.device)
+        out = self.model(input_ids=input_ids, past_key_values=self.past, use_cache=True)
+        self.past = out.past_key_values
+        self.cached.extend(ids)
+        return out.logits[0, -1].float()
+
+    def propose(self, ids: List[int], vocab_size: int) -> Tuple[List[int], Optional[torch.Tensor]]:
+        # Keep the longest cached prefix that still matches, but re-feed at least one token for logits
+        common = 0
+        for a, b in zip(self.cached, ids):
+            if a != b:
+                break
+            common += 1
+        keep = min(common, len(ids) - 1)
+        if self.past is not None and keep < len(self.cached):
+            self.past.crop(keep - len(self.cached))
+            self.cached = self.cached[:keep]
+        logits = self._feed(ids[keep:])
+
+        proposal, q_rows = [], []
+        for step in range(self.num_draft_tokens):
+            q = _distribution(logits, vocab_size, self.temperature, self.top_p)
+            token = int(torch.multinomial(q, 1))
+            proposal.append(token)
+            q_rows.append(q)
+            if step + 1 < self.num_draft_tokens:
+                logits = self._feed([token])
+        return proposal, torch.stack(q_rows)
+
+
+# ---------------------------------------------------------------------------
+# Verification loop
+# ---------------------------------------------------------------------------
+
+def _distribution(logits: torch.Tensor, vocab_size: int, temperature: float, top_p: float) -> torch.Tensor:
+    """Sampling distribution (one-hot argmax when temperature <= 0), truncated to vocab_size."""
+    logits = logits[:vocab_size].float()
+    if temperature <= 0:
+        probs = torch.zeros_like(logits)
+        probs[int(torch.argmax(logits))] = 1.0
+        return probs
+    probs = torch.softmax(logits / temperature, dim=-1)
+    if top_p < 1.0:
+        sorted_probs, order = torch.sort(probs, descending=True)
+        drop = torch.cumsum(sorted_probs, dim=-1) - sorted_probs >= top_p
+        probs[order[drop]] = 0.0
+        probs = probs / probs.sum()
+    return probs
+
+
+@torch.inference_mode()
+def speculative_generate(
+    model,
+    tokenizer,
+    prompt: str,
+    draft,
+    max_new_tokens: int = MAX_NEW_TOKENS,
+    temperature: float = 0.7,
+    top_p: float = 0.9,
+) -> Tuple[str, Dict]:
+    """Generate with draft proposals verified by `model`; returns the response and acceptance/speed stats."""
+    start = time.time()
+    vocab_size = min(model.get_output_embeddings().weight.shape[0], len(tokenizer))
+    eos_ids = {tokenizer.eos_token_id} if tokenizer.eos_token_id is not None else set()
+    ids = tokenizer.encode(prompt, add_special_tokens=True)
+    prompt_length = len(ids)
+    if hasattr(draft, "reset"):
+        draft.reset()
+
+    # Target cache always covers ids[:-1]; the last committed token is fed with the proposals
+    past = None
+    if len(ids) > 1:
+        past = model(input_ids=torch.tensor([ids[:-1]], device=model.device), use_cache=True).past_key_values
+    stats = {"proposed": 0, "accepted": 0, "target_forwards": 0}
+
+    while len(ids) - prompt_length < max_new_tokens:
+        remaining = max_new_tokens - (len(ids) - prompt_length)
+        proposal, q_rows = draft.propose(ids, vocab_size)
+        proposal = proposal[:max(remaining - 1, 0)]
+
+        block = [ids[-1]] + proposal
+        out = model(input_ids=torch.tensor([block], device=model.device), past_key_values=past, use_cache=True)
+        past = out.past_key_values
+        stats["target_forwards"] += 1
+        stats["proposed"] += len(proposal)
+
+        new_tokens = []
+        for i, token in enumerate(proposal):
+            p = _distribution(out.logits[0, i], vocab_size, temperature, top_p)
+            q_token = q_rows[i][token] if q_rows is not None else 1.0
+            if torch.rand(1).item() < min(1.0, float(p[token] / q_token)):
+                new_tokens.append(token)
+                if token in eos_ids:
+                    break
+                continue
+            # Rejected: resample from the residual max(0, p - q)
+            q = q_rows[i] if q_rows is not None else torch.nn.functional.one_hot(
+                torch.tensor(token), vocab_size).float()
+            residual = torch.clamp(p - q.to(p.device), min=0.0)
+            residual = residual / residual.sum() if residual.sum() > 0 else p
+            new_tokens.append(int(torch.multinomial(residual, 1)))
+            break
+        else:
+            # All proposals accepted: one bonus token from the last position
+            p = _distribution(out.logits[0, len(proposal)], vocab_size, temperature, top_p)
+            new_tokens.append(int(torch.multinomial(p, 1)))
+        stats["accepted"] += sum(1 for a, b in zip(new_tokens, proposal) if a == b)
+
+        # Keep the cache for ids[:-1] + accepted part of the block. Only ever crop by a negative count:
+        # transformers 4.x reads crop(n >= 0) as an absolute length, so crop(0) would empty the cache
+        drop = past.get_seq_length() - (len(ids) + len(new_tokens) - 1)
+        if drop > 0:
+            past.crop(-drop)
+        ids.extend(new_tokens)
+        if any(t in eos_ids for t in new_tokens):
+            break
+
+    response_ids = ids[prompt_length:prompt_length + max_new_tokens]
+    if eos_ids:
+        for j, t in enumerate(response_ids):
+            if t in eos_ids:
+                response_ids = response_ids[:j + 1]
+                break
+    elapsed = max(time.time() - start, 1e-9)
+    stats.update({
+        "new_tokens": len(response_ids),
+        "seconds": elapsed,
+        "tokens_per_sec": len(response_ids) / elapsed,
+        "acceptance_rate": stats["accepted"] / stats["proposed"] if stats["proposed"] else 0.0,
+        "tokens_per_forward": len(response_ids) / max(stats["target_forwards"], 1),
+    })
+    return tokenizer.decode(response_ids, skip_special_tokens=True).strip(), stats
+
+
+@torch.inference_mode()
+def plain_generate(model, tokenizer, prompt: str, max_new_tokens: int = MAX_NEW_TOKENS,
+                   temperature: float = 0.7, top_p: float = 0.9) -> Tuple[str, Dict]:
+    """Baseline: model.generate with the same sampling settings."""
+    start = time.time()
+    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    sampling = {"do_sample": True, "temperature": temperature, "top_p": top_p} if temperature > 0 else {"do_sample": False}
+    output_ids = model.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+        **sampling,
+    )
+    response_ids = output_ids[0][inputs["input_ids"].shape[1]:]
+    elapsed = max(time.time() - start, 1e-9)
+    stats = {"new_tokens": len(response_ids), "seconds": elapsed, "tokens_per_sec": len(response_ids) / elapsed}
+    return tokenizer.decode(response_ids, skip_special_tokens=True).strip(), stats
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def _default_prompt() -> str:
+    """First in-domain prompt of the evaluation suite (instruction + input, as in training)."""
+    with open(EVAL_PROMPTS, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("expect") == "ssd_json":
+                return f"{record.get('instruction', '')}\n\n{record.get('input', '')}".strip()
+    raise ValueError(f"No ssd_json prompt in {EVAL_PROMPTS}")
+
+
+def _load(model_name: str, adapter: Optional[str], device: str):
+    dtype = torch.float32 if device == "cpu" else (torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=dtype).to(device)
+    if adapter:
+        from peft import PeftModel
+
+        model = PeftModel.from_pretrained(model, adapter)
+    return model.eval()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speculative decoding for SSD generation")
+    parser.add_argument("--model", type=str, default=MODEL_NAME, help="Base model (or merged snapshot)")
+    parser.add_argument("--adapter", type=str, default=ADAPTER_PATH, help="LoRA adapter ('' for none)")
+    parser.add_argument("--draft", choices=["ngram", "model"], default="ngram")
+    parser.add_argument("--draft-model", type=str, default=None, help="Draft model for --draft model")
+    parser.add_argument("--num-draft-tokens", type=int, default=None, help="Tokens proposed per step (ngram 8, model 4)")
+    parser.add_argument("--corpus", type=str, default=DATA_PATH, help="SSD corpus JSONL for the n-gram draft")
+    parser.add_argument("--prompt", type=str, default=None, help="Prompt text (default: first in-domain eval prompt)")
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--top-p", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=3407)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--skip-baseline", action="store_true", help="Do not run plain generate for comparison")
+    args = parser.parse_args()
+
+    adapter = args.adapter
+    if adapter:
+        adapter_path = Path(adapter)
+        if not adapter_path.is_absolute():
+            adapter_path = SCRIPT_DIR / adapter_path
+        adapter = str(adapter_path) if adapter_path.exists() else None
+        if adapter is None:
+            print(f"Adapter not found: {adapter_path} (running the base model)")
+
+    print(f"Loading {args.model}{' + ' + adapter if adapter else ''} on {args.device}...")
+    model = _load(args.model, adapter, args.device)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    if args.draft == "model":
+        if not args.draft_model:
+            parser.error("--draft model requires --draft-model")
+        print(f"Loading draft model {args.draft_model}...")
+        draft = ModelDraft(_load(args.draft_model, None, args.device), args.num_draft_tokens or 4,
+                           args.temperature, args.top_p)
+    else:
+        corpus = Path(args.corpus)
+        if not corpus.is_absolute():
+            corpus = SCRIPT_DIR.parent.parent / "training_dataset" / "agent_1_document_interpreter" / corpus
+        draft = NgramDraft.from_corpus(corpus, tokenizer, num_draft_tokens=args.num_draft_tokens or 8)
+
+    prompt = args.prompt or _default_prompt()
+
+    torch.manual_seed(args.seed)
+    response, spec = speculative_generate(model, tokenizer, prompt, draft, args.max_new_tokens,
+                                          args.temperature, args.top_p)
+    print("\n--- Speculative output ---\n")
+    print(response)
+    print(f"\nSpeculative ({args.draft} draft): {spec['new_tokens']} tokens in {spec['seconds']:.2f}s "
+          f"({spec['tokens_per_sec']:.1f} tokens/sec), acceptance {spec['acceptance_rate']:.1%} "
+          f"({spec['accepted']}/{spec['proposed']}), {spec['tokens_per_forward']:.2f} tokens per target forward")
+
+    if not args.skip_baseline:
+        torch.manual_seed(args.seed)
+        _, base = plain_generate(model, tokenizer, prompt, args.max_new_tokens, args.temperature, args.top_p)
+        print(f"Plain generate: {base['new_tokens']} tokens in {base['seconds']:.2f}s "
+              f"({base['tokens_per_sec']:.1f} tokens/sec)")
+        print(f"Speedup: {spec['tokens_per_sec'] / max(base['tokens_per_sec'], 1e-9):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
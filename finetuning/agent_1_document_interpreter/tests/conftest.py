@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Scripts in this directory import each other as top-level siblings
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
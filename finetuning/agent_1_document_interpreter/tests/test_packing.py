@@ -0,0 +1,87 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+datasets = pytest.importorskip("datasets")
+
+from packing import PackedCompletionCollator, pack_examples, padding_stats
+
+
+def _example(start, prompt_len, completion_len):
+    ids = list(range(start, start + prompt_len + completion_len))
+    return {"input_ids": ids, "completion_mask": [0] * prompt_len + [1] * completion_len}
+
+
+def _packed_row():
+    # Two examples of 3 and 2 tokens; both start with a completion token
+    return {"input_ids": [10, 11, 12, 20, 21], "completion_mask": [1, 0, 1, 1, 1], "seq_lengths": [3, 2]}
+
+
+def test_pack_examples_fits_every_example_once():
+    examples = [_example(100 * i, 2, n) for i, n in enumerate([4, 1, 3, 2, 5])]
+    examples.append(_example(900, 4, 8))  # longer than a window: truncated to max_length
+    dataset = datasets.Dataset.from_list(examples)
+    packed = pack_examples(dataset, max_length=8)
+
+    windows = packed.to_list()
+    assert all(sum(w["seq_lengths"]) == len(w["input_ids"]) == len(w["completion_mask"]) <= 8 for w in windows)
+    packed_ids = sorted(tok for w in windows for tok in w["input_ids"])
+    expected = sorted(tok for e in examples for tok in e["input_ids"][:8])
+    assert packed_ids == expected
+    # Lengths 8, 7, 6, 5, 4, 3: the 3 joins the 5, so 33 tokens take the minimum ceil(33 / 8) windows
+    assert len(windows) == 5
+    # Each window's completion_mask still lines up with its own examples
+    by_first = {e["input_ids"][0]: e for e in examples}
+    for w in windows:
+        start = 0
+        for length in w["seq_lengths"]:
+            source = by_first[w["input_ids"][start]]
+            assert w["completion_mask"][start:start + length] == source["completion_mask"][:length]
+            start += length
+
+
+def test_block_mask_is_block_diagonal_causal():
+    single = {"input_ids": [30, 31, 32], "completion_mask": [0, 1, 1]}
+    batch = PackedCompletionCollator(pad_token_id=0)([_packed_row(), single])
+
+    allowed = batch["attention_mask"][:, 0] == 0
+    expected = torch.zeros(2, 5, 5, dtype=torch.bool)
+    expected[0, :3, :3] = torch.tril(torch.ones(3, 3, dtype=torch.bool))
+    expected[0, 3:, 3:] = torch.tril(torch.ones(2, 2, dtype=torch.bool))
+    expected[1, :3, :3] = torch.tril(torch.ones(3, 3, dtype=torch.bool))
+    assert torch.equal(allowed, expected)
+    assert batch["attention_mask"].min() == torch.finfo(torch.float32).min
+    assert batch["input_ids"][1].tolist() == [30, 31, 32, 0, 0]
+
+
+def test_labels_mask_prompts_and_each_example_start():
+    batch = PackedCompletionCollator(pad_token_id=0)([_packed_row()])
+    assert batch["labels"][0].tolist() == [-100, -100, 12, -100, 21]
+
+
+def test_position_ids_restart_per_example():
+    batch = PackedCompletionCollator(pad_token_id=0)([_packed_row()])
+    assert batch["position_ids"][0].tolist() == [0, 1, 2, 0, 1]
+
+
+def test_position_ids_mode_flattens_without_padding():
+    single = {"input_ids": [30, 31, 32], "completion_mask": [0, 1, 1]}
+    batch = PackedCompletionCollator(pad_token_id=0, attention="position_ids")([_packed_row(), single])
+    assert set(batch) == {"input_ids", "labels", "position_ids"}
+    assert batch["input_ids"].tolist() == [[10, 11, 12, 20, 21, 30, 31, 32]]
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 0, 1, 0, 1, 2]]
+    assert batch["labels"].tolist() == [[-100, -100, 12, -100, 21, -100, 31, 32]]
+
+
+def test_unpacked_rows_get_a_2d_padding_mask():
+    rows = [{"input_ids": [1, 2, 3], "completion_mask": [0, 1, 1]}, {"input_ids": [4], "completion_mask": [1]}]
+    batch = PackedCompletionCollator(pad_token_id=0)(rows)
+    assert batch["attention_mask"].tolist() == [[1, 1, 1], [1, 0, 0]]
+
+
+def test_padding_stats():
+    stats = padding_stats([4, 4, 4, 4], batch_size=2, packed_lengths=[8, 8])
+    assert stats == {"random": 0.0, "length_grouped": 0.0, "packed": 0.0}
+    # Lengths 1 and 3 always share a random batch of two: 4 real tokens out of 6 computed
+    assert padding_stats([1, 3], batch_size=2)["random"] == pytest.approx(1 / 3)
+    mixed = padding_stats([1, 9, 1, 9, 1, 9, 1, 9], batch_size=2)
+    assert mixed["length_grouped"] == 0.0 and mixed["random"] >= mixed["length_grouped"]
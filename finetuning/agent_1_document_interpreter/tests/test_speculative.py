@@ -0,0 +1,101 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from speculative import ModelDraft, NgramDraft, plain_generate, speculative_generate
+
+WORDS = ['{"simulation_name":', '"domain":', '"parameters":', '"equations":', '"symbol":', '"range":',
+         '[', ']', '{', '}', ',', '"x"', '"y"', '"k"', '0', '1', 'physics', 'pendulum', 'mass', 'spring']
+MAX_NEW_TOKENS = 24
+
+
+def _tiny_tokenizer():
+    vocab = {"<unk>": 0}
+    for word in WORDS:
+        vocab.setdefault(word, len(vocab))
+    vocab["<eos>"] = len(vocab)
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.WhitespaceSplit()
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>", eos_token="<eos>")
+
+
+def _tiny_llama(tokenizer, seed):
+    torch.manual_seed(seed)
+    # <eos> is the last tokenizer id and outside the model's vocab, so both decoders run the full length
+    config = transformers.LlamaConfig(
+        vocab_size=len(tokenizer) - 1, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=2, num_key_value_heads=2, max_position_embeddings=256,
+        bos_token_id=None, eos_token_id=None, pad_token_id=None,
+        initializer_range=0.5,  # sharp logits: greedy choices must not hinge on float near-ties
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+@pytest.fixture(scope="module")
+def setup():
+    tokenizer = _tiny_tokenizer()
+    model = _tiny_llama(tokenizer, seed=0)
+    # Repetitive SSD-like prompt so prompt lookup has n-grams to match
+    prompt = " ".join(WORDS[:14] * 3)
+    expected, _ = plain_generate(model, tokenizer, prompt, max_new_tokens=MAX_NEW_TOKENS, temperature=0)
+    return tokenizer, model, prompt, expected
+
+
+def _check_counters(stats):
+    assert 0 <= stats["accepted"] <= stats["proposed"]
+    assert stats["acceptance_rate"] == pytest.approx(stats["accepted"] / stats["proposed"] if stats["proposed"] else 0.0)
+    assert stats["target_forwards"] >= 1
+    assert stats["new_tokens"] == MAX_NEW_TOKENS
+    # Every forward commits the accepted proposals plus one target token
+    assert stats["new_tokens"] <= stats["accepted"] + stats["target_forwards"]
+    assert stats["tokens_per_forward"] == pytest.approx(stats["new_tokens"] / stats["target_forwards"])
+
+
+def test_ngram_draft_greedy_matches_plain_generate(setup):
+    tokenizer, model, prompt, expected = setup
+    draft = NgramDraft(ngram_size=3, min_ngram=1, num_draft_tokens=4)
+    text, stats = speculative_generate(model, tokenizer, prompt, draft, max_new_tokens=MAX_NEW_TOKENS, temperature=0)
+    assert text == expected
+    assert stats["proposed"] > 0
+    _check_counters(stats)
+
+
+def test_model_draft_greedy_matches_plain_generate(setup):
+    tokenizer, model, prompt, expected = setup
+    draft = ModelDraft(_tiny_llama(tokenizer, seed=1), num_draft_tokens=3, temperature=0)
+    text, stats = speculative_generate(model, tokenizer, prompt, draft, max_new_tokens=MAX_NEW_TOKENS, temperature=0)
+    assert text == expected
+    _check_counters(stats)
+
+
+def test_self_draft_accepts_every_proposal(setup):
+    tokenizer, model, prompt, expected = setup
+    draft = ModelDraft(model, num_draft_tokens=3, temperature=0)
+    text, stats = speculative_generate(model, tokenizer, prompt, draft, max_new_tokens=MAX_NEW_TOKENS, temperature=0)
+    assert text == expected
+    assert stats["proposed"] > 0
+    assert stats["accepted"] == stats["proposed"]
+    assert stats["acceptance_rate"] == 1.0
+    _check_counters(stats)
+
+
+def test_cache_crop_with_transformers_4_semantics(setup, monkeypatch):
+    # transformers 4.x: crop(n) with n >= 0 truncates to n tokens, so crop(0) wipes the prompt KV
+    tokenizer, model, prompt, expected = setup
+    original = transformers.DynamicCache.crop
+
+    def crop_4x(self, max_length):
+        if max_length >= 0:
+            max_length -= self.get_seq_length()
+            if max_length >= 0:
+                return
+        original(self, max_length)
+
+    monkeypatch.setattr(transformers.DynamicCache, "crop", crop_4x)
+    # Self-draft accepts everything, so every step ends with the cache already at the right length
+    draft = ModelDraft(model, num_draft_tokens=3, temperature=0)
+    text, stats = speculative_generate(model, tokenizer, prompt, draft, max_new_tokens=MAX_NEW_TOKENS, temperature=0)
+    assert text == expected
+    assert stats["accepted"] == stats["proposed"]
@@ -3,19 +3,26 @@
 Fine-tune a language model on model1_samples.jsonl using Unsloth + LoRA.
 - Trains only on the OUTPUT (completion); instruction and input are used as context but excluded from loss.
 - Uses 2x V100 GPUs via Distributed Data Parallel (DDP) when launched with torchrun.
+- Optional sequence packing (FINETUNE_PACKING=1) or length-grouped batching
+  (FINETUNE_GROUP_BY_LENGTH=1) to cut compute spent on pad tokens; see packing.py.
 """
 
 import json
 import os
+import time
 from pathlib import Path
+from typing import Optional
 
 import torch
 from unsloth import FastLanguageModel  # import before trl for Unsloth patches
-from datasets import Dataset
+from datasets import Dataset, Features, Value
 from trl import SFTConfig, SFTTrainer
 import wandb
 import weave
 
+from completion_tokenization import tokenize_for_completion_only
+from packing import PackedCompletionCollator, pack_examples, padding_stats
+
 # ---------------------------------------------------------------------------
 # Config (override via env or edit here)
 # ---------------------------------------------------------------------------
@@ -31,19 +38,23 @@ LORA_R = int(os.environ.get("FINETUNE_LORA_R", "16"))
 LORA_ALPHA = int(os.environ.get("FINETUNE_LORA_ALPHA", "16"))
 SAVE_STEPS = int(os.environ.get("FINETUNE_SAVE_STEPS", "200"))
 LOGGING_STEPS = int(os.environ.get("FINETUNE_LOGGING_STEPS", "5"))
-
-
-def load_and_format_dataset(data_path: str):
-    """Load JSONL and convert to HuggingFace Dataset with prompt/completion.
-    Only the completion (output) will be used for loss when completion_only_loss=True.
+# Pack several examples per MAX_SEQ_LENGTH window; attention: "block_mask" (SDPA/eager, V100)
+# or "position_ids" (flash-attention varlen, padding-free)
+PACKING = os.environ.get("FINETUNE_PACKING", "0").lower() in ("1", "true", "yes")
+PACKING_ATTENTION = os.environ.get("FINETUNE_PACKING_ATTENTION", "block_mask")
+# Length-grouped sampler (ignored with packing); opt-in in both trainers because it changes batch composition
+GROUP_BY_LENGTH = os.environ.get("FINETUNE_GROUP_BY_LENGTH", "0").lower() in ("1", "true", "yes")
+# Tokenized dataset cache shared by all launches and DDP ranks ("" disables it); worker count and
+# rank wait time: FINETUNE_TOKENIZE_PROCS / FINETUNE_TOKENIZE_WAIT (completion_tokenization.py)
+TOKENIZED_CACHE_DIR = os.environ.get("FINETUNE_TOKENIZED_CACHE", "tokenized_cache")
+# Rows per Arrow write when streaming the JSONL into a dataset
+LOAD_CHUNK_SIZE = int(os.environ.get("FINETUNE_LOAD_CHUNK_SIZE", "1000"))
+
+
+def _iter_prompt_completion(path: str, mtime: float, size: int):
+    """Yield prompt/completion records one line at a time.
+    mtime/size are unused here but part of gen_kwargs, so an edited file invalidates the Arrow cache.
     """
-    path = Path(data_path)
-    if not path.is_absolute():
-        path = Path(__file__).resolve().parent / path
-    if not path.exists():
-        raise FileNotFoundError(f"Data file not found: {path}")
-
-    rows = []
     with open(path, "r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
@@ -59,40 +70,52 @@ def load_and_format_dataset(data_path: str):
             prompt = f"{instruction}\n\n{inp}".strip()
             # Completion = output only (loss computed here)
             completion = json.dumps(output, ensure_ascii=False) if isinstance(output, dict) else str(output)
-            rows.append({"prompt": prompt, "completion": completion})
-
-    return Dataset.from_list(rows)
+            yield {"prompt": prompt, "completion": completion}
 
 
-def tokenize_for_completion_only(dataset, tokenizer, max_length: int):
-    """Pre-tokenize dataset to input_ids + completion_mask so Unsloth skips formatting_func.
-    Loss will be applied only where completion_mask=1 (output tokens).
-    EOS is appended to each completion so the model learns to output it and stop generation.
+def load_and_format_dataset(data_path: str):
+    """Load JSONL and convert to HuggingFace Dataset with prompt/completion.
+    Only the completion (output) will be used for loss when completion_only_loss=True.
+    Records are streamed straight into an Arrow-backed (memory-mapped) dataset in chunks of
+    LOAD_CHUNK_SIZE, so peak memory does not grow with the corpus size.
     """
-    def _tokenize(example):
-        prompt = example["prompt"]
-        completion = example["completion"]
-        prompt_ids = tokenizer(prompt, truncation=True, max_length=max_length, add_special_tokens=True)["input_ids"]
-        # Append EOS so the model learns to emit it at end of generation
-        full_text = prompt + completion + tokenizer.eos_token
-        full_encoded = tokenizer(full_text, truncation=True, max_length=max_length, add_special_tokens=True)
-        full_ids = full_encoded["input_ids"]
-        prompt_len = len(prompt_ids)
-        if prompt_len > len(full_ids):
-            prompt_len = len(full_ids)
-        elif full_ids[:prompt_len] != prompt_ids:
-            # Boundary mismatch: use prefix length that matches (tokenizer quirk)
-            for i in range(min(prompt_len, len(full_ids)), 0, -1):
-                if full_ids[:i] == prompt_ids[:i]:
-                    prompt_len = i
-                    break
-        completion_mask = [0] * prompt_len + [1] * (len(full_ids) - prompt_len)
-        return {
-            "input_ids": full_ids,
-            "attention_mask": [1] * len(full_ids),
-            "completion_mask": completion_mask,
-        }
-    return dataset.map(_tokenize, remove_columns=dataset.column_names, num_proc=1, desc="Tokenizing")
+    path = Path(data_path)
+    if not path.is_absolute():
+        path = Path(__file__).resolve().parent / path
+    if not path.exists():
+        raise FileNotFoundError(f"Data file not found: {path}")
+
+    stat = path.stat()
+    start = time.time()
+    try:
+        dataset = Dataset.from_generator(
+            _iter_prompt_completion,
+            gen_kwargs={"path": str(path), "mtime": stat.st_mtime, "size": stat.st_size},
+            features=Features({"prompt": Value("string"), "completion": Value("string")}),
+            writer_batch_size=LOAD_CHUNK_SIZE,
+        )
+    except ValueError as e:
+        # datasets refuses to build a split with no rows
+        raise ValueError(f"No valid training samples found in {path}") from e
+    elapsed = max(time.time() - start, 1e-9)
+    # An unchanged file is served from the Arrow cache written by an earlier launch
+    if any(os.path.getmtime(f["filename"]) >= start for f in dataset.cache_files):
+        print(f"Loaded {len(dataset)} records from {path} in {elapsed:.1f}s ({len(dataset) / elapsed:,.0f} records/sec)")
+    else:
+        print(f"Loaded {len(dataset)} records from {path} (Arrow cache)")
+    return dataset
+
+
+# Bump when the tokenized layout changes so stale caches are not reused
+TOKENIZATION_VERSION = "2"
+
+
+def _tokenized_cache_dir() -> Optional[Path]:
+    """TOKENIZED_CACHE_DIR resolved against this directory (None when caching is disabled)."""
+    if not TOKENIZED_CACHE_DIR:
+        return None
+    cache_dir = Path(TOKENIZED_CACHE_DIR)
+    return cache_dir if cache_dir.is_absolute() else Path(__file__).resolve().parent / cache_dir
 
 
 def main():
@@ -136,7 +159,30 @@ def main():
 
     # Pre-tokenize so Unsloth sees input_ids + completion_mask (avoids "must specify formatting_func")
     print("Pre-tokenizing dataset (output-only labels)...")
-    dataset = tokenize_for_completion_only(dataset, tokenizer, MAX_SEQ_LENGTH)
+    dataset = tokenize_for_completion_only(
+        dataset, tokenizer, MAX_SEQ_LENGTH, TOKENIZATION_VERSION, cache_dir=_tokenized_cache_dir()
+    )
+
+    # Padding report: how much of each batch would be pad tokens, before and after packing
+    lengths = [len(ids) for ids in dataset["input_ids"]]
+    real_tokens = sum(lengths)
+    data_collator = None
+    if PACKING:
+        print(f"Packing examples into {MAX_SEQ_LENGTH}-token windows (attention: {PACKING_ATTENTION})...")
+        dataset = pack_examples(dataset, MAX_SEQ_LENGTH)
+        data_collator = PackedCompletionCollator(
+            pad_token_id=tokenizer.pad_token_id,
+            attention=PACKING_ATTENTION,
+            dtype=preferred_dtype,
+        )
+        print(f"Packed {len(lengths)} examples into {len(dataset)} windows")
+    pad_stats = padding_stats(
+        lengths,
+        PER_DEVICE_BATCH_SIZE,
+        packed_lengths=[sum(s) for s in dataset["seq_lengths"]] if PACKING else None,
+    )
+    for mode, ratio in pad_stats.items():
+        print(f"Padding ratio ({mode} batching): {ratio:.1%}")
 
     # Training args: DDP is auto-enabled when torchrun uses >1 GPU
     num_gpus = torch.cuda.device_count()
@@ -167,6 +213,10 @@ def main():
         # Log loss, lr, grad_norm, etc. to Weights & Biases
         report_to=report_to,
         run_name=run_name,
+        group_by_length=GROUP_BY_LENGTH and not PACKING,
+        # Packed rows carry seq_lengths for the collator; don't let TRL re-process them
+        remove_unused_columns=not PACKING,
+        dataset_kwargs={"skip_prepare_dataset": True} if PACKING else None,
     )
 
     # SFTTrainer with prompt+completion dataset → loss only on completion (output)
@@ -175,9 +225,22 @@ def main():
         tokenizer=tokenizer,
         train_dataset=dataset,
         args=training_args,
+        data_collator=data_collator,
     )
 
-    trainer.train()
+    start = time.time()
+    train_result = trainer.train()
+    runtime = train_result.metrics.get("train_runtime", time.time() - start)
+    if PACKING:
+        batching = "packed"
+    elif GROUP_BY_LENGTH:
+        batching = "length_grouped"
+    else:
+        batching = "random"
+    # Real (non-pad) tokens seen per second across all ranks
+    tokens_per_sec = real_tokens * NUM_EPOCHS / runtime if runtime else 0.0
+    print(f"Throughput ({batching} batching): {tokens_per_sec:,.0f} tokens/sec, "
+          f"padding ratio {pad_stats[batching]:.1%}")
     trainer.save_model(output_dir)
     tokenizer.save_pretrained(output_dir)
     print(f"Saved model and tokenizer to {output_dir}")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Calibrate DocumentVerifierRAG match thresholds and fidelity weights against
+labelled verification samples (model2_samples.jsonl style).
+
+Step 1 (slow, once): encode every labelled pair and persist the raw
+source x SSD similarity matrices plus the threshold-independent parameter score.
+
+    python calibrate_thresholds.py cache \
+        --data ../../training_dataset/agent_2_document_verifier/model2_samples.jsonl \
+        --cache similarity_cache.npz
+
+Step 2 (fast, repeatable): sweep threshold/weight combinations over the cached
+matrices and report the ones that best agree with the labelled
+`verification_output` scores.
+
+    python calibrate_thresholds.py sweep --cache similarity_cache.npz --output calibration.json
+
+The sweep minimises the squared error of overall_fidelity. Because the overall
+score is linear in the per-category scores, the error of every
+(weights, equation/assumption/constraint threshold) combination is computed from
+small cross-moment matrices, so the cost does not grow with the number of samples.
+The resulting calibration.json can be passed to run_verification.py --calibration.
+"""
+
+import argparse
+import itertools
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+
+SEMANTIC_FIELDS = ["equations", "assumptions", "constraints"]
+LABEL_KEYS = [
+    "equation_accuracy",
+    "parameter_completeness",
+    "assumption_completeness",
+    "constraint_accuracy",
+    "overall_fidelity",
+]
+
+
+def build_cache(data_path: str, cache_path: str, embedding_model: str = "all-MiniLM-L6-v2"):
+    """Compute and persist similarity matrices and labels for every labelled pair."""
+    from graph_rag import DocumentVerifierRAG
+
+    verifier = DocumentVerifierRAG(embedding_model=embedding_model)
+    arrays: Dict[str, np.ndarray] = {}
+    labels: List[List[float]] = []
+    parameter_scores: List[float] = []
+
+    start = time.time()
+    with open(data_path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                source = record["source_document"]
+                ssd = record.get("ssd_document", record.get("ssd_output", {}))
+                label = record["verification_output"]
+            except (json.JSONDecodeError, KeyError) as e:
+                print(f"Error parsing line {line_num}: {e}")
+                continue
+
+            analysis = verifier.analyze_source_document(source)
+            elements = verifier._extract_ssd_elements(ssd)
+            matrices = verifier.compute_similarity_matrices(analysis, elements)
+
+            idx = len(labels)
+            for field in SEMANTIC_FIELDS:
+                arrays[f"s{idx}_{field}"] = matrices[field].astype(np.float32)
+            param_score, _, _ = verifier._verify_parameters(
+                analysis.extracted_parameters, elements["parameters"], source
+            )
+            parameter_scores.append(param_score)
+            labels.append([float(label.get(k, np.nan)) for k in LABEL_KEYS])
+
+    if not labels:
+        raise ValueError(f"No labelled samples found in {data_path}")
+
+    np.savez_compressed(
+        cache_path,
+        labels=np.asarray(labels, dtype=np.float64),
+        parameter_scores=np.asarray(parameter_scores, dtype=np.float64),
+        **arrays,
+    )
+    print(f"Cached similarity matrices for {len(labels)} samples in {time.time() - start:.1f}s -> {cache_path}")
+
+
+def _category_scores(best: List[np.ndarray], n_other: np.ndarray, thresholds: np.ndarray,
+                     empty_source: float, empty_ssd: float) -> np.ndarray:
+    """
+    Vectorized coverage score per (sample, threshold), mirroring
+    DocumentVerifierRAG._score_assumptions/_score_constraints.
+    """
+    scores = np.empty((len(best), len(thresholds)))
+    for i, row_max in enumerate(best):
+        if len(row_max) == 0:
+            scores[i] = empty_source
+        elif n_other[i] == 0:
+            scores[i] = empty_ssd
+        else:
+            scores[i] = (row_max[None, :] > thresholds[:, None]).mean(axis=1)
+    return scores
+
+
+def _equation_scores(row_best: List[np.ndarray], col_best: List[np.ndarray], thresholds: np.ndarray) -> np.ndarray:
+    """Vectorized mirror of DocumentVerifierRAG._score_equations over thresholds."""
+    scores = np.empty((len(row_best), len(thresholds)))
+    for i, (row_max, col_max) in enumerate(zip(row_best, col_best)):
+        if len(row_max) == 0:
+            scores[i] = 1.0 if len(col_max) == 0 else 0.5
+            continue
+        recall = (row_max[None, :] > thresholds[:, None]).mean(axis=1)
+        precision = (col_max[None, :] > thresholds[:, None]).mean(axis=1) if len(col_max) else 0.0
+        scores[i] = (precision + recall) / 2
+    return scores
+
+
+def _best(similarity: np.ndarray, axis: int) -> np.ndarray:
+    if similarity.shape[axis] == 0:
+        return np.zeros(similarity.shape[1 - axis])
+    return np.maximum(similarity.max(axis=axis), 0)
+
+
+def weight_grid(step: float) -> np.ndarray:
+    """All 4-way weight vectors on the simplex with the given step."""
+    n = int(round(1 / step))
+    combos = [c for c in itertools.product(range(n + 1), repeat=3) if sum(c) <= n]
+    return np.asarray([(a, b, c, n - a - b - c) for a, b, c in combos], dtype=np.float64) / n
+
+
+def sweep(cache_path: str, thresholds: np.ndarray, weights: np.ndarray, top_k: int = 10) -> Dict:
+    """Evaluate every threshold/weight combination against the cached labels."""
+    cache = np.load(cache_path)
+    labels = cache["labels"]
+    params = cache["parameter_scores"]
+    num_samples = len(labels)
+
+    start = time.time()
+    matrices = {field: [cache[f"s{i}_{field}"] for i in range(num_samples)] for field in SEMANTIC_FIELDS}
+    n_ssd = {field: np.asarray([m.shape[1] for m in matrices[field]]) for field in SEMANTIC_FIELDS}
+
+    E = _equation_scores(
+        [_best(m, 1) for m in matrices["equations"]],
+        [_best(m, 0) for m in matrices["equations"]],
+        thresholds,
+    )
+    A = _category_scores([_best(m, 1) for m in matrices["assumptions"]], n_ssd["assumptions"],
+                         thresholds, empty_source=1.0, empty_ssd=0.0)
+    C = _category_scores([_best(m, 1) for m in matrices["constraints"]], n_ssd["constraints"],
+                         thresholds, empty_source=1.0, empty_ssd=0.5)
+    P = params
+
+    # Squared error of overall_fidelity for all (w, te, ta, tc) from cross-moments
+    mask = ~np.isnan(labels[:, 4])
+    y = labels[mask, 4]
+    E_, A_, C_, P_ = E[mask], A[mask], C[mask], P[mask]
+    n = max(len(y), 1)
+
+    w0, w1, w2, w3 = (weights[:, k][:, None, None, None] for k in range(4))
+    EE = (E_ ** 2).sum(0)[None, :, None, None]
+    AA = (A_ ** 2).sum(0)[None, None, :, None]
+    CC = (C_ ** 2).sum(0)[None, None, None, :]
+    PP = (P_ ** 2).sum()
+    EA = (E_.T @ A_)[None, :, :, None]
+    EC = (E_.T @ C_)[None, :, None, :]
+    AC = (A_.T @ C_)[None, None, :, :]
+    EP = (E_.T @ P_)[None, :, None, None]
+    AP = (A_.T @ P_)[None, None, :, None]
+    CP = (C_.T @ P_)[None, None, None, :]
+    Ey = (E_.T @ y)[None, :, None, None]
+    Ay = (A_.T @ y)[None, None, :, None]
+    Cy = (C_.T @ y)[None, None, None, :]
+    Py = P_ @ y
+    yy = y @ y
+
+    sse = (
+        w0 ** 2 * EE + w1 ** 2 * PP + w2 ** 2 * AA + w3 ** 2 * CC
+        + 2 * (w0 * w1 * EP + w0 * w2 * EA + w0 * w3 * EC + w1 * w2 * AP + w1 * w3 * CP + w2 * w3 * AC)
+        - 2 * (w0 * Ey + w1 * Py + w2 * Ay + w3 * Cy)
+        + yy
+    )
+    rmse = np.sqrt(np.maximum(sse, 0) / n)
+    elapsed = time.time() - start
+
+    order = np.argsort(rmse, axis=None)[:top_k]
+    candidates = []
+    for flat in order:
+        wi, te, ta, tc = np.unravel_index(flat, rmse.shape)
+        overall = E[:, te] * weights[wi, 0] + P * weights[wi, 1] + A[:, ta] * weights[wi, 2] + C[:, tc] * weights[wi, 3]
+        candidates.append({
+            "equation_threshold": float(thresholds[te]),
+            "assumption_threshold": float(thresholds[ta]),
+            "constraint_threshold": float(thresholds[tc]),
+            "fidelity_weights": [float(w) for w in weights[wi]],
+            "overall_rmse": float(rmse[wi, te, ta, tc]),
+            "overall_mae": float(np.nanmean(np.abs(overall - labels[:, 4]))),
+            "status_agreement": float(np.mean(_status(overall) == _status(labels[:, 4]))),
+            "category_mae": {
+                "equation_accuracy": float(np.nanmean(np.abs(E[:, te] - labels[:, 0]))),
+                "parameter_completeness": float(np.nanmean(np.abs(P - labels[:, 1]))),
+                "assumption_completeness": float(np.nanmean(np.abs(A[:, ta] - labels[:, 2]))),
+                "constraint_accuracy": float(np.nanmean(np.abs(C[:, tc] - labels[:, 3]))),
+            },
+        })
+
+    return {
+        "num_samples": int(num_samples),
+        "num_combinations": int(rmse.size),
+        "sweep_seconds": elapsed,
+        "best": candidates[0],
+        "top": candidates,
+    }
+
+
+def _status(overall: np.ndarray) -> np.ndarray:
+    """Same buckets as DocumentVerifier.verify_document's overall_status."""
+    return np.where(overall >= 0.9, 2, np.where(overall >= 0.7, 1, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate Agent 2 verifier thresholds and weights")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cache_parser = sub.add_parser("cache", help="Compute and persist similarity matrices for labelled pairs")
+    cache_parser.add_argument("--data", type=str, required=True, help="Labelled JSONL (model2_samples.jsonl style)")
+    cache_parser.add_argument("--cache", type=str, default="similarity_cache.npz", help="Output .npz cache")
+    cache_parser.add_argument("--embedding-model", type=str, default="all-MiniLM-L6-v2")
+
+    sweep_parser = sub.add_parser("sweep", help="Sweep thresholds/weights over cached matrices")
+    sweep_parser.add_argument("--cache", type=str, default="similarity_cache.npz", help="Cache from the cache step")
+    sweep_parser.add_argument("--threshold-min", type=float, default=0.3)
+    sweep_parser.add_argument("--threshold-max", type=float, default=0.95)
+    sweep_parser.add_argument("--threshold-step", type=float, default=0.05)
+    sweep_parser.add_argument("--weight-step", type=float, default=0.1, help="Simplex grid step for the 4 weights")
+    sweep_parser.add_argument("--top-k", type=int, default=10)
+    sweep_parser.add_argument("--output", type=str, default=None, help="Write best calibration JSON here")
+
+    args = parser.parse_args()
+
+    if args.command == "cache":
+        build_cache(args.data, args.cache, args.embedding_model)
+        return
+
+    thresholds = np.round(np.arange(args.threshold_min, args.threshold_max + 1e-9, args.threshold_step), 4)
+    weights = weight_grid(args.weight_step)
+    report = sweep(args.cache, thresholds, weights, top_k=args.top_k)
+
+    print(f"Evaluated {report['num_combinations']:,} combinations over {report['num_samples']} samples "
+          f"in {report['sweep_seconds']:.2f}s")
+    print(f"{'eq_thr':>7} {'as_thr':>7} {'co_thr':>7}  {'weights':<24} {'rmse':>7} {'mae':>7} {'status':>7}")
+    for c in report["top"]:
+        w = "/".join(f"{x:.2f}" for x in c["fidelity_weights"])
+        print(f"{c['equation_threshold']:>7.2f} {c['assumption_threshold']:>7.2f} {c['constraint_threshold']:>7.2f}  "
+              f"{w:<24} {c['overall_rmse']:>7.4f} {c['overall_mae']:>7.4f} {c['status_agreement']:>7.2%}")
+
+    if args.output:
+        best = report["best"]
+        calibration = {k: best[k] for k in
+                       ("equation_threshold", "assumption_threshold", "constraint_threshold", "fidelity_weights")}
+        with open(Path(args.output), "w", encoding="utf-8") as f:
+            json.dump({**calibration, "report": report}, f, indent=2)
+        print(f"Best calibration written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ Checks for:
 import json
 import os
 import re
+from collections import Counter
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 
@@ -55,9 +56,27 @@ class DocumentVerifierRAG:
     
     def __init__(
         self,
-        embedding_model: str = "all-MiniLM-L6-v2"
+        embedding_model: str = "all-MiniLM-L6-v2",
+        equation_threshold: float = 0.7,
+        assumption_threshold: float = 0.6,
+        constraint_threshold: float = 0.6,
+        fidelity_weights: Tuple[float, float, float, float] = (0.4, 0.3, 0.2, 0.1)
     ):
+        """
+        Args:
+            embedding_model: Sentence transformer model for semantic similarity
+            equation_threshold: Cosine similarity above which equations match
+            assumption_threshold: Match threshold for assumptions (more flexible wording)
+            constraint_threshold: Match threshold for constraints
+            fidelity_weights: Overall fidelity weights for
+                (equations, parameters, assumptions, constraints);
+                see calibrate_thresholds.py for tuning these
+        """
         self.embedding_model = SentenceTransformer(embedding_model)
+        self.equation_threshold = equation_threshold
+        self.assumption_threshold = assumption_threshold
+        self.constraint_threshold = constraint_threshold
+        self.fidelity_weights = tuple(fidelity_weights)
         
         # Common physics/engineering patterns
         self.equation_patterns = [
@@ -186,40 +205,82 @@ class DocumentVerifierRAG:
         source_analysis = self.analyze_source_document(source_text)
         
         # Extract from SSD
-        ssd_equations = [eq.get('expression', '') for eq in ssd_document.get('equations', [])]
-        ssd_parameters = [p.get('symbol', '') for p in ssd_document.get('parameters', [])]
-        ssd_assumptions = ssd_document.get('assumptions', [])
-        ssd_constraints = ssd_document.get('constraints', [])
+        ssd_elements = self._extract_ssd_elements(ssd_document)
         
         # Verify equations
         equation_score, missing_eqs, extra_eqs = self._verify_equations(
             source_analysis.extracted_equations,
-            ssd_equations,
+            ssd_elements['equations'],
             source_text
         )
         
         # Verify parameters
         param_score, missing_params, extra_params = self._verify_parameters(
             source_analysis.extracted_parameters,
-            ssd_parameters,
+            ssd_elements['parameters'],
             source_text
         )
         
         # Verify assumptions
         assumption_score, missing_assumptions = self._verify_assumptions(
             source_analysis.extracted_assumptions,
-            ssd_assumptions
+            ssd_elements['assumptions']
         )
         
         # Verify constraints
         constraint_score, missing_constraints = self._verify_constraints(
             source_analysis.extracted_constraints,
-            ssd_constraints
+            ssd_elements['constraints']
         )
         
+        return self._combine_scores(
+            (equation_score, missing_eqs, extra_eqs),
+            (param_score, missing_params, extra_params),
+            (assumption_score, missing_assumptions),
+            (constraint_score, missing_constraints)
+        )
+    
+    def create_session(self, source_text: str, ssd_document: Dict) -> "VerificationSession":
+        """Start an incremental verification session for one source document."""
+        return VerificationSession(self, source_text, ssd_document)
+    
+    @staticmethod
+    def _extract_ssd_elements(ssd_document: Dict) -> Dict[str, List[str]]:
+        """Pull the verifiable element lists out of an SSD document."""
+        return {
+            'equations': [eq.get('expression', '') for eq in ssd_document.get('equations', [])],
+            'parameters': [p.get('symbol', '') for p in ssd_document.get('parameters', [])],
+            'assumptions': list(ssd_document.get('assumptions', [])),
+            'constraints': list(ssd_document.get('constraints', []) or []),
+        }
+    
+    def compute_similarity_matrices(
+        self,
+        source_analysis: DocumentAnalysis,
+        ssd_elements: Dict[str, List[str]]
+    ) -> Dict[str, np.ndarray]:
+        """Raw source x SSD cosine similarity matrices for the semantically matched categories."""
+        source_items = {
+            'equations': source_analysis.extracted_equations,
+            'assumptions': source_analysis.extracted_assumptions,
+            'constraints': source_analysis.extracted_constraints,
+        }
+        return {
+            field: self._cosine_similarity_matrix(self._encode(items), self._encode(ssd_elements[field]))
+            for field, items in source_items.items()
+        }
+    
+    def _combine_scores(self, equations, parameters, assumptions, constraints) -> VerificationResult:
+        """Weight per-category scores into a VerificationResult."""
+        equation_score, missing_eqs, extra_eqs = equations
+        param_score, missing_params, extra_params = parameters
+        assumption_score, missing_assumptions = assumptions
+        constraint_score, missing_constraints = constraints
+        
         # Calculate overall fidelity
-        overall = (equation_score * 0.4 + param_score * 0.3 + 
-                  assumption_score * 0.2 + constraint_score * 0.1)
+        w_eq, w_param, w_assumption, w_constraint = self.fidelity_weights
+        overall = (equation_score * w_eq + param_score * w_param + 
+                  assumption_score * w_assumption + constraint_score * w_constraint)
         
         missing = missing_eqs + missing_params + missing_assumptions + missing_constraints
         extra = extra_eqs + extra_params
@@ -234,6 +295,29 @@ class DocumentVerifierRAG:
             overall_fidelity=overall
         )
     
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts into a 2-D embedding array (shape (0, dim) when empty)."""
+        if not texts:
+            dim = self.embedding_model.get_sentence_embedding_dimension()
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.asarray(self.embedding_model.encode(texts))
+    
+    @staticmethod
+    def _cosine_similarity_matrix(source_embeddings: np.ndarray, ssd_embeddings: np.ndarray) -> np.ndarray:
+        """Pairwise cosine similarity, rows = source elements, columns = SSD elements."""
+        src_norms = np.linalg.norm(source_embeddings, axis=1, keepdims=True)
+        ssd_norms = np.linalg.norm(ssd_embeddings, axis=1, keepdims=True)
+        src = source_embeddings / np.where(src_norms == 0, 1, src_norms)
+        ssd = ssd_embeddings / np.where(ssd_norms == 0, 1, ssd_norms)
+        return src @ ssd.T
+    
+    @staticmethod
+    def _best_matches(similarity: np.ndarray, axis: int) -> np.ndarray:
+        """Best similarity per row (axis=1) or column (axis=0), 0 where there is nothing to match."""
+        if similarity.shape[axis] == 0:
+            return np.zeros(similarity.shape[1 - axis])
+        return np.maximum(similarity.max(axis=axis), 0)
+    
     def _verify_equations(
         self,
         source_equations: List[str],
@@ -241,50 +325,44 @@ class DocumentVerifierRAG:
         source_text: str
     ) -> Tuple[float, List[str], List[str]]:
         """Verify equation fidelity using semantic similarity."""
-        missing = []
-        extra = []
-        
         if not source_equations and not ssd_equations:
             return 1.0, [], []
         
         if not source_equations:
             # No equations in source but SSD has them - likely hallucinated
-            extra = [f"Equation: {eq}" for eq in ssd_equations]
-            return 0.5, [], extra
+            return self._score_equations(None, source_equations, ssd_equations)
         
         # Encode equations
-        source_embeddings = self.embedding_model.encode(source_equations)
-        ssd_embeddings = self.embedding_model.encode(ssd_equations)
+        similarity = self._cosine_similarity_matrix(
+            self._encode(source_equations),
+            self._encode(ssd_equations)
+        )
+        return self._score_equations(similarity, source_equations, ssd_equations)
+    
+    def _score_equations(
+        self,
+        similarity: Optional[np.ndarray],
+        source_equations: List[str],
+        ssd_equations: List[str]
+    ) -> Tuple[float, List[str], List[str]]:
+        """Score equations from a precomputed source x SSD similarity matrix."""
+        if not source_equations and not ssd_equations:
+            return 1.0, [], []
+        
+        if not source_equations:
+            return 0.5, [], [f"Equation: {eq}" for eq in ssd_equations]
         
         # Check coverage: are all source equations in SSD?
-        matched_source = 0
-        for i, src_emb in enumerate(source_embeddings):
-            max_sim = 0
-            for ssd_emb in ssd_embeddings:
-                sim = np.dot(src_emb, ssd_emb) / (np.linalg.norm(src_emb) * np.linalg.norm(ssd_emb))
-                max_sim = max(max_sim, sim)
-            
-            if max_sim > 0.7:  # threshold for match
-                matched_source += 1
-            else:
-                missing.append(f"Equation: {source_equations[i]}")
+        source_matched = self._best_matches(similarity, axis=1) > self.equation_threshold
+        missing = [f"Equation: {eq}" for eq, ok in zip(source_equations, source_matched) if not ok]
         
         # Check for hallucinations: are there SSD equations not in source?
-        matched_ssd = 0
-        for j, ssd_emb in enumerate(ssd_embeddings):
-            max_sim = 0
-            for src_emb in source_embeddings:
-                sim = np.dot(src_emb, ssd_emb) / (np.linalg.norm(src_emb) * np.linalg.norm(ssd_emb))
-                max_sim = max(max_sim, sim)
-            
-            if max_sim > 0.7:
-                matched_ssd += 1
-            else:
-                extra.append(f"Equation: {ssd_equations[j]}")
+        ssd_matched = self._best_matches(similarity, axis=0) > self.equation_threshold
+        extra = [f"Equation: {eq}" for eq, ok in zip(ssd_equations, ssd_matched) if not ok]
         
         # Score: average of precision and recall
-        precision = matched_ssd / len(ssd_equations) if ssd_equations else 0
-        recall = matched_source / len(source_equations) if source_equations else 0
+        precision = int(ssd_matched.sum()) / len(ssd_equations) if ssd_equations else 0
+        recall = int(source_matched.sum()) / len(source_equations)
         score = (precision + recall) / 2
         
         return score, missing, extra
@@ -337,32 +415,33 @@ class DocumentVerifierRAG:
         ssd_assumptions: List[str]
     ) -> Tuple[float, List[str]]:
         """Verify assumption completeness using semantic similarity."""
-        missing = []
+        if not source_assumptions or not ssd_assumptions:
+            return self._score_assumptions(None, source_assumptions, ssd_assumptions)
         
+        # Encode assumptions
+        similarity = self._cosine_similarity_matrix(
+            self._encode(source_assumptions),
+            self._encode(ssd_assumptions)
+        )
+        return self._score_assumptions(similarity, source_assumptions, ssd_assumptions)
+    
+    def _score_assumptions(
+        self,
+        similarity: Optional[np.ndarray],
+        source_assumptions: List[str],
+        ssd_assumptions: List[str]
+    ) -> Tuple[float, List[str]]:
+        """Score assumptions from a precomputed source x SSD similarity matrix."""
         if not source_assumptions:
             return 1.0, []
         
         if not ssd_assumptions:
             return 0.0, [f"Assumption: {a}" for a in source_assumptions]
         
-        # Encode assumptions
-        source_embeddings = self.embedding_model.encode(source_assumptions)
-        ssd_embeddings = self.embedding_model.encode(ssd_assumptions)
-        
-        # Check if each source assumption is captured in SSD
-        matched = 0
-        for i, src_emb in enumerate(source_embeddings):
-            max_sim = 0
-            for ssd_emb in ssd_embeddings:
-                sim = np.dot(src_emb, ssd_emb) / (np.linalg.norm(src_emb) * np.linalg.norm(ssd_emb))
-                max_sim = max(max_sim, sim)
-            
-            if max_sim > 0.6:  # lower threshold for assumptions (more flexible wording)
-                matched += 1
-            else:
-                missing.append(f"Assumption: {source_assumptions[i]}")
+        matched = self._best_matches(similarity, axis=1) > self.assumption_threshold
+        missing = [f"Assumption: {a}" for a, ok in zip(source_assumptions, matched) if not ok]
         
-        score = matched / len(source_assumptions) if source_assumptions else 1.0
+        score = int(matched.sum()) / len(source_assumptions)
         return score, missing
     
     def _verify_constraints(
@@ -371,35 +450,197 @@ class DocumentVerifierRAG:
         ssd_constraints: List[str]
     ) -> Tuple[float, List[str]]:
         """Verify constraint identification."""
-        missing = []
+        if not source_constraints or not ssd_constraints:
+            return self._score_constraints(None, source_constraints, ssd_constraints)
         
+        # Encode constraints
+        similarity = self._cosine_similarity_matrix(
+            self._encode(source_constraints),
+            self._encode(ssd_constraints)
+        )
+        return self._score_constraints(similarity, source_constraints, ssd_constraints)
+    
+    def _score_constraints(
+        self,
+        similarity: Optional[np.ndarray],
+        source_constraints: List[str],
+        ssd_constraints: List[str]
+    ) -> Tuple[float, List[str]]:
+        """Score constraints from a precomputed source x SSD similarity matrix."""
         if not source_constraints:
             return 1.0, []
         
         if not ssd_constraints:
             return 0.5, [f"Constraint: {c}" for c in source_constraints]
         
-        # Encode constraints
-        source_embeddings = self.embedding_model.encode(source_constraints)
-        ssd_embeddings = self.embedding_model.encode(ssd_constraints)
-        
-        # Check if each source constraint is in SSD
-        matched = 0
-        for i, src_emb in enumerate(source_embeddings):
-            max_sim = 0
-            for ssd_emb in ssd_embeddings:
-                sim = np.dot(src_emb, ssd_emb) / (np.linalg.norm(src_emb) * np.linalg.norm(ssd_emb))
-                max_sim = max(max_sim, sim)
-            
-            if max_sim > 0.6:
-                matched += 1
-            else:
-                missing.append(f"Constraint: {source_constraints[i]}")
+        matched = self._best_matches(similarity, axis=1) > self.constraint_threshold
+        missing = [f"Constraint: {c}" for c, ok in zip(source_constraints, matched) if not ok]
         
-        score = matched / len(source_constraints) if source_constraints else 1.0
+        score = int(matched.sum()) / len(source_constraints)
         return score, missing
 
 
+class VerificationSession:
+    """
+    Incremental verification of one source document against an evolving SSD.
+    
+    The source analysis, source embeddings and the source x SSD similarity
+    matrices are kept between calls. Applying an SSD diff only encodes the
+    added elements and only touches the affected matrix columns, so
+    re-verifying a small patch does not re-run the whole pipeline.
+    
+    Diffs have the form::
+    
+        {
+            "equations": {"added": ["F = m*a"], "removed": ["F = m*g"]},
+            "parameters": {"added": ["m"]},
+            "assumptions": {"removed": ["No friction"]},
+            "constraints": {...}
+        }
+    
+    Equations and parameters may be given as SSD dicts ({"expression": ...},
+    {"symbol": ...}) or as plain strings. apply_diff keeps the surviving elements
+    in order and appends the added ones; update() puts every field in the order of
+    the new document, so its result matches verify_ssd_fidelity on that document.
+    """
+    
+    SEMANTIC_FIELDS = ('equations', 'assumptions', 'constraints')
+    FIELDS = ('equations', 'parameters', 'assumptions', 'constraints')
+    
+    def __init__(self, verifier: DocumentVerifierRAG, source_text: str, ssd_document: Dict):
+        self.verifier = verifier
+        self.source_text = source_text
+        self.source_analysis = verifier.analyze_source_document(source_text)
+        
+        self._source_items = {
+            'equations': self.source_analysis.extracted_equations,
+            'assumptions': self.source_analysis.extracted_assumptions,
+            'constraints': self.source_analysis.extracted_constraints,
+        }
+        # Cache of text -> embedding, so re-adding a removed element is free
+        self._embedding_cache: Dict[str, np.ndarray] = {}
+        self._source_embeddings = {
+            field: self._embed(items) for field, items in self._source_items.items()
+        }
+        
+        self.ssd_items: Dict[str, List[str]] = {field: [] for field in self.FIELDS}
+        self._similarity = {
+            field: np.zeros((len(self._source_items[field]), 0))
+            for field in self.SEMANTIC_FIELDS
+        }
+        self._scores: Dict[str, tuple] = {}
+        
+        initial = DocumentVerifierRAG._extract_ssd_elements(ssd_document)
+        self.apply_diff({field: {'added': items} for field, items in initial.items()})
+    
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Encode only texts that have not been seen in this session."""
+        new_texts = list(dict.fromkeys(t for t in texts if t not in self._embedding_cache))
+        if new_texts:
+            for text, emb in zip(new_texts, self.verifier._encode(new_texts)):
+                self._embedding_cache[text] = emb
+        if not texts:
+            return self.verifier._encode([])
+        return np.stack([self._embedding_cache[t] for t in texts])
+    
+    @staticmethod
+    def _normalize_items(field: str, items) -> List[str]:
+        """Accept SSD-style dicts or plain strings for a diff entry."""
+        key = {'equations': 'expression', 'parameters': 'symbol'}.get(field)
+        return [item.get(key, '') if key and isinstance(item, dict) else item for item in items or []]
+    
+    def apply_diff(self, diff: Dict[str, Dict[str, List]]) -> VerificationResult:
+        """Apply added/removed SSD elements and return the updated verification result."""
+        self._apply(diff)
+        return self.result()
+    
+    def _apply(self, diff: Dict[str, Dict[str, List]]):
+        for field, changes in diff.items():
+            if field not in self.FIELDS:
+                raise ValueError(f"Unknown SSD field in diff: {field}")
+            removed = self._normalize_items(field, changes.get('removed'))
+            added = self._normalize_items(field, changes.get('added'))
+            if not removed and not added:
+                continue
+            
+            items = self.ssd_items[field]
+            keep = list(range(len(items)))
+            for item in removed:
+                for pos, idx in enumerate(keep):
+                    if items[idx] == item:
+                        del keep[pos]
+                        break
+                else:
+                    raise ValueError(f"Cannot remove {field[:-1]} not present in SSD: {item!r}")
+            self.ssd_items[field] = [items[idx] for idx in keep] + added
+            
+            if field in self._similarity:
+                new_columns = DocumentVerifierRAG._cosine_similarity_matrix(
+                    self._source_embeddings[field],
+                    self._embed(added)
+                )
+                self._similarity[field] = np.hstack([self._similarity[field][:, keep], new_columns])
+            
+            self._scores.pop(field, None)
+    
+    def _reorder(self, field: str, order: List[str]):
+        """Rearrange a field's SSD elements (and similarity columns) into order, a permutation of them."""
+        items = self.ssd_items[field]
+        if items == order:
+            return
+        positions: Dict[str, List[int]] = {}
+        for idx, item in enumerate(items):
+            positions.setdefault(item, []).append(idx)
+        permutation = [positions[item].pop(0) for item in order]
+        self.ssd_items[field] = list(order)
+        if field in self._similarity:
+            self._similarity[field] = self._similarity[field][:, permutation]
+        self._scores.pop(field, None)
+    
+    def update(self, ssd_document: Dict) -> VerificationResult:
+        """Diff a full (patched) SSD document against the session state and apply it."""
+        new_items = DocumentVerifierRAG._extract_ssd_elements(ssd_document)
+        diff = {}
+        for field in self.FIELDS:
+            old_counts = Counter(self.ssd_items[field])
+            new_counts = Counter(new_items[field])
+            removed = list((old_counts - new_counts).elements())
+            added = list((new_counts - old_counts).elements())
+            if removed or added:
+                diff[field] = {'added': added, 'removed': removed}
+        self._apply(diff)
+        # Missing/extra lists follow SSD order, as in a full verify_ssd_fidelity call
+        for field in self.FIELDS:
+            self._reorder(field, new_items[field])
+        return self.result()
+    
+    def result(self) -> VerificationResult:
+        """Current verification result; only re-scores fields changed since the last call."""
+        verifier = self.verifier
+        if 'equations' not in self._scores:
+            self._scores['equations'] = verifier._score_equations(
+                self._similarity['equations'], self._source_items['equations'], self.ssd_items['equations']
+            )
+        if 'parameters' not in self._scores:
+            self._scores['parameters'] = verifier._verify_parameters(
+                self.source_analysis.extracted_parameters, self.ssd_items['parameters'], self.source_text
+            )
+        if 'assumptions' not in self._scores:
+            self._scores['assumptions'] = verifier._score_assumptions(
+                self._similarity['assumptions'], self._source_items['assumptions'], self.ssd_items['assumptions']
+            )
+        if 'constraints' not in self._scores:
+            self._scores['constraints'] = verifier._score_constraints(
+                self._similarity['constraints'], self._source_items['constraints'], self.ssd_items['constraints']
+            )
+        return verifier._combine_scores(
+            self._scores['equations'],
+            self._scores['parameters'],
+            self._scores['assumptions'],
+            self._scores['constraints']
+        )
+
+
 if __name__ == "__main__":
     # Test the Document Verifier RAG system
     verifier = DocumentVerifierRAG()
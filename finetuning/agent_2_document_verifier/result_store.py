@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Columnar storage for Agent 2 verification results.
+
+`batch_verify` normally writes one JSON object per line, echoing the full
+source and SSD documents. For large runs this store keeps the scalar fidelity
+scores in NumPy `.npy` column segments that can be memory-mapped directly, and
+moves everything variable-length (documents, missing/extra element lists, LLM
+output) into a single append-only blob indexed by byte offsets.
+
+Layout of an output directory:
+    manifest.json               columns, dtypes, status labels, segment row counts
+    segments/00000/<col>.npy    one array per column per segment
+    documents.bin               concatenated UTF-8 JSON records (see blob_offset/blob_length)
+
+Usage:
+    reader = ColumnarResultReader("verification_results")
+    scores = reader.column("overall_fidelity")      # no JSON parsing
+    print(np.percentile(scores, [5, 50, 95]))
+    record = reader.record(42)                      # full record for one row
+"""
+
+import json
+import mmap
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+SCORE_COLUMNS = [
+    "equation_accuracy",
+    "parameter_completeness",
+    "assumption_completeness",
+    "constraint_accuracy",
+    "overall_fidelity",
+]
+
+STATUS_LABELS = ["high_fidelity", "acceptable", "needs_review"]
+
+COLUMN_DTYPES = {
+    **{name: "float32" for name in SCORE_COLUMNS},
+    "status": "uint8",
+    "missing_count": "int32",
+    "extra_count": "int32",
+    "line_num": "int64",
+    "blob_offset": "int64",
+    "blob_length": "int64",
+}
+
+MANIFEST_NAME = "manifest.json"
+BLOB_NAME = "documents.bin"
+
+
+class ColumnarResultWriter:
+    """
+    Append verification results (as produced by DocumentVerifier.verify_document)
+    to a columnar result directory.
+
+    Rows are buffered in memory and written as one `.npy` file per column every
+    `segment_size` rows and on close(). The manifest is rewritten after every
+    segment, so a crashed run leaves all completed segments readable.
+
+    Like opening a JSONL file with 'w', an existing result directory is cleared
+    first; append=True continues after the rows it already holds instead.
+    """
+
+    def __init__(self, output_dir: str, segment_size: int = 65536, append: bool = False):
+        self.output_dir = Path(output_dir)
+        self.segment_size = segment_size
+        manifest_path = self.output_dir / MANIFEST_NAME
+        if not append:
+            # Only the files this writer owns; anything else in the directory is left alone
+            manifest_path.unlink(missing_ok=True)
+            (self.output_dir / BLOB_NAME).unlink(missing_ok=True)
+            shutil.rmtree(self.output_dir / "segments", ignore_errors=True)
+        (self.output_dir / "segments").mkdir(parents=True, exist_ok=True)
+
+        if manifest_path.exists():
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {
+                "columns": COLUMN_DTYPES,
+                "status_labels": STATUS_LABELS,
+                "segments": [],
+                "num_rows": 0,
+            }
+
+        # Truncate the blob to what the manifest knows about (drops a torn tail)
+        self._blob = open(self.output_dir / BLOB_NAME, "ab+")
+        self._blob.truncate(self.manifest.get("blob_bytes", 0))
+        self._blob.seek(0, 2)
+        self._buffer: Dict[str, List] = {name: [] for name in COLUMN_DTYPES}
+
+    def write(self, result: Dict, line_num: int = -1):
+        """Add one verification result."""
+        fidelity = result["fidelity_verification"]
+        missing = fidelity.get("missing_elements", [])
+        extra = fidelity.get("extra_elements", [])
+
+        payload = json.dumps({
+            "source_document": result.get("source_document"),
+            "ssd_document": result.get("ssd_document"),
+            "source_analysis": result.get("source_analysis"),
+            "llm_verification": result.get("llm_verification"),
+            "missing_elements": missing,
+            "extra_elements": extra,
+        }, ensure_ascii=False).encode("utf-8")
+        offset = self._blob.tell()
+        self._blob.write(payload)
+
+        for name in SCORE_COLUMNS:
+            self._buffer[name].append(fidelity[name])
+        self._buffer["status"].append(STATUS_LABELS.index(result["overall_status"]))
+        self._buffer["missing_count"].append(len(missing))
+        self._buffer["extra_count"].append(len(extra))
+        self._buffer["line_num"].append(line_num)
+        self._buffer["blob_offset"].append(offset)
+        self._buffer["blob_length"].append(len(payload))
+
+        if len(self._buffer["line_num"]) >= self.segment_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows as a new segment and update the manifest."""
+        num_rows = len(self._buffer["line_num"])
+        if num_rows == 0:
+            return
+
+        self._blob.flush()
+        segment_name = f"{len(self.manifest['segments']):05d}"
+        segment_dir = self.output_dir / "segments" / segment_name
+        segment_dir.mkdir(parents=True, exist_ok=True)
+        for name, dtype in COLUMN_DTYPES.items():
+            np.save(segment_dir / f"{name}.npy", np.asarray(self._buffer[name], dtype=dtype))
+            self._buffer[name] = []
+
+        self.manifest["segments"].append({"name": segment_name, "num_rows": num_rows})
+        self.manifest["num_rows"] += num_rows
+        self.manifest["blob_bytes"] = self._blob.tell()
+
+        tmp_path = self.output_dir / (MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        tmp_path.replace(self.output_dir / MANIFEST_NAME)
+
+    def close(self):
+        self.flush()
+        self._blob.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ColumnarResultReader:
+    """Memory-mapped read access to a directory written by ColumnarResultWriter."""
+
+    def __init__(self, output_dir: str):
+        self.output_dir = Path(output_dir)
+        with open(self.output_dir / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self._blob: Optional[mmap.mmap] = None
+
+    def __len__(self) -> int:
+        return self.manifest["num_rows"]
+
+    def segments(self, name: str) -> List[np.ndarray]:
+        """Memory-mapped arrays for one column, one per segment."""
+        if name not in self.manifest["columns"]:
+            raise KeyError(f"Unknown column: {name}")
+        return [
+            np.load(self.output_dir / "segments" / seg["name"] / f"{name}.npy", mmap_mode="r")
+            for seg in self.manifest["segments"]
+        ]
+
+    def column(self, name: str) -> np.ndarray:
+        """Whole column as one array (a view when there is a single segment)."""
+        parts = self.segments(name)
+        if not parts:
+            return np.zeros(0, dtype=self.manifest["columns"][name])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def status_labels(self) -> np.ndarray:
+        """Decoded overall_status per row."""
+        return np.asarray(self.manifest["status_labels"])[self.column("status")]
+
+    def record(self, index: int) -> Dict:
+        """Full variable-length record (documents, missing/extra lists) for one row."""
+        if self._blob is None:
+            with open(self.output_dir / BLOB_NAME, "rb") as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for seg in self.manifest["segments"]:
+            if index < seg["num_rows"]:
+                seg_dir = self.output_dir / "segments" / seg["name"]
+                offset = int(np.load(seg_dir / "blob_offset.npy", mmap_mode="r")[index])
+                length = int(np.load(seg_dir / "blob_length.npy", mmap_mode="r")[index])
+                return json.loads(self._blob[offset:offset + length].decode("utf-8"))
+            index -= seg["num_rows"]
+        raise IndexError("record index out of range")
@@ -7,12 +7,23 @@ verifies that the SSD accurately represents the source.
 
 import json
 import argparse
+import sys
+import time
 from pathlib import Path
 from typing import Dict, Optional
 
 import torch
 from unsloth import FastLanguageModel
 from graph_rag import DocumentVerifierRAG
+from result_store import ColumnarResultWriter
+
+# Merged snapshots are written and validated by agent 1's export_merged.py
+EXPORT_DIR = Path(__file__).resolve().parent.parent / "agent_1_document_interpreter"
+if str(EXPORT_DIR) not in sys.path:
+    sys.path.insert(0, str(EXPORT_DIR))
+from export_merged import find_merged_snapshot
+
+CALIBRATION_KEYS = ("equation_threshold", "assumption_threshold", "constraint_threshold", "fidelity_weights")
 
 
 class DocumentVerifier:
@@ -25,7 +36,9 @@ class DocumentVerifier:
         self,
         model_path: str,
         embedding_model: str = "all-MiniLM-L6-v2",
-        max_seq_length: int = 8192
+        max_seq_length: int = 8192,
+        calibration: Optional[Dict] = None,
+        use_merged: bool = True
     ):
         """
         Initialize the document verifier.
@@ -34,19 +47,26 @@ class DocumentVerifier:
             model_path: Path to finetuned verification model
             embedding_model: Sentence transformer model for semantic similarity
             max_seq_length: Maximum sequence length for model
+            calibration: Optional thresholds/weights from calibrate_thresholds.py
+            use_merged: Load the merged snapshot from export_merged.py when it is current
         """
-        print(f"Loading verification model from {model_path}")
+        start = time.time()
+        snapshot = find_merged_snapshot(Path(model_path)) if use_merged else None
+        print(f"Loading verification model from {snapshot or model_path}")
         self.model, self.tokenizer = FastLanguageModel.from_pretrained(
-            model_name=model_path,
+            model_name=str(snapshot or model_path),
             max_seq_length=max_seq_length,
             dtype=None,
             load_in_4bit=True,
         )
         FastLanguageModel.for_inference(self.model)
+        print(f"Model ready in {time.time() - start:.1f}s ({'merged snapshot' if snapshot else 'base + adapter'})")
         
         print("Initializing Document Verifier RAG system")
+        calibration = calibration or {}
         self.graph_rag = DocumentVerifierRAG(
-            embedding_model=embedding_model
+            embedding_model=embedding_model,
+            **{k: calibration[k] for k in CALIBRATION_KEYS if k in calibration}
         )
     
     def verify_document(self, source_document: str, ssd_document: Dict) -> Dict:
@@ -149,7 +169,9 @@ Verify that the generated SSD accurately represents the source document. Check t
                 "parameter_completeness": fidelity_result.parameter_completeness,
                 "assumption_completeness": fidelity_result.assumption_completeness,
                 "constraint_accuracy": fidelity_result.constraint_accuracy,
-                "overall_fidelity": fidelity_result.overall_fidelity
+                "overall_fidelity": fidelity_result.overall_fidelity,
+                "missing_elements": fidelity_result.missing_elements,
+                "extra_elements": fidelity_result.extra_elements
             },
             "llm_verification": verification_result,
             "overall_status": "high_fidelity" if fidelity_result.overall_fidelity >= 0.9 else (
@@ -159,7 +181,7 @@ Verify that the generated SSD accurately represents the source document. Check t
         
         return result
     
-    def batch_verify(self, input_file: str, output_file: str):
+    def batch_verify(self, input_file: str, output_file: str, output_format: str = "jsonl", append: bool = False):
         """
         Verify a batch of source documents and SSDs from a JSONL file.
         Each line should have {source_document: str, ssd_document: dict}.
@@ -167,8 +189,19 @@ Verify that the generated SSD accurately represents the source document. Check t
         Args:
             input_file: Path to input JSONL file with source+SSD pairs
             output_file: Path to output JSONL file with verification results
+                (a directory when output_format is "columnar")
+            output_format: "jsonl" (one JSON object per line) or "columnar"
+                (memory-mappable score columns, see result_store.py)
+            append: add to existing results instead of overwriting them
         """
-        with open(input_file, 'r') as f_in, open(output_file, 'w') as f_out:
+        if output_format == "columnar":
+            writer = ColumnarResultWriter(output_file, append=append)
+            write = writer.write
+        else:
+            writer = open(output_file, 'a' if append else 'w')
+            write = lambda result, line_num: writer.write(json.dumps(result) + '\n')
+        
+        with open(input_file, 'r') as f_in, writer:
             for line_num, line in enumerate(f_in, 1):
                 line = line.strip()
                 if not line:
@@ -182,7 +215,7 @@ Verify that the generated SSD accurately represents the source document. Check t
                     print(f"\nVerifying document {line_num}: {ssd_doc.get('simulation_name', 'Unknown')}")
                     
                     result = self.verify_document(source_doc, ssd_doc)
-                    f_out.write(json.dumps(result) + '\n')
+                    write(result, line_num)
                     
                     print(f"Status: {result['overall_status']}")
                     print(f"Overall Fidelity: {result['fidelity_verification']['overall_fidelity']:.2f}")
@@ -210,7 +243,19 @@ def main():
         "--output",
         type=str,
         required=True,
-        help="Output JSONL file for verification results"
+        help="Output JSONL file (or directory for --output-format columnar) for verification results"
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        choices=["jsonl", "columnar"],
+        default="jsonl",
+        help="jsonl: one JSON object per line; columnar: .npy score columns + offset-indexed document blob"
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="Add to existing results in --output instead of overwriting them"
     )
     parser.add_argument(
         "--embedding-model",
@@ -218,15 +263,33 @@ def main():
         default="all-MiniLM-L6-v2",
         help="Sentence transformer model for semantic similarity"
     )
+    parser.add_argument(
+        "--calibration",
+        type=str,
+        default=None,
+        help="JSON with thresholds/weights written by calibrate_thresholds.py sweep --output"
+    )
+    parser.add_argument(
+        "--no-merged",
+        action="store_true",
+        help="Ignore <model>/merged (export_merged.py snapshot) and load base + adapter"
+    )
     
     args = parser.parse_args()
     
+    calibration = None
+    if args.calibration:
+        with open(args.calibration, 'r') as f:
+            calibration = json.load(f)
+    
     verifier = DocumentVerifier(
         model_path=args.model,
-        embedding_model=args.embedding_model
+        embedding_model=args.embedding_model,
+        calibration=calibration,
+        use_merged=not args.no_merged
     )
     
-    verifier.batch_verify(args.input, args.output)
+    verifier.batch_verify(args.input, args.output, output_format=args.output_format, append=args.append)
     print(f"\nVerification complete. Results saved to {args.output}")
 
 
@@ -0,0 +1,106 @@
+import zlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+import graph_rag
+from graph_rag import DocumentVerifierRAG
+
+SOURCE = """
+A ball is launched from a platform at speed v0 and angle theta above horizontal.
+Ignore air drag; use g = 9.81 m/s^2.
+The horizontal position is x(t) = v0*cos(theta)*t
+The vertical position is y(t) = h + v0*sin(theta)*t - 0.5*g*t^2
+Assume flat ground at y=0. Assume no air resistance.
+The speed must be positive and angle must be between 0 and 90 degrees.
+"""
+
+SSD = {
+    "equations": [
+        {"expression": "x(t) = v0*cos(theta)*t"},
+        {"expression": "E = m*c^2"},
+        {"expression": "y(t) = h + v0*sin(theta)*t - 0.5*g*t^2"},
+    ],
+    "parameters": [{"symbol": "v0"}, {"symbol": "theta"}, {"symbol": "q_e"}],
+    "assumptions": ["No air resistance"],
+    "constraints": ["speed must be positive"],
+}
+
+# Removes an equation, adds two (one ahead of a surviving hallucination) and reorders the rest
+PATCHED = {
+    "equations": [
+        {"expression": "p = m*v"},
+        {"expression": "E = m*c^2"},
+        {"expression": "x(t) = v0*cos(theta)*t"},
+        {"expression": "F = q*v*B"},
+    ],
+    "parameters": [{"symbol": "k_b"}, {"symbol": "theta"}, {"symbol": "q_e"}, {"symbol": "v0"}],
+    "assumptions": ["Flat ground at y=0", "No air resistance"],
+    "constraints": [],
+}
+
+
+class _CharTrigramEncoder:
+    """Deterministic stand-in for a sentence transformer: hashed character trigram counts"""
+
+    DIM = 64
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_sentence_embedding_dimension(self):
+        return self.DIM
+
+    def encode(self, texts):
+        out = np.zeros((len(texts), self.DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = text.lower()
+            for i in range(len(text) - 2):
+                out[row, zlib.crc32(text[i:i + 3].encode()) % self.DIM] += 1
+        return out
+
+
+@pytest.fixture
+def verifier(monkeypatch):
+    monkeypatch.setattr(graph_rag, "SentenceTransformer", _CharTrigramEncoder)
+    return DocumentVerifierRAG()
+
+
+def _assert_same(result, expected):
+    for field in ("equation_accuracy", "parameter_completeness", "assumption_completeness",
+                  "constraint_accuracy", "overall_fidelity"):
+        assert getattr(result, field) == pytest.approx(getattr(expected, field)), field
+    assert result.missing_elements == expected.missing_elements
+    assert result.extra_elements == expected.extra_elements
+
+
+def test_session_matches_full_verification(verifier):
+    session = verifier.create_session(SOURCE, SSD)
+    _assert_same(session.result(), verifier.verify_ssd_fidelity(SOURCE, SSD))
+
+
+def test_update_matches_full_verification_of_the_patched_ssd(verifier):
+    session = verifier.create_session(SOURCE, SSD)
+    expected = verifier.verify_ssd_fidelity(SOURCE, PATCHED)
+    assert len(expected.extra_elements) >= 3  # ordering of the extra list is actually exercised
+    _assert_same(session.update(PATCHED), expected)
+    # And back again
+    _assert_same(session.update(SSD), verifier.verify_ssd_fidelity(SOURCE, SSD))
+
+
+def test_apply_diff_appends_added_elements(verifier):
+    session = verifier.create_session(SOURCE, SSD)
+    result = session.apply_diff({
+        "equations": {"added": [{"expression": "p = m*v"}], "removed": ["E = m*c^2"]},
+        "parameters": {"removed": [{"symbol": "q_e"}]},
+    })
+    equivalent = {
+        **SSD,
+        "equations": [SSD["equations"][0], SSD["equations"][2], {"expression": "p = m*v"}],
+        "parameters": SSD["parameters"][:2],
+    }
+    _assert_same(result, verifier.verify_ssd_fidelity(SOURCE, equivalent))
+    with pytest.raises(ValueError):
+        session.apply_diff({"assumptions": {"removed": ["Not there"]}})
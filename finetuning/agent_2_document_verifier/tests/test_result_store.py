@@ -0,0 +1,51 @@
+import numpy as np
+
+from result_store import ColumnarResultReader, ColumnarResultWriter, SCORE_COLUMNS
+
+
+def _result(score: float, name: str):
+    return {
+        "source_document": f"source {name}",
+        "ssd_document": {"simulation_name": name},
+        "fidelity_verification": {
+            **{column: score for column in SCORE_COLUMNS},
+            "missing_elements": [f"missing {name}"],
+            "extra_elements": [],
+        },
+        "overall_status": "acceptable",
+    }
+
+
+def _write(output_dir, names, **kwargs):
+    with ColumnarResultWriter(str(output_dir), segment_size=4, **kwargs) as writer:
+        for i, name in enumerate(names):
+            writer.write(_result(i / 10, name), line_num=i + 1)
+
+
+def test_round_trip(tmp_path):
+    _write(tmp_path, [f"a{i}" for i in range(7)])
+    reader = ColumnarResultReader(str(tmp_path))
+    assert len(reader) == 7
+    assert len(reader.segments("overall_fidelity")) == 2
+    np.testing.assert_allclose(reader.column("overall_fidelity"), np.arange(7) / 10, rtol=1e-6)
+    assert reader.column("line_num").tolist() == list(range(1, 8))
+    assert reader.record(5)["ssd_document"]["simulation_name"] == "a5"
+    assert reader.record(5)["missing_elements"] == ["missing a5"]
+
+
+def test_reopen_overwrites_by_default(tmp_path):
+    _write(tmp_path, [f"a{i}" for i in range(7)])
+    _write(tmp_path, ["b0", "b1"])
+    reader = ColumnarResultReader(str(tmp_path))
+    assert len(reader) == 2
+    assert [reader.record(i)["ssd_document"]["simulation_name"] for i in range(2)] == ["b0", "b1"]
+    assert (tmp_path / "documents.bin").stat().st_size == reader.manifest["blob_bytes"]
+
+
+def test_reopen_with_append_continues(tmp_path):
+    _write(tmp_path, [f"a{i}" for i in range(7)])
+    _write(tmp_path, ["b0", "b1"], append=True)
+    reader = ColumnarResultReader(str(tmp_path))
+    assert len(reader) == 9
+    assert reader.record(6)["ssd_document"]["simulation_name"] == "a6"
+    assert reader.record(8)["ssd_document"]["simulation_name"] == "b1"
@@ -5,20 +5,30 @@ This agent verifies SSD format outputs from Agent 1 against domain knowledge gra
 - Validates equation correctness, domain consistency, and parameter feasibility
 - Uses Graph RAG to retrieve domain-specific validation rules
 - Trains on verification samples with corrective feedback
+- Loss only on the verification output by default (FINETUNE_COMPLETION_ONLY=0 for full-text loss)
 """
 
 import json
 import os
+import random
+import sys
+import time
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import torch
 from unsloth import FastLanguageModel
-from datasets import Dataset
+from datasets import Dataset, Features, Value
 from trl import SFTConfig, SFTTrainer
 import wandb
 import weave
 
+# Completion-only tokenization and its cache are shared with Agent 1's trainer
+SHARED_DIR = Path(__file__).resolve().parent.parent / "agent_1_document_interpreter"
+if str(SHARED_DIR) not in sys.path:
+    sys.path.insert(0, str(SHARED_DIR))
+from completion_tokenization import tokenize_for_completion_only
+
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
@@ -34,21 +44,35 @@ LORA_R = int(os.environ.get("FINETUNE_LORA_R", "32"))
 LORA_ALPHA = int(os.environ.get("FINETUNE_LORA_ALPHA", "32"))
 SAVE_STEPS = int(os.environ.get("FINETUNE_SAVE_STEPS", "100"))
 LOGGING_STEPS = int(os.environ.get("FINETUNE_LOGGING_STEPS", "10"))
+# Rows per Arrow write when streaming the JSONL into a dataset
+LOAD_CHUNK_SIZE = int(os.environ.get("FINETUNE_LOAD_CHUNK_SIZE", "1000"))
+# Serialize ssd_input / verification_output without indent whitespace (saves tokens)
+COMPACT_JSON = os.environ.get("FINETUNE_COMPACT_JSON", "0").lower() in ("1", "true", "yes")
+# Batch samples of similar token length together to cut padding. Opt-in, as in Agent 1's trainer:
+# it changes batch composition (and so the loss curve), and length_report.json shows the padding
+# it would save before enabling it
+GROUP_BY_LENGTH = os.environ.get("FINETUNE_GROUP_BY_LENGTH", "0").lower() in ("1", "true", "yes")
+# Loss only on the verification output tokens; 0 trains on the full text (prompt included)
+COMPLETION_ONLY = os.environ.get("FINETUNE_COMPLETION_ONLY", "1").lower() in ("1", "true", "yes")
+# Tokenized dataset cache shared by all launches and DDP ranks ("" disables it); worker count and
+# rank wait time: FINETUNE_TOKENIZE_PROCS / FINETUNE_TOKENIZE_WAIT (completion_tokenization.py)
+TOKENIZED_CACHE_DIR = os.environ.get("FINETUNE_TOKENIZED_CACHE", "tokenized_cache")
 
+# Prompt sections measured separately in the length report (completion is measured too)
+LENGTH_FIELDS = ["instruction", "ssd_input", "graph_context"]
+LENGTH_BUCKETS = [128, 256, 512, 1024, 2048, 4096, 8192, 16384]
 
-def load_and_format_dataset(data_path: str):
-    """
-    Load verification samples with graph RAG context.
-    Format: {instruction, ssd_input, graph_context, verification_output}
-    """
-    path = Path(data_path)
-    if not path.is_absolute():
-        path = Path(__file__).resolve().parent.parent.parent / "training_dataset/agent_2_document_verifier" / data_path
 
-    if not path.exists():
-        raise FileNotFoundError(f"Data file not found: {path}")
+def _dump_json(obj, compact: bool) -> str:
+    return json.dumps(obj, separators=(",", ":")) if compact else json.dumps(obj, indent=2)
 
-    rows = []
+
+def _iter_verification_records(path: str, mtime: float, size: int, compact_json: bool = False):
+    """
+    Yield formatted verification samples one line at a time.
+    mtime/size are unused here but part of gen_kwargs, so an edited file invalidates the Arrow cache.
+    The individual prompt sections are kept as field_* columns for the length report.
+    """
     with open(path, "r", encoding="utf-8") as f:
         for line_num, line in enumerate(f, start=1):
             line = line.strip()
@@ -56,34 +80,154 @@ def load_and_format_dataset(data_path: str):
                 continue
             try:
                 record = json.loads(line)
+                ssd_input = _dump_json(record['ssd_input'], compact_json)
+                graph_context = record['graph_context']
+                # Structured graph context (nodes/edges) is JSON like the SSD; pre-rendered text stays as is
+                if not isinstance(graph_context, str):
+                    graph_context = _dump_json(graph_context, compact_json)
                 # Format for verification task with graph RAG context
                 prompt = f"""### Instruction:
 {record['instruction']}
 
 ### SSD Document to Verify:
-{json.dumps(record['ssd_input'], indent=2)}
+{ssd_input}
 
 ### Domain Knowledge Graph Context:
-{record['graph_context']}
+{graph_context}
 
 ### Verification Output:
 """
-                completion = json.dumps(record['verification_output'], indent=2)
+                completion = _dump_json(record['verification_output'], compact_json)
                 
-                rows.append({
+                formatted = {
                     "prompt": prompt,
                     "completion": completion,
-                    "text": prompt + completion
-                })
+                    "text": prompt + completion,
+                    "field_instruction": record['instruction'],
+                    "field_ssd_input": ssd_input,
+                    "field_graph_context": graph_context,
+                }
             except Exception as e:
                 print(f"Error parsing line {line_num}: {e}")
                 continue
+            yield formatted
 
-    if not rows:
-        raise ValueError(f"No valid training samples found in {path}")
 
-    print(f"Loaded {len(rows)} verification samples from {path}")
-    return Dataset.from_list(rows)
+def load_and_format_dataset(data_path: str, compact_json: bool = COMPACT_JSON):
+    """
+    Load verification samples with graph RAG context.
+    Format: {instruction, ssd_input, graph_context, verification_output}
+    Records are streamed straight into an Arrow-backed (memory-mapped) dataset in chunks of
+    LOAD_CHUNK_SIZE, so peak memory does not grow with the corpus size.
+    With compact_json, SSD, structured graph context and verification JSON are serialized
+    without indent whitespace.
+    """
+    path = Path(data_path)
+    if not path.is_absolute():
+        path = Path(__file__).resolve().parent.parent.parent / "training_dataset/agent_2_document_verifier" / data_path
+
+    if not path.exists():
+        raise FileNotFoundError(f"Data file not found: {path}")
+
+    stat = path.stat()
+    start = time.time()
+    try:
+        dataset = Dataset.from_generator(
+            _iter_verification_records,
+            gen_kwargs={"path": str(path), "mtime": stat.st_mtime, "size": stat.st_size, "compact_json": compact_json},
+            features=Features({
+                name: Value("string")
+                for name in ["prompt", "completion", "text"] + [f"field_{f}" for f in LENGTH_FIELDS]
+            }),
+            writer_batch_size=LOAD_CHUNK_SIZE,
+        )
+    except ValueError as e:
+        # datasets refuses to build a split with no rows
+        raise ValueError(f"No valid training samples found in {path}") from e
+    elapsed = max(time.time() - start, 1e-9)
+
+    # An unchanged file is served from the Arrow cache written by an earlier launch
+    if any(os.path.getmtime(f["filename"]) >= start for f in dataset.cache_files):
+        print(f"Loaded {len(dataset)} verification samples from {path} in {elapsed:.1f}s "
+              f"({len(dataset) / elapsed:,.0f} records/sec)")
+    else:
+        print(f"Loaded {len(dataset)} verification samples from {path} (Arrow cache)")
+    return dataset
+
+
+# Columns the cached tokenization measures for the length report (len_<column>)
+LENGTH_MEASURE_COLUMNS = ["completion"] + [f"field_{f}" for f in LENGTH_FIELDS]
+
+
+def compute_length_report(tokenized, max_seq_length: int, batch_size: int, compact_json: bool = COMPACT_JSON):
+    """
+    Token-length report from the cached tokenized dataset: per-field histograms, samples/tokens
+    lost to truncation at max_seq_length, and padding wasted by random vs length-grouped batches.
+    Reads the length, full_length and len_* columns written by tokenize_for_completion_only
+    (with_length=True, measure=LENGTH_MEASURE_COLUMNS), so nothing is tokenized here.
+    compact_json is recorded in the report and should match the flag the dataset was loaded with.
+    """
+    def _histogram(values: List[int]) -> Dict[str, int]:
+        edges = [0] + LENGTH_BUCKETS
+        hist = {f"{lo}-{hi}": sum(1 for v in values if lo <= v < hi) for lo, hi in zip(edges, edges[1:])}
+        hist[f">={LENGTH_BUCKETS[-1]}"] = sum(1 for v in values if v >= LENGTH_BUCKETS[-1])
+        return hist
+
+    totals = tokenized["full_length"]
+    completions = tokenized["len_completion"]
+    effective = tokenized["length"]
+    overflow = [max(0, t - e) for t, e in zip(totals, effective)]
+
+    def _padding(order: List[int]) -> int:
+        wasted = 0
+        for i in range(0, len(order), batch_size):
+            batch = [effective[j] for j in order[i:i + batch_size]]
+            wasted += max(batch) * len(batch) - sum(batch)
+        return wasted
+
+    indices = list(range(len(effective)))
+    random.Random(42).shuffle(indices)
+    # Same megabatch scheme as HF's LengthGroupedSampler
+    megabatch = batch_size * 50
+    grouped = []
+    for i in range(0, len(indices), megabatch):
+        grouped.extend(sorted(indices[i:i + megabatch], key=lambda j: effective[j], reverse=True))
+
+    report = {
+        "num_samples": len(totals),
+        "max_seq_length": max_seq_length,
+        "compact_json": compact_json,
+        "histograms": {
+            **{field: _histogram(tokenized[f"len_field_{field}"]) for field in LENGTH_FIELDS},
+            "verification_output": _histogram(completions),
+            "total": _histogram(totals),
+        },
+        "mean_tokens": {
+            **{field: sum(tokenized[f"len_field_{field}"]) / max(len(totals), 1) for field in LENGTH_FIELDS},
+            "verification_output": sum(completions) / max(len(totals), 1),
+            "total": sum(totals) / max(len(totals), 1),
+        },
+        "truncated_samples": sum(1 for o in overflow if o > 0),
+        "truncated_tokens": sum(overflow),
+        # Truncation cuts the end of the text, i.e. the verification output the loss is on
+        "truncated_completion_tokens": sum(min(o, c) for o, c in zip(overflow, completions)),
+        "padding_tokens_random_batches": _padding(indices),
+        "padding_tokens_length_grouped_batches": _padding(grouped),
+        "real_tokens": sum(effective),
+    }
+    return report
+
+
+# Bump when the tokenized layout changes so stale caches are not reused
+TOKENIZATION_VERSION = "2"
+
+
+def _tokenized_cache_dir() -> Optional[Path]:
+    """TOKENIZED_CACHE_DIR resolved against this directory (None when caching is disabled)."""
+    if not TOKENIZED_CACHE_DIR:
+        return None
+    cache_dir = Path(TOKENIZED_CACHE_DIR)
+    return cache_dir if cache_dir.is_absolute() else Path(__file__).resolve().parent / cache_dir
 
 
 def formatting_prompts_func(examples):
@@ -98,15 +242,8 @@ def main():
 
     # Load dataset
     print(f"Loading dataset from {DATA_PATH}")
-    dataset = load_and_format_dataset(DATA_PATH)
-    
-    # Split dataset
-    split = dataset.train_test_split(test_size=0.1, seed=42)
-    train_dataset = split["train"]
-    eval_dataset = split["test"]
-
-    print(f"Training samples: {len(train_dataset)}")
-    print(f"Evaluation samples: {len(eval_dataset)}")
+    compact_json = COMPACT_JSON
+    dataset = load_and_format_dataset(DATA_PATH, compact_json=compact_json)
 
     # Load model with LoRA
     print(f"Loading model: {MODEL_NAME}")
@@ -132,6 +269,57 @@ def main():
 
     print(f"Model loaded with LoRA (r={LORA_R}, alpha={LORA_ALPHA})")
 
+    # Ensure pad token exists for batching
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    # One cached tokenization feeds both the length report and completion-only training
+    print("Pre-tokenizing dataset...")
+    tokenized = tokenize_for_completion_only(
+        dataset, tokenizer, MAX_SEQ_LENGTH, TOKENIZATION_VERSION,
+        cache_dir=_tokenized_cache_dir(), with_length=True, measure=LENGTH_MEASURE_COLUMNS,
+    )
+
+    # Length report: how many samples get truncated and how much compute goes to padding
+    if int(os.environ.get("RANK", "0")) == 0:
+        length_report = compute_length_report(
+            tokenized, MAX_SEQ_LENGTH, PER_DEVICE_BATCH_SIZE, compact_json=compact_json
+        )
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        report_path = os.path.join(OUTPUT_DIR, "length_report.json")
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(length_report, f, indent=2)
+        real = max(length_report["real_tokens"], 1)
+        print(f"Length report ({'compact' if compact_json else 'indented'} JSON) saved to {report_path}")
+        print(f"  Mean tokens per sample: {length_report['mean_tokens']['total']:.0f}")
+        print(f"  Truncated at {MAX_SEQ_LENGTH}: {length_report['truncated_samples']} samples, "
+              f"{length_report['truncated_tokens']} tokens ({length_report['truncated_completion_tokens']} of them output tokens)")
+        print(f"  Padding tokens: {length_report['padding_tokens_random_batches']} random batches "
+              f"({length_report['padding_tokens_random_batches'] / real:.1%} of real), "
+              f"{length_report['padding_tokens_length_grouped_batches']} length-grouped "
+              f"({length_report['padding_tokens_length_grouped_batches'] / real:.1%})")
+        wandb.summary.update({f"length_report/{k}": v for k, v in length_report.items() if not isinstance(v, dict)})
+    tokenized = tokenized.remove_columns(["full_length"] + [f"len_{c}" for c in LENGTH_MEASURE_COLUMNS])
+
+    loss_tokens = None
+    if COMPLETION_ONLY:
+        dataset = tokenized
+        loss_tokens = sum(sum(mask) for mask in dataset["completion_mask"])
+        all_tokens = sum(dataset["length"])
+        print(f"Loss tokens: {loss_tokens:,} of {all_tokens:,} ({loss_tokens / max(all_tokens, 1):.1%})")
+    else:
+        # Full-text loss trains on the text column; the token lengths drive length grouping
+        dataset = dataset.remove_columns([f"field_{f}" for f in LENGTH_FIELDS])
+        dataset = dataset.add_column("length", tokenized["length"])
+
+    # Split dataset (same seed either way, so both loss modes see the same train/eval rows)
+    split = dataset.train_test_split(test_size=0.1, seed=42)
+    train_dataset = split["train"]
+    eval_dataset = split["test"]
+
+    print(f"Training samples: {len(train_dataset)}")
+    print(f"Evaluation samples: {len(eval_dataset)}")
+
     # Training configuration
     training_args = SFTConfig(
         output_dir=OUTPUT_DIR,
@@ -149,7 +337,12 @@ def main():
         save_total_limit=3,
         max_seq_length=MAX_SEQ_LENGTH,
         dataset_text_field="text",
+        # Pre-tokenized input_ids + completion_mask: prompt tokens are masked out of the loss
+        completion_only_loss=COMPLETION_ONLY,
         packing=False,
+        # Length-grouped sampler: batches of similar length (uses the `length` column)
+        group_by_length=GROUP_BY_LENGTH,
+        length_column_name="length",
         report_to=["wandb", "weave"],
     )
 
@@ -160,12 +353,21 @@ def main():
         train_dataset=train_dataset,
         eval_dataset=eval_dataset,
         args=training_args,
-        formatting_func=formatting_prompts_func,
+        formatting_func=None if COMPLETION_ONLY else formatting_prompts_func,
     )
 
     # Train
-    print("Starting training...")
-    trainer.train()
+    print(f"Starting training ({'completion-only' if COMPLETION_ONLY else 'full-text'} loss)...")
+    start = time.time()
+    train_result = trainer.train()
+    runtime = train_result.metrics.get("train_runtime", time.time() - start)
+    steps = max(train_result.global_step, 1)
+    print(f"Train loss: {train_result.training_loss:.4f}, {runtime / steps:.2f}s/step over {steps} steps")
+    wandb.summary.update({
+        "completion_only": COMPLETION_ONLY,
+        "seconds_per_step": runtime / steps,
+        **({"loss_tokens": loss_tokens} if loss_tokens is not None else {}),
+    })
 
     # Save final model
     final_path = os.path.join(OUTPUT_DIR, "final_model")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Prefix-cache benchmark for extend_dataset.py, run against fake_vllm_server.py in-process.
+
+The fake server models automatic prefix caching (block-hashed LRU) and charges prefill time only for
+prompt characters it could not reuse. The generator runs --samples accepted entries at --concurrency;
+reported are the share of prompt characters the server served from its cache, the generator's own
+estimate (PrefixShareTracker, when the module has it) and accepted entries per second.
+
+Usage:
+    python bench_prefix_cache.py                                   # current prompt layout
+    python bench_prefix_cache.py --group-by-domain
+    # another revision's prompt layout, for before/after numbers:
+    git show <rev>:training_dataset/agent_1_document_interpreter/extend_dataset.py > /tmp/extend_dataset_prev.py
+    python bench_prefix_cache.py --module /tmp/extend_dataset_prev.py
+"""
+
+import argparse
+import importlib.util
+import inspect
+import json
+import logging
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+import fake_vllm_server
+
+
+def load_generator_module(path: Path):
+    spec = importlib.util.spec_from_file_location("extend_dataset_bench", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_seed_examples(module, input_file: str, per_domain: int):
+    """Seed examples from a JSONL file, or synthetic ones (the stub's entries) for every catalog domain"""
+    if input_file:
+        return module.load_existing_dataset(input_file)
+    examples = []
+    for domain, info in module.DOMAIN_CATALOG.items():
+        for subcategory in info['subcategories'][:per_domain]:
+            examples.append(fake_vllm_server._entry(domain, subcategory))
+    return examples
+
+
+def run(args) -> dict:
+    random.seed(args.seed)
+    module = load_generator_module(Path(args.module))
+    module.logger.setLevel(logging.INFO if args.verbose else logging.ERROR)
+    logging.getLogger("httpx").setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    server_args = fake_vllm_server.parse_args([
+        "--capacity", str(args.concurrency * 4), "--error-rate", "0", "--latency", str(args.latency),
+        "--latency-per-request", "0", "--jitter", str(args.jitter),
+        "--prefix-cache-blocks", str(args.cache_blocks), "--block-chars", str(args.block_chars),
+        "--prefill-per-kchar", str(args.prefill_per_kchar),
+    ])
+    server = fake_vllm_server.FakeVLLMServer(("127.0.0.1", 0), server_args)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # Only pass options this revision of the generator knows about
+    options = {
+        'vllm_base_url': f"http://127.0.0.1:{server.server_address[1]}/v1",
+        'model_name': server_args.model,
+        'critic_batch_size': args.critic_batch_size,
+        'group_by_domain': args.group_by_domain,
+        'adaptive_rate': False,
+        'seed': args.seed,
+    }
+    accepted = inspect.signature(module.SimulationGenerator.__init__).parameters
+    generator = module.SimulationGenerator(**{k: v for k, v in options.items() if k in accepted})
+    examples = load_seed_examples(module, args.input, args.seeds_per_domain)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = Path(tmp) / "bench.jsonl"
+            start = time.time()
+            generator.generate_dataset(examples, target_size=args.samples, num_examples=args.num_examples,
+                                       output_file=str(output_file), concurrency=args.concurrency)
+            elapsed = time.time() - start
+            with open(output_file, 'r', encoding='utf-8') as f:
+                written = sum(1 for line in f if line.strip())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    counts = server.counts
+    tracker = getattr(generator, 'prefix_tracker', None)
+    return {
+        'module': args.module,
+        'group_by_domain': args.group_by_domain,
+        'accepted': written,
+        'seconds': round(elapsed, 2),
+        'accepted_per_sec': round(written / elapsed, 2),
+        'requests': counts['requests'],
+        'prompt_chars_per_request': counts['prompt_chars'] // max(counts['requests'], 1),
+        'server_prefix_reuse': round(counts['cached_chars'] / max(counts['prompt_chars'], 1), 4),
+        'tracker_estimate': tracker.summary() if tracker else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt prefix reuse and throughput against a prefix-caching stub")
+    parser.add_argument("--module", default=str(SCRIPT_DIR / "extend_dataset.py"), help="extend_dataset.py to benchmark")
+    parser.add_argument("--input", default="", help="Seed examples JSONL (default: synthetic, one per subcategory)")
+    parser.add_argument("--seeds-per-domain", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--num-examples", type=int, default=5)
+    parser.add_argument("--critic-batch-size", type=int, default=1)
+    parser.add_argument("--group-by-domain", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.05, help="Server seconds per request besides prefill")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--prefill-per-kchar", type=float, default=0.02, help="Server seconds per 1000 uncached prompt chars")
+    parser.add_argument("--cache-blocks", type=int, default=4096)
+    parser.add_argument("--block-chars", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
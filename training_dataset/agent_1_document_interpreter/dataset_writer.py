@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Buffered, crash-safe writer for the generated JSONL dataset.
+
+Accepted entries are buffered and flushed when flush_entries lines are waiting, when the oldest
+waiting line is flush_seconds old (checked on write), at checkpoints and on close. A flush:
+  1. writes the batch to <output>.seg-<offset> via a temp file + fsync + rename, where <offset> is
+     the output file's size before the batch - the segment is now durable
+  2. appends the batch to the output file with one open/write/fsync
+  3. removes the segment
+On open, a leftover segment (crash between 1 and 3) is replayed: the output is truncated to its
+offset and the batch appended again, so a batch is never lost or duplicated once its segment exists.
+
+Entries may carry a sample record (e.g. the generator's sample number and target), appended to
+<output>.samples.jsonl with the output line it describes, before step 1 of the same flush. The
+sidecar is therefore never behind the output; records for a batch that never reached the output are
+superseded by the next record for the same line (sample_records() keeps the last one).
+
+Optionally (shard_format="zstd") accepted lines are also sealed into zstd-compressed JSONL shards of
+shard_entries lines under <output>.shards/, each written temp + rename, with index.json listing
+file, first line, entry count and bytes. Lines not yet in a sealed shard are recovered from the
+JSONL on open. iter_shard_entries() streams the shards back for downstream trainers.
+"""
+
+import io
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SEGMENT_RE = re.compile(r"\.seg-(\d+)$")
+SHARD_INDEX = "index.json"
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class DatasetWriter:
+    """Single writer for the output JSONL (and optional zstd shards)"""
+
+    def __init__(
+        self,
+        output_file: str,
+        flush_entries: int = 64,
+        flush_seconds: float = 30.0,
+        shard_format: Optional[str] = None,
+        shard_entries: int = 10000,
+        compression_level: int = 10,
+    ):
+        if shard_format not in (None, "zstd"):
+            raise ValueError(f"Unknown shard format: {shard_format}")
+        if shard_format == "zstd" and zstandard is None:
+            raise ImportError("shard_format='zstd' needs the zstandard package (pip install zstandard)")
+        self.path = Path(output_file)
+        self.flush_entries = max(1, flush_entries)
+        self.flush_seconds = flush_seconds
+        self.shard_format = shard_format
+        self.shard_entries = shard_entries
+        self.compression_level = compression_level
+
+        self.samples_path = Path(f"{output_file}.samples.jsonl")
+
+        self.buffer: List[str] = []
+        self.sample_buffer: List[str] = []
+        self.buffer_since: Optional[float] = None
+        self.flushes = 0
+        self.recovered_segments = self._recover_segments()
+        self._lines: Optional[int] = None  # output line count, counted on first use
+        self._terminate_samples_file()
+
+        if shard_format:
+            self.shard_dir = Path(f"{output_file}.shards")
+            self.shard_dir.mkdir(exist_ok=True)
+            self.index = self._load_index()
+            self.shard_pending: List[str] = self._recover_shard_tail()
+
+    # ----- Segments (crash safety) -----
+
+    def _segments(self) -> List[Path]:
+        return sorted(
+            (p for p in self.path.parent.glob(f"{self.path.name}.seg-*") if SEGMENT_RE.search(p.name)),
+            key=lambda p: int(SEGMENT_RE.search(p.name).group(1))
+        )
+
+    def _recover_segments(self) -> int:
+        # Temp segments were never committed; their batch was not durable yet
+        for tmp_path in self.path.parent.glob(f"{self.path.name}.seg-*.tmp"):
+            tmp_path.unlink()
+        segments = self._segments()
+        for segment in segments:
+            offset = int(SEGMENT_RE.search(segment.name).group(1))
+            self._append(segment.read_bytes(), offset)
+            segment.unlink()
+        return len(segments)
+
+    def _append(self, data: bytes, offset: Optional[int] = None, path: Optional[Path] = None):
+        """Append with one fsync; with offset, first drop anything past it (a partial earlier append)"""
+        with open(path or self.path, 'ab') as f:
+            if offset is not None and f.tell() != offset:
+                f.truncate(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _terminate_samples_file(self):
+        """A crash mid-append can leave a torn last record; end it so the next record starts a fresh line"""
+        if self.samples_path.exists() and self.samples_path.stat().st_size:
+            with open(self.samples_path, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    # ----- Writing -----
+
+    def write(self, entry: Dict, sample: Optional[Dict] = None):
+        """Buffer one entry; sample (JSON-serializable) goes to the sidecar tagged with the entry's line"""
+        if sample is not None:
+            line = self._line_count() + len(self.buffer)
+            self.sample_buffer.append(json.dumps({'line': line, **sample}, ensure_ascii=False) + '\n')
+        self.buffer.append(json.dumps(entry, ensure_ascii=False) + '\n')
+        if self.buffer_since is None:
+            self.buffer_since = time.monotonic()
+        if len(self.buffer) >= self.flush_entries or time.monotonic() - self.buffer_since >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.sample_buffer:
+            # Ahead of the batch, so every entry that reaches the output has its record
+            self._append(''.join(self.sample_buffer).encode('utf-8'), path=self.samples_path)
+            self.sample_buffer = []
+        data = ''.join(self.buffer).encode('utf-8')
+        offset = self.path.stat().st_size if self.path.exists() else 0
+        segment = self.path.with_name(f"{self.path.name}.seg-{offset}")
+        _write_atomic(segment, data)
+        self._append(data)
+        segment.unlink()
+
+        if self.shard_format:
+            self.shard_pending.extend(self.buffer)
+            while len(self.shard_pending) >= self.shard_entries:
+                self._seal_shard(self.shard_pending[:self.shard_entries])
+                self.shard_pending = self.shard_pending[self.shard_entries:]
+        if self._lines is not None:
+            self._lines += len(self.buffer)
+        self.buffer = []
+        self.buffer_since = None
+        self.flushes += 1
+
+    def _line_count(self) -> int:
+        if self._lines is None:
+            self._lines = 0
+            if self.path.exists():
+                with open(self.path, 'rb') as f:
+                    self._lines = sum(1 for _ in f)
+        return self._lines
+
+    def sample_records(self) -> Dict[int, Dict]:
+        """Output line -> its sample record (the last one written for that line)"""
+        records = {}
+        if self.samples_path.exists():
+            with open(self.samples_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line
+                    records[record.pop('line')] = record
+        return records
+
+    def close(self):
+        """Flush, and seal the partial last shard (the next open continues with a new shard)"""
+        self.flush()
+        if self.shard_format and self.shard_pending:
+            self._seal_shard(self.shard_pending)
+            self.shard_pending = []
+
+    # ----- Shards -----
+
+    def _load_index(self) -> Dict:
+        index_path = self.shard_dir / SHARD_INDEX
+        if index_path.exists():
+            with open(index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'format': 'jsonl.zst', 'source': self.path.name, 'total_entries': 0, 'shards': []}
+
+    def _recover_shard_tail(self) -> List[str]:
+        """Output lines not covered by a sealed shard yet"""
+        if not self.path.exists():
+            return []
+        covered = self.index['total_entries']
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return [line if line.endswith('\n') else line + '\n' for i, line in enumerate(f) if i >= covered]
+
+    def _seal_shard(self, lines: List[str]):
+        number = len(self.index['shards'])
+        name = f"shard-{number:05d}.jsonl.zst"
+        data = zstandard.ZstdCompressor(level=self.compression_level).compress(''.join(lines).encode('utf-8'))
+        _write_atomic(self.shard_dir / name, data)
+        self.index['shards'].append({
+            'file': name,
+            'first_line': self.index['total_entries'],
+            'entries': len(lines),
+            'bytes': len(data),
+        })
+        self.index['total_entries'] += len(lines)
+        _write_atomic(self.shard_dir / SHARD_INDEX, json.dumps(self.index, indent=2).encode('utf-8'))
+
+
+def iter_shard_entries(shard_dir: str) -> Iterator[Dict]:
+    """Stream entries from the shards listed in shard_dir/index.json, in order"""
+    if zstandard is None:
+        raise ImportError("Reading zstd shards needs the zstandard package (pip install zstandard)")
+    shard_dir = Path(shard_dir)
+    with open(shard_dir / SHARD_INDEX, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    decompressor = zstandard.ZstdDecompressor()
+    for shard in index['shards']:
+        with open(shard_dir / shard['file'], 'rb') as raw:
+            with decompressor.stream_reader(raw) as reader:
+                for line in io.TextIOWrapper(reader, encoding='utf-8'):
+                    if line.strip():
+                        yield json.loads(line)
@@ -5,18 +5,34 @@ Ensures wide domain coverage across: Physics, Chemistry, Biology, Math,
 Computer Science, Engineering, Finance, and more.
 """
 
+import os
+import re
 import json
+import zlib
+import time
+import bisect
 import random
+import asyncio
 import logging
 from pathlib import Path
 from typing import List, Dict, Optional, Any
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque
 
+import numpy as np
+from langchain_core.messages import AIMessage
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field, field_validator
 from langchain_openai import ChatOpenAI
 
+from ssd_schema import Entity, Constant, Parameter, Equation, SimulationOutput
+from near_duplicates import NearDuplicateIndex
+from ssd_checks import SSDChecker
+from rate_control import AdaptiveLimiter
+from token_accounting import TokenLedger, message_usage
+from response_cache import ResponseCache, cache_key
+from dataset_writer import DatasetWriter
+
 # Configure logging
 DEBUG_MODE = False
 
@@ -35,6 +51,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Seconds between live rate metric lines in the concurrent pipeline
+RATE_REPORT_SECONDS = 30
+
 
 # ==================== DOMAIN DEFINITIONS ====================
 
@@ -261,66 +280,7 @@ DOMAIN_CATALOG = {
 
 # ==================== STRUCTURED OUTPUT SCHEMAS ====================
 
-class Entity(BaseModel):
-    """Represents a physical entity in the simulation"""
-    name: str = Field(description="Name of the entity")
-    mass: Optional[Dict[str, Any]] = Field(None, description="Mass properties")
-    capacitance: Optional[Dict[str, Any]] = Field(None, description="Capacitance properties")
-    resistance: Optional[Dict[str, Any]] = Field(None, description="Resistance properties")
-    count: Optional[Dict[str, Any]] = Field(None, description="Count properties")
-
-
-class Constant(BaseModel):
-    """Represents a physical constant"""
-    name: str = Field(description="Name of the constant")
-    symbol: str = Field(description="Symbol for the constant")
-    value: float = Field(description="Numerical value")
-    unit: str = Field(description="Unit of measurement")
-
-
-class Parameter(BaseModel):
-    """Represents a simulation parameter"""
-    name: str = Field(description="Name of the parameter")
-    symbol: str = Field(description="Mathematical symbol")
-    unit: str = Field(description="Unit of measurement")
-    range: List[float] = Field(description="Valid range [min, max]")
-
-
-class Equation(BaseModel):
-    """Represents a mathematical equation"""
-    description: str = Field(description="Description of what the equation represents")
-    expression: str = Field(description="Mathematical expression")
-    condition: Optional[str] = Field(None, description="Condition for applicability")
-
-
-class SimulationOutput(BaseModel):
-    """Structured output for a simulation description - SSD Format"""
-    simulation_name: str = Field(description="Unique identifier for the simulation")
-    domain: str = Field(description="Scientific/engineering domain")
-    description: str = Field(description="Brief description of the simulation")
-    assumptions: List[str] = Field(description="List of assumptions made")
-    entities: List[Entity] = Field(default_factory=list, description="Physical entities")
-    constants: List[Constant] = Field(default_factory=list, description="Physical constants")
-    parameters: List[Parameter] = Field(description="Configurable parameters")
-    equations: List[Equation] = Field(description="Mathematical equations")
-    initial_conditions: Dict[str, Any] = Field(description="Initial conditions")
-    outputs: List[str] = Field(description="Output variables")
-    simulation_controls: List[str] = Field(description="User-controllable parameters")
-    constraints: Optional[List[str]] = Field(default_factory=list, description="System constraints")
-    
-    @field_validator('simulation_name')
-    @classmethod
-    def validate_simulation_name(cls, v):
-        if not v or not v.strip():
-            raise ValueError("Simulation name cannot be empty")
-        return v.strip()
-    
-    @field_validator('domain')
-    @classmethod
-    def validate_domain(cls, v):
-        if not v or not v.strip():
-            raise ValueError("Domain cannot be empty")
-        return v.strip()
+# SSD output models live in ssd_schema.py (shared with Agent 1 schema-guided decoding)
 
 
 class DatasetEntry(BaseModel):
@@ -352,13 +312,28 @@ class ValidationFeedback(BaseModel):
     feedback_summary: str = Field(description="Brief evaluation summary")
 
 
+class BatchEntryFeedback(ValidationFeedback):
+    """Critic feedback for one entry of a batched critic call"""
+    entry_index: int = Field(description="1-based index of the evaluated entry")
+
+
+class BatchValidationFeedback(BaseModel):
+    """Critic agent's feedback for a batch of entries"""
+    evaluations: List[BatchEntryFeedback] = Field(description="One evaluation per entry, in order")
+
+
 # ==================== DIVERSITY MANAGER ====================
 
 class DiversityManager:
     """Manages domain rotation and tracks diversity metrics"""
     
-    def __init__(self, domain_catalog: Dict):
+    def __init__(self, domain_catalog: Dict, group_by_domain: bool = False, rng: Optional[random.Random] = None):
         self.domain_catalog = domain_catalog
+        # Own RNG for the rotation shuffles, so other users of the global random state cannot shift it
+        self.rng = rng or random.Random()
+        # Grouped: shuffled domains, each with its shuffled subcategories back to back, so
+        # requests in flight together share the domain section of the prompt prefix
+        self.group_by_domain = group_by_domain
         self.domain_queue = self._build_domain_queue()
         self.domain_counts = defaultdict(int)
         self.subcategory_counts = defaultdict(int)
@@ -367,11 +342,21 @@ class DiversityManager:
         
     def _build_domain_queue(self) -> List[tuple]:
         """Build a shuffled queue of (domain, subcategory) pairs"""
+        if self.group_by_domain:
+            domains = list(self.domain_catalog.items())
+            self.rng.shuffle(domains)
+            queue = []
+            for domain, info in domains:
+                subcategories = list(info['subcategories'])
+                self.rng.shuffle(subcategories)
+                queue.extend((domain, subcat) for subcat in subcategories)
+            return queue
+        
         queue = []
         for domain, info in self.domain_catalog.items():
             for subcat in info['subcategories']:
                 queue.append((domain, subcat))
-        random.shuffle(queue)
+        self.rng.shuffle(queue)
         return queue
     
     def get_next_domain_target(self) -> tuple:
@@ -385,19 +370,43 @@ class DiversityManager:
         
         return domain, subcategory
     
+    def claim_target(self, domain: str, subcategory: str):
+        """Count a target that was drawn and completed before a restart, and take it off the queue"""
+        if not self.domain_queue:
+            self.domain_queue = self._build_domain_queue()
+        if (domain, subcategory) in self.domain_queue:
+            self.domain_queue.remove((domain, subcategory))
+        self.domain_counts[domain] += 1
+        self.subcategory_counts[f"{domain}::{subcategory}"] += 1
+    
     def get_topic_suggestions(self, domain: str) -> List[str]:
-        """Get topic suggestions for a domain, avoiding recent topics"""
+        """Get topic suggestions for a domain, avoiding recently hinted topics"""
         topics = self.domain_catalog.get(domain, {}).get('example_topics', [])
         # Filter out recently used topics
         available = [t for t in topics if t not in self.topic_history[-20:]]
         return available if available else topics
     
-    def record_generated(self, domain: str, topic: str):
-        """Record a generated simulation"""
-        self.topic_history.append(topic)
+    def record_topics(self, topics: List[str]):
+        """Record the topic hints given to a target (in draw order, so the history is the same at any concurrency)"""
+        self.topic_history.extend(topics)
         if len(self.topic_history) > self.max_topic_history:
             self.topic_history = self.topic_history[-self.max_topic_history:]
     
+    def state_dict(self) -> Dict:
+        """JSON-serializable rotation state (for checkpoint snapshots)"""
+        return {
+            'domain_queue': [list(pair) for pair in self.domain_queue],
+            'domain_counts': dict(self.domain_counts),
+            'subcategory_counts': dict(self.subcategory_counts),
+            'topic_history': list(self.topic_history),
+        }
+    
+    def load_state_dict(self, state: Dict):
+        self.domain_queue = [tuple(pair) for pair in state['domain_queue']]
+        self.domain_counts = defaultdict(int, state['domain_counts'])
+        self.subcategory_counts = defaultdict(int, state['subcategory_counts'])
+        self.topic_history = list(state['topic_history'])
+    
     def get_diversity_stats(self) -> Dict:
         """Get diversity statistics"""
         return {
@@ -460,48 +469,134 @@ def select_diverse_examples(
     return selected
 
 
-# ==================== ENHANCED PROMPT CONSTRUCTION ====================
-
-def build_targeted_generation_prompt(
-    examples: List[Dict],
-    target_domain: str,
-    target_subcategory: str,
-    topic_suggestions: List[str]
-) -> ChatPromptTemplate:
-    """Build a domain-targeted generation prompt"""
+class ExamplePool:
+    """
+    Few-shot example pool indexed by output domain.
     
-    # Format examples (escape for LangChain)
-    example_text = "\n\n".join([
-        f"EXAMPLE {i+1}:\n"
-        f"Input: {ex['input']}\n"
-        f"Output Domain: {ex['output'].get('domain', 'Unknown')}\n"
-        f"Output Type: {ex['output'].get('simulation_name', 'Unknown')}"
-        for i, ex in enumerate(examples)
-    ])
+    Sampling "not in domain X" draws k positions from the complement and maps them through
+    per-domain offsets, so it costs O(domains + k) instead of rescanning every entry.
+    Accepted entries can be added as generation proceeds. With selection="embedding",
+    a wider candidate set is narrowed to the examples least similar to the target domain's
+    centroid and to each other (hashed bag-of-words vectors of the input text).
+    """
     
-    # Format topic suggestions
-    topic_hint = ", ".join(random.sample(topic_suggestions, min(5, len(topic_suggestions))))
+    EMBED_DIM = 512
+    CANDIDATE_FACTOR = 4
+    
+    def __init__(self, data: List[Dict], selection: str = "random"):
+        if selection not in ("random", "embedding"):
+            raise ValueError(f"Unknown example selection: {selection}")
+        self.selection = selection
+        self.entries: List[Dict] = []
+        self.by_domain: Dict[str, List[int]] = defaultdict(list)
+        self.vectors: List[np.ndarray] = []
+        self.domain_centroids: Dict[str, np.ndarray] = {}
+        for entry in data:
+            self.add(entry)
+    
+    def __len__(self) -> int:
+        return len(self.entries)
     
-    prompt_template = f"""You are an expert in {target_domain}, specifically in {target_subcategory}.
+    @staticmethod
+    def _domain(entry: Dict) -> str:
+        return (entry.get('output') or {}).get('domain') or ''
+    
+    @classmethod
+    def _embed(cls, text: str) -> np.ndarray:
+        vector = np.zeros(cls.EMBED_DIM, dtype=np.float32)
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            # crc32, not hash(): str hashes are salted per process, which would change selections between runs
+            vector[zlib.crc32(word.encode('utf-8')) % cls.EMBED_DIM] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def add(self, entry: Dict):
+        """Index a new example in O(1) (plus its text length when embedding)"""
+        idx = len(self.entries)
+        domain = self._domain(entry)
+        self.entries.append(entry)
+        self.by_domain[domain].append(idx)
+        if self.selection == "embedding":
+            vector = self._embed(str(entry.get('input', '')))
+            self.vectors.append(vector)
+            if domain in self.domain_centroids:
+                self.domain_centroids[domain] = self.domain_centroids[domain] + vector
+            else:
+                self.domain_centroids[domain] = vector.copy()
+    
+    def _sample_indices_excluding(self, target_domain: str, k: int, rng) -> List[int]:
+        others = [(d, ids) for d, ids in self.by_domain.items() if d != target_domain and ids]
+        offsets, total = [], 0
+        for _, ids in others:
+            offsets.append(total)
+            total += len(ids)
+        
+        # If not enough different examples, use all data
+        if total < k:
+            return rng.sample(range(len(self.entries)), min(k, len(self.entries)))
+        
+        picked = []
+        for position in rng.sample(range(total), k):
+            slot = bisect.bisect_right(offsets, position) - 1
+            picked.append(others[slot][1][position - offsets[slot]])
+        return picked
+    
+    def select(self, target_domain: str, num_examples: int = 5, rng: Optional[random.Random] = None) -> List[Dict]:
+        """
+        Examples from domains other than target_domain (drop-in for select_diverse_examples).
+        rng draws the candidates (default: the global random state).
+        """
+        rng = rng or random
+        if self.selection == "random":
+            selected = [self.entries[i] for i in self._sample_indices_excluding(target_domain, num_examples, rng)]
+            logger.debug(f"Selected {len(selected)} examples from different domains than {target_domain}")
+            return selected
+        
+        candidates = self._sample_indices_excluding(target_domain, num_examples * self.CANDIDATE_FACTOR, rng)
+        if len(candidates) <= num_examples:
+            return [self.entries[i] for i in candidates]
+        
+        # Greedy farthest-point: the target centroid acts as an already chosen point
+        matrix = np.stack([self.vectors[i] for i in candidates])
+        centroid = self.domain_centroids.get(target_domain)
+        if centroid is not None and np.linalg.norm(centroid) > 0:
+            closest = matrix @ (centroid / np.linalg.norm(centroid))
+        else:
+            closest = np.full(len(candidates), -1.0, dtype=np.float32)
+        chosen = []
+        for _ in range(num_examples):
+            pick = int(np.argmin(np.where(np.isin(np.arange(len(candidates)), chosen), np.inf, closest)))
+            chosen.append(pick)
+            closest = np.maximum(closest, matrix @ matrix[pick])
+        logger.debug(f"Selected {len(chosen)} dissimilar examples from different domains than {target_domain}")
+        return [self.entries[candidates[i]] for i in chosen]
 
-Your task is to generate a COMPLETELY NEW and CREATIVE simulation description in the field of {target_domain} ({target_subcategory}).
 
-CRITICAL REQUIREMENTS:
-1. The simulation MUST be in the domain: {target_domain}
-2. The simulation MUST focus on: {target_subcategory}
-3. INSPIRATION (not limitations): Example topics include {topic_hint} - but FEEL FREE to create entirely new experiments, procedures, or simulations beyond these examples
-4. The simulation MUST be COMPLETELY DIFFERENT from all examples below
-5. Use realistic equations, parameters, and physical principles from {target_domain}
-6. BE CREATIVE: Invent new lab procedures, combine concepts, or design novel experiments within {target_subcategory}
+# ==================== ENHANCED PROMPT CONSTRUCTION ====================
 
-EXAMPLES FROM OTHER DOMAINS (DO NOT COPY - THESE ARE DIFFERENT FIELDS):
-{example_text}
+# Prompts are laid out as a static prefix (identical for every request) followed by the
+# variable sections, least variable first (domain, subcategory, topics, examples), so a
+# prefix-caching server (vLLM --enable-prefix-caching) reuses the KV cache of the prefix.
+
+TOPIC_HINTS = 5  # example topics suggested per generation prompt
+
+GENERATION_SYSTEM_PROMPT = "You are an expert scientist and engineer. Generate accurate, diverse simulation specifications."
+
+GENERATION_INSTRUCTIONS = """Your task is to generate a COMPLETELY NEW and CREATIVE simulation description in the TARGET DOMAIN and TARGET SUBCATEGORY given at the end of this message.
+
+CRITICAL REQUIREMENTS:
+1. The simulation MUST be in the TARGET DOMAIN
+2. The simulation MUST focus on the TARGET SUBCATEGORY
+3. INSPIRATION (not limitations): the TOPIC HINTS are example topics - but FEEL FREE to create entirely new experiments, procedures, or simulations beyond these examples
+4. The simulation MUST be COMPLETELY DIFFERENT from all EXAMPLES FROM OTHER DOMAINS
+5. Use realistic equations, parameters, and physical principles from the TARGET DOMAIN
+6. BE CREATIVE: Invent new lab procedures, combine concepts, or design novel experiments within the TARGET SUBCATEGORY
 
 WHAT TO GENERATE:
-- Create an original simulation that a student, researcher, or engineer in {target_domain} would actually use
+- Create an original simulation that a student, researcher, or engineer in the TARGET DOMAIN would actually use
 - You can design NEW lab procedures, experiments, or analytical methods not listed in the examples
-- Include proper mathematical equations relevant to {target_subcategory}
-- Use standard terminology and notation from {target_domain}
+- Include proper mathematical equations relevant to the TARGET SUBCATEGORY
+- Use standard terminology and notation from the TARGET DOMAIN
 - Make it scientifically accurate with realistic parameters
 - Ensure the simulation is practical, educational, and innovative
 
@@ -511,7 +606,7 @@ Your response must be a JSON object with these THREE fields:
 2. "input": Natural language description of what the user wants to simulate (2-4 sentences)
 3. "output": Complete structured SSD specification with:
    - simulation_name: Descriptive name (e.g., "Doppler Effect Analyzer", "Enzyme Kinetics Model")
-   - domain: MUST be "{target_domain}"
+   - domain: MUST be exactly the TARGET DOMAIN
    - description: What the simulation does
    - assumptions: List of simplifying assumptions
    - entities: Physical objects/components (if applicable)
@@ -524,44 +619,61 @@ Your response must be a JSON object with these THREE fields:
    - constraints: System limitations
 
 CRITICAL: 
-- Domain must be EXACTLY "{target_domain}"
-- Must focus on {target_subcategory}
+- Domain must be EXACTLY the TARGET DOMAIN
+- Must focus on the TARGET SUBCATEGORY
 - Must be different from all examples
 - Must be scientifically accurate
-- Return ONLY the JSON object, no other text
+- Return ONLY the JSON object, no other text"""
 
-Generate the simulation now:"""
 
-    return ChatPromptTemplate.from_messages([
-        ("system", f"You are an expert in {target_domain} and {target_subcategory}. Generate accurate, diverse simulation specifications."),
-        ("user", prompt_template)
-    ])
-
-
-def build_validation_prompt(entry: Dict, examples: List[Dict], target_domain: str) -> ChatPromptTemplate:
-    """Build the validation prompt for critic agent"""
+def build_targeted_generation_prompt(
+    examples: List[Dict],
+    target_domain: str,
+    target_subcategory: str,
+    topic_suggestions: List[str]
+) -> ChatPromptTemplate:
+    """
+    Build a domain-targeted generation prompt (static instructions first, targets last).
+    topic_suggestions are the hints picked for this target; the first TOPIC_HINTS are shown, in order.
+    """
     
-    example_summaries = "\n".join([
-        f"  - {ex['output']['domain']}: {ex['output']['simulation_name']}"
-        for ex in examples[:3]
-    ])
+    # Format examples (escape for LangChain)
+    example_text = "\n\n".join([
+        f"EXAMPLE {i+1}:\n"
+        f"Input: {ex['input']}\n"
+        f"Output Domain: {ex['output'].get('domain', 'Unknown')}\n"
+        f"Output Type: {ex['output'].get('simulation_name', 'Unknown')}"
+        for i, ex in enumerate(examples)
+    ]).replace('{', '{{').replace('}', '}}')
     
-    prompt_template = f"""You are an expert scientific reviewer validating simulation descriptions for a high-quality dataset.
+    # Format topic suggestions
+    topic_hint = ", ".join(topic_suggestions[:TOPIC_HINTS])
+    
+    prompt_template = f"""{GENERATION_INSTRUCTIONS}
 
 TARGET DOMAIN: {target_domain}
+TARGET SUBCATEGORY: {target_subcategory}
+You are an expert in {target_domain}, specifically in {target_subcategory}.
 
-ENTRY TO VALIDATE:
-```json
-{json.dumps(entry, indent=2).replace('{', '{{').replace('}', '}}')}
-```
+TOPIC HINTS: {topic_hint}
 
-EXISTING EXAMPLES FOR COMPARISON:
-{example_summaries}
+EXAMPLES FROM OTHER DOMAINS (DO NOT COPY - THESE ARE DIFFERENT FIELDS):
+{example_text}
+
+Generate the simulation now:"""
 
-VALIDATION CRITERIA:
+    return ChatPromptTemplate.from_messages([
+        ("system", GENERATION_SYSTEM_PROMPT),
+        ("user", prompt_template)
+    ])
+
+
+def _validation_criteria(domain_text: str) -> str:
+    """Critic rubric; domain_text names the domain an entry must match"""
+    return f"""VALIDATION CRITERIA:
 
 1. **Domain Accuracy** (CRITICAL): 
-   - Domain must be EXACTLY "{target_domain}"
+   - Domain must be EXACTLY {domain_text}
    - If domain doesn't match, score 0.0 and REJECT
 
 2. **Scientific Accuracy** (0-10):
@@ -599,18 +711,169 @@ QUALITY THRESHOLDS:
 - Overall quality ≥ 7.0 → ACCEPT
 - Overall quality 5.0-6.9 → REVISE
 - Overall quality < 5.0 → REJECT
-- Any score < 4.0 in critical areas → REJECT
+- Any score < 4.0 in critical areas → REJECT"""
+
+
+CRITIC_SYSTEM_PROMPT = "You are a rigorous scientific reviewer ensuring data quality."
+
+CRITIC_INSTRUCTIONS = f"""You are an expert scientific reviewer validating simulation descriptions for a high-quality dataset.
+
+{_validation_criteria("the TARGET DOMAIN given with the entry")}"""
+
+
+def build_validation_prompt(entry: Dict, examples: List[Dict], target_domain: str) -> ChatPromptTemplate:
+    """Build the validation prompt for critic agent (static rubric first, entry last)"""
+    
+    example_summaries = "\n".join([
+        f"  - {ex['output']['domain']}: {ex['output']['simulation_name']}"
+        for ex in examples[:3]
+    ]).replace('{', '{{').replace('}', '}}')
+    
+    prompt_template = f"""{CRITIC_INSTRUCTIONS}
+
+Provide detailed feedback with scores, issues, strengths, and recommendation.
+
+TARGET DOMAIN: {target_domain}
+
+ENTRY TO VALIDATE:
+```json
+{json.dumps(entry, indent=2).replace('{', '{{').replace('}', '}}')}
+```
+
+EXISTING EXAMPLES FOR COMPARISON:
+{example_summaries}"""
+
+    return ChatPromptTemplate.from_messages([
+        ("system", CRITIC_SYSTEM_PROMPT),
+        ("user", prompt_template)
+    ])
+
 
-Provide detailed feedback with scores, issues, strengths, and recommendation."""
+def build_batch_validation_prompt(items: List[tuple]) -> ChatPromptTemplate:
+    """Build one critic prompt scoring several (entry, examples, target_domain) items"""
+    
+    summaries = []
+    for _, examples, _ in items:
+        for ex in examples[:3]:
+            summary = f"  - {ex['output']['domain']}: {ex['output']['simulation_name']}"
+            if summary not in summaries:
+                summaries.append(summary)
+    example_summaries = "\n".join(summaries[:10]).replace('{', '{{').replace('}', '}}')
+    
+    entries_text = "\n\n".join(
+        f"ENTRY {i}\nTARGET DOMAIN: {target_domain}\n```json\n"
+        f"{json.dumps(entry, indent=2).replace('{', '{{').replace('}', '}}')}\n```"
+        for i, (entry, _, target_domain) in enumerate(items, 1)
+    )
+    
+    prompt_template = f"""{CRITIC_INSTRUCTIONS}
+
+Evaluate each entry below independently; each has its own TARGET DOMAIN.
+Return one evaluation per entry in "evaluations", in order, with "entry_index" set to the ENTRY number.
+Provide detailed feedback with scores, issues, strengths, and recommendation for each entry.
+
+You will evaluate {len(items)} entries.
+
+{entries_text}
+
+EXISTING EXAMPLES FOR COMPARISON:
+{example_summaries}"""
 
     return ChatPromptTemplate.from_messages([
-        ("system", "You are a rigorous scientific reviewer ensuring data quality."),
+        ("system", CRITIC_SYSTEM_PROMPT),
         ("user", prompt_template)
     ])
 
 
 # ==================== ENHANCED GENERATION ENGINE ====================
 
+class PrefixShareTracker:
+    """
+    Estimates what a prefix-caching server could reuse: for each prompt, the longest common
+    prefix with any of the last `window` prompts of the same kind, as a share of its length.
+    """
+    
+    def __init__(self, window: int = 32):
+        self.recent: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self.shared_chars: Dict[str, int] = defaultdict(int)
+        self.total_chars: Dict[str, int] = defaultdict(int)
+    
+    @staticmethod
+    def _common_prefix_length(a: str, b: str) -> int:
+        # Binary search on slice equality (C-speed comparisons instead of a per-character loop)
+        low, high = 0, min(len(a), len(b))
+        while low < high:
+            mid = (low + high + 1) // 2
+            if a[:mid] == b[:mid]:
+                low = mid
+            else:
+                high = mid - 1
+        return low
+    
+    def observe(self, kind: str, messages: List) -> None:
+        text = "\n".join(str(m.content) for m in messages)
+        recent = self.recent[kind]
+        shared = max((self._common_prefix_length(text, prev) for prev in recent), default=0)
+        recent.append(text)
+        self.shared_chars[kind] += shared
+        self.total_chars[kind] += len(text)
+    
+    def summary(self) -> str:
+        return ", ".join(
+            f"{kind} {self.shared_chars[kind] / self.total_chars[kind] * 100:.0f}%"
+            for kind in self.total_chars if self.total_chars[kind]
+        ) or "n/a"
+
+
+class CriticBatcher:
+    """
+    Collects critic requests from concurrent pipelines and scores them batch_size at a time.
+    A partial batch is flushed after max_wait seconds so the tail of a run never stalls.
+    """
+    
+    def __init__(self, score_batch, batch_size: int, max_wait: float = 2.0):
+        self.score_batch = score_batch  # async (items) -> feedback per item
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.items: List[tuple] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer = None
+        self.tasks = set()
+    
+    async def submit(self, entry: Dict, examples: List[Dict], target_domain: str) -> Optional[ValidationFeedback]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.items.append((entry, examples, target_domain))
+        self.futures.append(future)
+        if len(self.items) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+    
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.items:
+            return
+        items, futures = self.items, self.futures
+        self.items, self.futures = [], []
+        task = asyncio.ensure_future(self._score(items, futures))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+    
+    async def _score(self, items: List[tuple], futures: List[asyncio.Future]):
+        try:
+            results = await self.score_batch(items)
+        except Exception as e:
+            logger.error(f"Batched critic error: {e}")
+            results = [None] * len(items)
+        for future, feedback in zip(futures, results):
+            if not future.done():  # the pipeline may have been cancelled meanwhile
+                future.set_result(feedback)
+
+
 class SimulationGenerator:
     """Enhanced generator with diversity enforcement"""
     
@@ -621,7 +884,23 @@ class SimulationGenerator:
         temperature: float = 0.8,
         max_tokens: int = 2000,
         enable_critic: bool = True,
-        min_quality_score: float = 7.0
+        min_quality_score: float = 7.0,
+        dedup_threshold: float = 0.7,
+        example_selection: str = "random",
+        feed_back_examples: bool = False,
+        local_validation: bool = True,
+        critic_batch_size: int = 1,
+        group_by_domain: bool = False,
+        adaptive_rate: bool = True,
+        target_latency: float = 60.0,
+        response_cache: Optional[str] = None,
+        cache_ttl_days: float = 30.0,
+        cache_max_mb: int = 2048,
+        write_buffer_entries: int = 64,
+        write_buffer_seconds: float = 30.0,
+        shard_format: Optional[str] = None,
+        shard_entries: int = 10000,
+        seed: Optional[int] = None
     ):
         logger.info(f"Initializing Enhanced SimulationGenerator")
         logger.info(f"VLLM URL: {vllm_base_url}")
@@ -631,10 +910,67 @@ class SimulationGenerator:
         
         self.enable_critic = enable_critic
         self.min_quality_score = min_quality_score
+        # Entries scored per critic call; > 1 sends one rubric for several entries
+        self.critic_batch_size = max(1, critic_batch_size)
+        self.critic_batcher: Optional[CriticBatcher] = None
+        
+        # Near-duplicate index (MinHash/LSH over input text + equations); 0 disables
+        self.dedup_index = NearDuplicateIndex(threshold=dedup_threshold) if dedup_threshold else None
+        
+        # Deterministic SSD checks (schema, ranges, constants, symbols) before the critic
+        self.ssd_checker = SSDChecker() if local_validation else None
+        
+        # Run seed: the rotation and each sample's topic hints and few-shot picks are drawn from RNGs
+        # derived from it, so a seeded run renders the same prompts at any concurrency
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        
+        # Few-shot example pool (built from existing_data in generate_dataset). Fed-back entries wait in
+        # _fed_back and join the pool in sample order, feedback_lag samples behind the target being drawn.
+        self.example_selection = example_selection
+        self.feed_back_examples = feed_back_examples
+        self.example_pool: Optional[ExamplePool] = None
+        self._fed_back: Dict[int, Dict] = {}
+        self._feedback_lag = 1
         
         # Initialize diversity manager
-        self.diversity_manager = DiversityManager(DOMAIN_CATALOG)
-        logger.info(f"[OK] Diversity Manager initialized with {len(DOMAIN_CATALOG)} domains")
+        self.diversity_manager = DiversityManager(
+            DOMAIN_CATALOG, group_by_domain=group_by_domain, rng=random.Random(self.seed)
+        )
+        logger.info(f"[OK] Diversity Manager initialized with {len(DOMAIN_CATALOG)} domains"
+                    f"{' (grouped by domain)' if group_by_domain else ''}")
+        
+        # Estimated prompt prefix reuse across recent requests
+        self.prefix_tracker = PrefixShareTracker()
+        
+        # Targets drawn but not yet recorded (saved in snapshots), and snapshot targets to re-run first
+        self._in_flight: Dict[int, Dict] = {}
+        self._carry: List[Dict] = []
+        
+        # Prompt/completion tokens per call stage, settled per sample by outcome and domain
+        self.token_ledger = TokenLedger()
+        
+        # Persistent response cache (SQLite path); replays of a run are served from it
+        self.response_cache = ResponseCache(
+            response_cache, ttl_seconds=cache_ttl_days * 86400, max_bytes=cache_max_mb * 1024 ** 2
+        ) if response_cache else None
+        if self.response_cache is not None:
+            logger.info(f"[OK] Response cache: {response_cache} ({len(self.response_cache)} responses)")
+        
+        # Buffered, segment-journaled output writer (opened per output file in generate_dataset)
+        self.writer_options = {
+            'flush_entries': write_buffer_entries,
+            'flush_seconds': write_buffer_seconds,
+            'shard_format': shard_format,
+            'shard_entries': shard_entries,
+        }
+        self.writer: Optional[DatasetWriter] = None
+        
+        # AIMD in-flight limit + jittered backoff around every LLM call (created per run in generate_dataset).
+        # It owns retries, so the clients do not retry on their own.
+        self.adaptive_rate = adaptive_rate
+        self.target_latency = target_latency
+        self.rate_limiter: Optional[AdaptiveLimiter] = None
+        client_retries = 0 if adaptive_rate else 2
         
         # Generator LLM
         self.generator_llm = ChatOpenAI(
@@ -644,7 +980,7 @@ class SimulationGenerator:
             temperature=temperature,
             max_tokens=max_tokens,
             timeout=120,
-            max_retries=2
+            max_retries=client_retries
         )
         
         # Critic LLM
@@ -655,14 +991,27 @@ class SimulationGenerator:
             temperature=0.3,
             max_tokens=1500,
             timeout=120,
-            max_retries=2
+            max_retries=client_retries
+        )
+        
+        # Batched critic LLM (room for one evaluation per entry)
+        self.batch_critic_llm = ChatOpenAI(
+            base_url=vllm_base_url,
+            api_key="EMPTY",
+            model=model_name,
+            temperature=0.3,
+            max_tokens=1500 * self.critic_batch_size,
+            timeout=120 * self.critic_batch_size,
+            max_retries=client_retries
         )
         
         # Structured output setup
         self.use_structured = False
         try:
-            self.structured_generator = self.generator_llm.with_structured_output(DatasetEntry)
-            self.structured_critic = self.critic_llm.with_structured_output(ValidationFeedback)
+            # include_raw keeps the AIMessage so token usage can be recorded
+            self.structured_generator = self.generator_llm.with_structured_output(DatasetEntry, include_raw=True)
+            self.structured_critic = self.critic_llm.with_structured_output(ValidationFeedback, include_raw=True)
+            self.structured_batch_critic = self.batch_critic_llm.with_structured_output(BatchValidationFeedback, include_raw=True)
             self.use_structured = True
             logger.info("[OK] Structured output enabled")
         except:
@@ -674,6 +1023,11 @@ class SimulationGenerator:
             'accepted': 0,
             'rejected': 0,
             'domain_mismatch': 0,
+            'near_duplicates': 0,
+            'critic_calls': 0,
+            'critic_batches': 0,
+            'critic_tokens': 0,
+            'critic_seconds': 0.0,
             'quality_scores': []
         }
     
@@ -683,7 +1037,8 @@ class SimulationGenerator:
         try:
             from langchain_core.messages import HumanMessage
             test_messages = [HumanMessage(content="Test connection. Respond: OK")]
-            response = self.generator_llm.invoke(test_messages)
+            response = self._call_llm(self.generator_llm, test_messages)
+            self.token_ledger.charge('api_test', *message_usage(response, test_messages)[:2])
             
             if hasattr(response, 'content'):
                 logger.info(f"✓ API connection successful")
@@ -695,43 +1050,341 @@ class SimulationGenerator:
             logger.error(f"✗ API test failed: {e}")
             return False
     
+    # call kind -> (client attribute, structured output schema)
+    _CACHED_CALLS = {
+        'generator': ('generator_llm', DatasetEntry),
+        'critic': ('critic_llm', ValidationFeedback),
+        'batch_critic': ('batch_critic_llm', BatchValidationFeedback),
+    }
+
+    def _cache_key(self, kind: Optional[str], variant: str, messages: List) -> Optional[str]:
+        if self.response_cache is None or kind is None:
+            return None
+        client = getattr(self, self._CACHED_CALLS[kind][0])
+        return cache_key(
+            getattr(client, 'model_name', ''), getattr(client, 'temperature', None), getattr(client, 'max_tokens', None),
+            f"{kind}/structured" if self.use_structured else kind, variant, messages
+        )
+
+    def _cached(self, key: Optional[str], kind: Optional[str]):
+        if key is None:
+            return None
+        return self.response_cache.get(key, self._CACHED_CALLS[kind][1])
+
+    def _latency_target(self, kind: Optional[str]) -> float:
+        """Batched critic calls score critic_batch_size entries (and get that many times the tokens and timeout)"""
+        if kind == 'batch_critic':
+            return self.target_latency * self.critic_batch_size
+        return self.target_latency
+
+    def _call_llm(self, runnable, messages: List, kind: Optional[str] = None, variant: str = ""):
+        """invoke() through the response cache (kind set) and the rate limiter"""
+        key = self._cache_key(kind, variant, messages)
+        result = self._cached(key, kind)
+        if result is not None:
+            return result
+        if self.rate_limiter is None:
+            result = runnable.invoke(messages)
+        else:
+            result = self.rate_limiter.call_sync(lambda: runnable.invoke(messages), self._latency_target(kind))
+        if key is not None:
+            self.response_cache.put(key, result)
+        return result
+
+    async def _acall_llm(self, runnable, messages: List, kind: Optional[str] = None, variant: str = ""):
+        key = self._cache_key(kind, variant, messages)
+        result = self._cached(key, kind)
+        if result is not None:
+            return result
+        if self.rate_limiter is None:
+            result = await runnable.ainvoke(messages)
+        else:
+            result = await self.rate_limiter.call(lambda: runnable.ainvoke(messages), self._latency_target(kind))
+        if key is not None:
+            self.response_cache.put(key, result)
+        return result
+
+    def _log_rate_metrics(self):
+        if self.rate_limiter is not None:
+            logger.info(f"[RATE] {self.rate_limiter.describe()}")
+
+    def _critic_runnable(self, batch: bool = False):
+        if self.use_structured:
+            return self.structured_batch_critic if batch else self.structured_critic
+        return self.batch_critic_llm if batch else self.critic_llm
+
+    def _unwrap_critic_result(self, result, messages: List, started: float, entries: List[Dict]):
+        """Record critic call, tokens and latency; return (parsed structured output or None, raw message)"""
+        raw, parsed = (result['raw'], result['parsed']) if self.use_structured else (result, None)
+        prompt_tokens, completion_tokens, estimated = message_usage(raw, messages)
+        tokens = self.token_ledger.charge(
+            'critic_batch' if len(entries) > 1 else 'critic', prompt_tokens, completion_tokens,
+            self.token_ledger.owners(entries), estimated
+        )
+        self.stats['critic_calls'] += 1
+        self.stats['critic_tokens'] += tokens
+        self.stats['critic_seconds'] += time.time() - started
+        return parsed, raw
+
+    @staticmethod
+    def _extract_json(content: str) -> Optional[Any]:
+        start_idx = content.find('{')
+        end_idx = content.rfind('}') + 1
+        if start_idx == -1 or end_idx == 0:
+            logger.error("No JSON in critic response")
+            return None
+        return json.loads(content[start_idx:end_idx])
+
+    def _parse_feedback(self, parsed, raw) -> Optional[ValidationFeedback]:
+        """Critic result -> ValidationFeedback (structured output or JSON parsing fallback)"""
+        if self.use_structured:
+            if parsed is None:
+                raise ValueError("Critic structured output could not be parsed")
+            return parsed
+
+        feedback_dict = self._extract_json(raw.content)
+        return ValidationFeedback(**feedback_dict) if feedback_dict is not None else None
+
+    def _parse_batch_feedback(self, parsed, raw, count: int) -> List[Optional[ValidationFeedback]]:
+        """Batched critic result -> feedback per entry (None where the batch has no usable evaluation)"""
+        if self.use_structured:
+            evaluations = parsed.evaluations if parsed is not None else []
+        else:
+            content = raw.content
+            # A bare JSON list of evaluations is accepted too
+            if content.lstrip().startswith('['):
+                data = json.loads(content[content.find('['):content.rfind(']') + 1])
+            else:
+                data = (self._extract_json(content) or {}).get('evaluations', [])
+            evaluations = []
+            for item in data:
+                try:
+                    evaluations.append(BatchEntryFeedback(**item))
+                except Exception as e:
+                    logger.warning(f"Unusable evaluation in batched critic response: {e}")
+
+        results: List[Optional[ValidationFeedback]] = [None] * count
+        for evaluation in evaluations:
+            idx = evaluation.entry_index - 1
+            if 0 <= idx < count and results[idx] is None:
+                results[idx] = ValidationFeedback(**evaluation.model_dump(exclude={'entry_index'}))
+        return results
+
     def validate_with_critic(
-        self, 
-        entry: Dict, 
+        self,
+        entry: Dict,
         examples: List[Dict],
         target_domain: str
     ) -> Optional[ValidationFeedback]:
         """Validate with critic agent"""
         if not self.enable_critic:
             return None
-        
+
+        try:
+            messages = build_validation_prompt(entry, examples, target_domain).format_messages()
+            self.prefix_tracker.observe('critic', messages)
+            started = time.time()
+            result = self._call_llm(self._critic_runnable(), messages, kind='critic')
+            return self._parse_feedback(*self._unwrap_critic_result(result, messages, started, [entry]))
+        except Exception as e:
+            logger.error(f"Critic validation error: {e}")
+            return None
+
+    async def avalidate_with_critic(
+        self,
+        entry: Dict,
+        examples: List[Dict],
+        target_domain: str
+    ) -> Optional[ValidationFeedback]:
+        """Async validate_with_critic (used by the concurrent pipeline)"""
+        if not self.enable_critic:
+            return None
+
+        try:
+            messages = build_validation_prompt(entry, examples, target_domain).format_messages()
+            self.prefix_tracker.observe('critic', messages)
+            started = time.time()
+            result = await self._acall_llm(self._critic_runnable(), messages, kind='critic')
+            return self._parse_feedback(*self._unwrap_critic_result(result, messages, started, [entry]))
+        except Exception as e:
+            logger.error(f"Critic validation error: {e}")
+            return None
+
+    def _batch_feedback_or_none(self, result, messages: List, started: float, items: List[tuple]) -> List[Optional[ValidationFeedback]]:
+        count = len(items)
+        try:
+            return self._parse_batch_feedback(
+                *self._unwrap_critic_result(result, messages, started, [item[0] for item in items]), count
+            )
+        except Exception as e:
+            logger.error(f"Batched critic parse error: {e}")
+            return [None] * count
+
+    def _critic_key(self, item: tuple) -> Optional[str]:
+        """Response cache key of the single-entry critic call for an (entry, examples, target_domain) item"""
+        return self._cache_key('critic', '', build_validation_prompt(*item).format_messages())
+
+    def _judged_before(self, items: List[tuple]) -> List[int]:
+        """Indices of items whose single-entry evaluation is cached (from a single or any batched call)"""
+        if self.response_cache is None:
+            return []
+        return [i for i, item in enumerate(items) if self._critic_key(item) in self.response_cache]
+
+    def _store_batch_feedback(self, items: List[tuple], results: List[Optional[ValidationFeedback]]):
+        """
+        Cache each evaluation of a batched call under its entry's single-entry key: batches are formed
+        in completion order, so a replay at concurrency > 1 groups the same entries differently
+        """
+        if self.response_cache is None:
+            return
+        for item, feedback in zip(items, results):
+            if feedback is not None:
+                raw = AIMessage(content=feedback.model_dump_json())
+                self.response_cache.put(self._critic_key(item), {'raw': raw, 'parsed': feedback} if self.use_structured else raw)
+
+    def validate_batch_with_critic(self, items: List[tuple]) -> List[Optional[ValidationFeedback]]:
+        """
+        Score several (entry, examples, target_domain) items in one critic call.
+        Entries judged before are served one by one from the response cache; entries without a
+        usable evaluation fall back to validate_with_critic.
+        """
+        if len(items) == 1:
+            return [self.validate_with_critic(*items[0])]
+
+        results: List[Optional[ValidationFeedback]] = [None] * len(items)
+        judged = self._judged_before(items)
+        for i in judged:
+            results[i] = self.validate_with_critic(*items[i])
+        todo = [i for i in range(len(items)) if i not in judged]
+        if len(todo) == 1:
+            results[todo[0]] = self.validate_with_critic(*items[todo[0]])
+            return results
+        if not todo:
+            return results
+
+        batch = [items[i] for i in todo]
+        try:
+            messages = build_batch_validation_prompt(batch).format_messages()
+            self.prefix_tracker.observe('critic', messages)
+            started = time.time()
+            self.stats['critic_batches'] += 1
+            result = self._call_llm(self._critic_runnable(batch=True), messages, kind='batch_critic')
+            scored = self._batch_feedback_or_none(result, messages, started, batch)
+            self._store_batch_feedback(batch, scored)
+            for i, feedback in zip(todo, scored):
+                results[i] = feedback
+        except Exception as e:
+            logger.error(f"Batched critic error: {e}")
+
+        missing = [i for i in todo if results[i] is None]
+        if missing:
+            logger.warning(f"Batched critic: no evaluation for {len(missing)}/{len(batch)} entries - scoring them one by one")
+        for i in missing:
+            results[i] = self.validate_with_critic(*items[i])
+        return results
+
+    async def avalidate_batch_with_critic(self, items: List[tuple]) -> List[Optional[ValidationFeedback]]:
+        """Async validate_batch_with_critic (used by CriticBatcher)"""
+        if len(items) == 1:
+            return [await self.avalidate_with_critic(*items[0])]
+
+        results: List[Optional[ValidationFeedback]] = [None] * len(items)
+        judged = self._judged_before(items)
+        for i in judged:
+            results[i] = await self.avalidate_with_critic(*items[i])
+        todo = [i for i in range(len(items)) if i not in judged]
+        if len(todo) == 1:
+            results[todo[0]] = await self.avalidate_with_critic(*items[todo[0]])
+            return results
+        if not todo:
+            return results
+
+        batch = [items[i] for i in todo]
+        try:
+            messages = build_batch_validation_prompt(batch).format_messages()
+            self.prefix_tracker.observe('critic', messages)
+            started = time.time()
+            self.stats['critic_batches'] += 1
+            result = await self._acall_llm(self._critic_runnable(batch=True), messages, kind='batch_critic')
+            scored = self._batch_feedback_or_none(result, messages, started, batch)
+            self._store_batch_feedback(batch, scored)
+            for i, feedback in zip(todo, scored):
+                results[i] = feedback
+        except Exception as e:
+            logger.error(f"Batched critic error: {e}")
+
+        missing = [i for i in todo if results[i] is None]
+        if missing:
+            logger.warning(f"Batched critic: no evaluation for {len(missing)}/{len(batch)} entries - scoring them one by one")
+            fallback = await asyncio.gather(*(self.avalidate_with_critic(*items[i]) for i in missing))
+            for i, feedback in zip(missing, fallback):
+                results[i] = feedback
+        return results
+
+    def _generation_request(self, examples: List[Dict], target_domain: str, target_subcategory: str, topic_suggestions: List[str]):
+        """(runnable, rendered messages) for one generation call"""
+        messages = build_targeted_generation_prompt(
+            examples,
+            target_domain,
+            target_subcategory,
+            topic_suggestions
+        ).format_messages()
+        self.prefix_tracker.observe('generator', messages)
+        return (self.structured_generator if self.use_structured else self.generator_llm), messages
+
+    def _parse_generated(self, result, messages: List, simulation_number: int,
+                         target_domain: str, target_subcategory: str) -> Optional[Dict]:
+        """
+        Generator chain result -> entry, or None if it has no JSON, misses fields or the domain is wrong.
+        The call's tokens are charged to sample simulation_number as generation, domain_mismatch or generation_error.
+        """
+        raw = result['raw'] if self.use_structured else result
+        stage = 'generation_error'
         try:
-            prompt = build_validation_prompt(entry, examples, target_domain)
-            
             if self.use_structured:
-                chain = prompt | self.structured_critic
-                feedback = chain.invoke({})
+                if result['parsed'] is None:
+                    raise ValueError(f"Structured output parse error: {result.get('parsing_error')}")
+                entry = result['parsed'].dict()
             else:
-                chain = prompt | self.critic_llm
-                response = chain.invoke({})
-                content = response.content
-                
+                content = result.content
+
                 start_idx = content.find('{')
                 end_idx = content.rfind('}') + 1
+
                 if start_idx == -1 or end_idx == 0:
-                    logger.error("No JSON in critic response")
+                    logger.error("No JSON in response")
                     return None
-                
+
                 json_str = content[start_idx:end_idx]
-                feedback_dict = json.loads(json_str)
-                feedback = ValidationFeedback(**feedback_dict)
-            
-            return feedback
-            
-        except Exception as e:
-            logger.error(f"Critic validation error: {e}")
-            return None
-    
+                entry = json.loads(json_str)
+
+            # Validate required fields
+            if 'input' not in entry or 'output' not in entry:
+                logger.error("Missing input/output")
+                return None
+
+            if 'instruction' not in entry:
+                entry['instruction'] = "Convert the following natural language simulation description into a structured SSD format with all necessary components."
+
+            # CHECK DOMAIN MATCH
+            generated_domain = entry['output'].get('domain', '')
+            if generated_domain != target_domain:
+                logger.warning(f"[X] Domain mismatch: expected '{target_domain}', got '{generated_domain}'")
+                self.stats['domain_mismatch'] += 1
+                stage = 'domain_mismatch'
+                return None
+
+            stage = 'generation'
+            logger.info(f"[OK] Generated: {entry['output'].get('simulation_name', 'Unknown')}")
+            logger.info(f"  Domain: {generated_domain} ✓")
+            logger.info(f"  Subcategory: {target_subcategory}")
+            logger.info(f"  Parameters: {len(entry['output'].get('parameters', []))}")
+            logger.info(f"  Equations: {len(entry['output'].get('equations', []))}")
+            return entry
+        finally:
+            prompt_tokens, completion_tokens, estimated = message_usage(raw, messages)
+            self.token_ledger.charge(stage, prompt_tokens, completion_tokens, [simulation_number], estimated)
+
     def generate_single_entry(
         self,
         examples: List[Dict],
@@ -742,81 +1395,507 @@ class SimulationGenerator:
         max_retries: int = 3
     ) -> Optional[Dict]:
         """Generate a single simulation entry with domain targeting"""
-        
+
         logger.info(f"{'='*60}")
         logger.info(f"Generating #{simulation_number}: {target_domain} -> {target_subcategory}")
-        
+
         for attempt in range(max_retries + 1):
             try:
                 if attempt > 0:
                     logger.info(f"  Retry {attempt}/{max_retries}")
-                
-                prompt = build_targeted_generation_prompt(
-                    examples, 
-                    target_domain, 
-                    target_subcategory,
-                    topic_suggestions
-                )
-                
-                if self.use_structured:
-                    chain = prompt | self.structured_generator
-                    result = chain.invoke({})
-                    entry = result.dict()
-                else:
-                    chain = prompt | self.generator_llm
-                    response = chain.invoke({})
-                    content = response.content
-                    
-                    start_idx = content.find('{')
-                    end_idx = content.rfind('}') + 1
-                    
-                    if start_idx == -1 or end_idx == 0:
-                        logger.error("No JSON in response")
-                        continue
-                    
-                    json_str = content[start_idx:end_idx]
-                    entry = json.loads(json_str)
-                
-                # Validate required fields
-                if 'input' not in entry or 'output' not in entry:
-                    logger.error("Missing input/output")
-                    continue
-                
-                if 'instruction' not in entry:
-                    entry['instruction'] = "Convert the following natural language simulation description into a structured SSD format with all necessary components."
-                
-                # CHECK DOMAIN MATCH
-                generated_domain = entry['output'].get('domain', '')
-                if generated_domain != target_domain:
-                    logger.warning(f"[X] Domain mismatch: expected '{target_domain}', got '{generated_domain}'")
-                    self.stats['domain_mismatch'] += 1
-                    continue
-                
-                logger.info(f"[OK] Generated: {entry['output'].get('simulation_name', 'Unknown')}")
-                logger.info(f"  Domain: {generated_domain} ✓")
-                logger.info(f"  Subcategory: {target_subcategory}")
-                logger.info(f"  Parameters: {len(entry['output'].get('parameters', []))}")
-                logger.info(f"  Equations: {len(entry['output'].get('equations', []))}")
-                
-                return entry
-                
+
+                llm, messages = self._generation_request(examples, target_domain, target_subcategory, topic_suggestions)
+                # Variant: a retry must not be served the response it is retrying
+                result = self._call_llm(llm, messages, kind='generator', variant=f"{simulation_number}:{attempt}")
+                entry = self._parse_generated(result, messages, simulation_number, target_domain, target_subcategory)
+                if entry is not None:
+                    return entry
+
             except Exception as e:
                 logger.error(f"[X] Generation error (attempt {attempt+1}): {e}")
                 if attempt == max_retries:
                     return None
-        
+
         return None
-    
+
+    async def agenerate_single_entry(
+        self,
+        examples: List[Dict],
+        target_domain: str,
+        target_subcategory: str,
+        topic_suggestions: List[str],
+        simulation_number: int,
+        max_retries: int = 3
+    ) -> Optional[Dict]:
+        """Async generate_single_entry (used by the concurrent pipeline)"""
+
+        logger.info(f"Generating #{simulation_number}: {target_domain} -> {target_subcategory}")
+
+        for attempt in range(max_retries + 1):
+            try:
+                if attempt > 0:
+                    logger.info(f"  #{simulation_number} retry {attempt}/{max_retries}")
+
+                llm, messages = self._generation_request(examples, target_domain, target_subcategory, topic_suggestions)
+                result = await self._acall_llm(llm, messages, kind='generator', variant=f"{simulation_number}:{attempt}")
+                entry = self._parse_generated(result, messages, simulation_number, target_domain, target_subcategory)
+                if entry is not None:
+                    return entry
+
+            except Exception as e:
+                logger.error(f"[X] #{simulation_number} generation error (attempt {attempt+1}): {e}")
+                if attempt == max_retries:
+                    return None
+
+        return None
+
+    # ----- Per-sample pipeline: target -> generate -> validate -> critic -> outcome -----
+
+    def _has_next_target(self, target_size: int, run: Dict) -> bool:
+        return bool(self._carry) or run['drawn'] < target_size
+
+    def _next_number(self, run: Dict) -> int:
+        return self._carry[0]['number'] if self._carry else run['drawn'] + 1
+
+    @staticmethod
+    def _sample_rng(run: Dict, number: int, purpose: str) -> random.Random:
+        """RNG for one sample's random choices: depends only on the run seed, not on what ran before"""
+        return random.Random(f"{run['seed']}:{number}:{purpose}")
+
+    def _feedback_ready(self, run: Dict) -> bool:
+        """Whether every sample whose accepted entry the next target may see as an example is recorded"""
+        if not self.feed_back_examples:
+            return True
+        horizon = self._next_number(run) - self._feedback_lag
+        return not any(number <= horizon for number in self._in_flight)
+
+    def _release_feedback(self, number: int):
+        """Add fed-back entries of samples up to number - feedback_lag to the example pool, in sample order"""
+        horizon = number - self._feedback_lag
+        for done in sorted(n for n in self._fed_back if n <= horizon):
+            self.example_pool.add(self._fed_back.pop(done))
+
+    def _next_target(self, existing_data: List[Dict], num_examples: int, target_size: int, run: Dict) -> Dict:
+        """
+        Next target: targets carried over by a resume (in flight at the snapshot, or drawn after it
+        but never written) first, then draw from the diversity manager. Always called in sample
+        order, so the rotation is the same in both modes.
+        """
+        if self._carry:
+            target = self._carry.pop(0)
+            logger.info(f"\n--- Sample {target['number']}/{target_size} (re-run after resume) ---")
+        else:
+            target = self._draw_target(run)
+            logger.info(f"\n--- Sample {target['number']}/{target_size} ---")
+        logger.info(f"Target: {target['domain']} :: {target['subcategory']}")
+
+        # Select diverse examples (different from target domain)
+        self._release_feedback(target['number'])
+        target['examples'] = self.example_pool.select(
+            target['domain'], num_examples, rng=self._sample_rng(run, target['number'], 'examples')
+        )
+        self._in_flight[target['number']] = target
+        return target
+
+    def _draw_target(self, run: Dict) -> Dict:
+        run['drawn'] += 1
+        target_domain, target_subcategory = self.diversity_manager.get_next_domain_target()
+        suggestions = self.diversity_manager.get_topic_suggestions(target_domain)
+        topics = self._sample_rng(run, run['drawn'], 'topics').sample(suggestions, min(TOPIC_HINTS, len(suggestions)))
+        self.diversity_manager.record_topics(topics)
+        return {
+            'number': run['drawn'],
+            'domain': target_domain,
+            'subcategory': target_subcategory,
+            'topics': topics,
+        }
+
+    def _run_target(self, target: Dict, run_critic: bool = True) -> Dict:
+        """
+        Generate and validate one target; returns an outcome for _record_outcome.
+        With run_critic=False a valid entry is returned with 'needs_critic' and both the local
+        checks and the critic run over the whole chunk (_generate_sequential).
+        """
+        entry = self.generate_single_entry(
+            target['examples'], target['domain'], target['subcategory'], target['topics'], target['number']
+        )
+        if entry is None:
+            return {'target': target, 'status': 'failed'}
+        self.token_ledger.bind(entry, target['number'])
+        if not self._validate_ssd_format(entry):
+            return {'target': target, 'status': 'format_failed'}
+        if self._near_duplicate_of(entry):
+            return {'target': target, 'status': 'duplicate', 'entry': entry}
+        if self.enable_critic and not run_critic:
+            return {'target': target, 'status': 'generated', 'entry': entry, 'feedback': None, 'needs_critic': True}
+        if self._local_issues(entry):
+            return {'target': target, 'status': 'local_rejected', 'entry': entry}
+        feedback = self.validate_with_critic(entry, target['examples'], target['domain']) if self.enable_critic else None
+        return {'target': target, 'status': 'generated', 'entry': entry, 'feedback': feedback}
+
+    async def _arun_target(self, target: Dict) -> Dict:
+        """Async _run_target: one generate -> validate -> critic chain in flight"""
+        entry = await self.agenerate_single_entry(
+            target['examples'], target['domain'], target['subcategory'], target['topics'], target['number']
+        )
+        if entry is None:
+            return {'target': target, 'status': 'failed'}
+        self.token_ledger.bind(entry, target['number'])
+        if not self._validate_ssd_format(entry):
+            return {'target': target, 'status': 'format_failed'}
+        if self._near_duplicate_of(entry):
+            return {'target': target, 'status': 'duplicate', 'entry': entry}
+        if self._local_issues(entry):
+            return {'target': target, 'status': 'local_rejected', 'entry': entry}
+        if not self.enable_critic:
+            feedback = None
+        elif self.critic_batcher is not None:
+            feedback = await self.critic_batcher.submit(entry, target['examples'], target['domain'])
+        else:
+            feedback = await self.avalidate_with_critic(entry, target['examples'], target['domain'])
+        return {'target': target, 'status': 'generated', 'entry': entry, 'feedback': feedback}
+
+    def _near_duplicate_of(self, entry: Dict) -> Optional[str]:
+        """Label of an indexed near-duplicate of entry (checked before spending a critic call)"""
+        if self.dedup_index is None:
+            return None
+        match = self.dedup_index.query(entry)
+        if match is None:
+            return None
+        label, similarity = match
+        logger.warning(f"[X] Near-duplicate of '{label}' (similarity {similarity:.2f})")
+        return label
+
+    def _local_issues(self, entry: Dict) -> List[str]:
+        """Issues found by the local SSD checker (empty when it passes or is disabled)"""
+        return self._local_issues_batch([entry])[0]
+
+    def _local_issues_batch(self, entries: List[Dict]) -> List[List[str]]:
+        """_local_issues for several entries in one SSDChecker.check_batch call"""
+        if self.ssd_checker is None:
+            return [[] for _ in entries]
+        batch_issues = self.ssd_checker.check_batch(entries)
+        for issues in batch_issues:
+            if issues:
+                logger.warning(f"[X] Local validation failed: {'; '.join(issues[:3])}")
+        return batch_issues
+
+    @staticmethod
+    def _load_output_entries(output_file: str) -> List[Dict]:
+        entries = []
+        if Path(output_file).exists():
+            with open(output_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        return entries
+
+    def _seed_dedup_index(self, existing_data: List[Dict], output_entries: List[Dict]):
+        """Index the few-shot data and every entry already in the output file"""
+        if self.dedup_index is None:
+            return
+        seeded = self.dedup_index.add_many(existing_data) + self.dedup_index.add_many(output_entries)
+        logger.info(f"[OK] Near-duplicate index seeded with {seeded} entries (threshold {self.dedup_index.threshold})")
+
+    # ----- Checkpoint snapshots -----
+
+    @staticmethod
+    def state_path(output_file: str) -> Path:
+        """Snapshot of generator + diversity state, next to the output file"""
+        return Path(f"{output_file}.state.json")
+
+    def _save_state(self, output_file: str, run: Dict):
+        """Atomically write the snapshot (temp file + fsync + rename)"""
+        path = self.state_path(output_file)
+        version, internal, gauss_next = self.diversity_manager.rng.getstate()
+        state = {
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+            'run': run,
+            'in_flight': [
+                {k: v for k, v in target.items() if k != 'examples'}
+                for _, target in sorted(self._in_flight.items())
+            ],
+            'diversity': self.diversity_manager.state_dict(),
+            'stats': self.stats,
+            'tokens': self.token_ledger.state_dict(),
+            'random_state': [version, list(internal), gauss_next],
+        }
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        logger.debug(f"Snapshot saved: {path}")
+
+    def _restore_state(self, output_file: str, output_entries: List[Dict], run: Dict):
+        """
+        Continue from the last snapshot: rotation queue, counts, topic history, stats, rotation RNG state,
+        run seed, sample counter and in-flight targets. Entries written after the snapshot are adopted; their
+        sample records (<output>.samples.jsonl) say which samples they were, so those are neither
+        re-run nor drawn again, and their tokens and domain counts are restored.
+        Without a snapshot, the samples already in the output file are skipped.
+        """
+        path = self.state_path(output_file)
+        if not path.exists():
+            if output_entries:
+                run['drawn'] = len(output_entries)
+                logger.info(f"[NOTICE] No snapshot found - skipping the first {run['drawn']} samples "
+                            f"(one per existing entry)")
+            return
+
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        run.update(state['run'])
+        self.diversity_manager.load_state_dict(state['diversity'])
+        self.stats.update(state['stats'])
+        if 'tokens' in state:
+            self.token_ledger.load_state_dict(state['tokens'])
+        version, internal, gauss_next = state['random_state']
+        self.diversity_manager.rng.setstate((version, tuple(internal), gauss_next))
+        run['consecutive_failures'] = 0
+
+        # Entries appended after the snapshot was taken, with their sample records
+        saved_lines = run['output_lines']
+        records = self.writer.sample_records()
+        adopted: Dict[int, Dict] = {}
+        if len(output_entries) > saved_lines:
+            for line, entry in enumerate(output_entries[saved_lines:], saved_lines):
+                run['generated'] += 1
+                self.stats['accepted'] += 1
+                if line in records:
+                    adopted[records[line]['number']] = records[line]
+            logger.info(f"[NOTICE] Adopted {len(output_entries) - saved_lines} entries written after the snapshot "
+                        f"({len(adopted)} with sample records)")
+        elif len(output_entries) < saved_lines:
+            logger.warning(f"[NOTICE] Output has {len(output_entries)} entries but the snapshot expected {saved_lines}")
+        run['output_lines'] = len(output_entries)
+
+        # Adopted samples are done: no re-run, tokens settled, and the rotation advanced past them
+        self._carry = [target for target in state['in_flight'] if target['number'] not in adopted]
+        for number, record in sorted(adopted.items()):
+            self.token_ledger.adopt(number, record, record['domain'], record['subcategory'])
+        while run['drawn'] < max(adopted, default=0):
+            record = adopted.get(run['drawn'] + 1)
+            if record is not None:
+                run['drawn'] += 1
+                self.diversity_manager.claim_target(record['domain'], record['subcategory'])
+                self.diversity_manager.record_topics(record.get('topics', []))
+            else:
+                # Drawn after the snapshot but not written: run it again, in sample order
+                self._carry.append(self._draw_target(run))
+
+        logger.info(f"[OK] Resumed from snapshot {path} ({state['saved_at']}): {run['drawn']} samples drawn, "
+                    f"{run['generated']} accepted, {len(self._carry)} targets to re-run")
+
+    def _record_outcome(self, outcome: Dict, run: Dict, output_file: str, target_size: int, checkpoint_interval: int):
+        """
+        Apply one outcome: counters, critic decision, append to the output file, diversity tracking,
+        token settlement, checkpoint logging. Only the dispatching loop calls this, so there is a single writer.
+        """
+        target = outcome['target']
+        self._in_flight.pop(target['number'], None)
+        result = self._apply_outcome(outcome, run, output_file)
+        self.token_ledger.settle(target['number'], result, target['domain'], target['subcategory'])
+        if outcome.get('entry') is not None:
+            self.token_ledger.release([outcome['entry']])
+        if result == 'accepted' and run['generated'] % checkpoint_interval == 0:
+            self._log_checkpoint(run, output_file, target_size)
+
+    def _apply_outcome(self, outcome: Dict, run: Dict, output_file: str) -> str:
+        """Counters, critic decision and output write for one outcome; returns the final result label"""
+        status = outcome['status']
+        if status == 'failed':
+            run['failed'] += 1
+            run['consecutive_failures'] += 1
+            logger.warning(f"[X] Generation failed (#{outcome['target']['number']})")
+            return 'failed'
+        if status == 'format_failed':
+            run['failed'] += 1
+            run['consecutive_failures'] += 1
+            logger.warning(f"[X] Format validation failed (#{outcome['target']['number']})")
+            return 'format_failed'
+        if status == 'local_rejected':
+            run['local_rejected'] += 1
+            run['consecutive_failures'] += 1
+            if self.enable_critic:
+                run['critic_calls_saved'] += 1
+            return 'local_rejected'
+        # Concurrent chains can pass the pre-critic check before an earlier near-duplicate is saved
+        if status == 'duplicate' or self._near_duplicate_of(outcome['entry']):
+            run['duplicates'] += 1
+            run['consecutive_failures'] += 1
+            self.stats['near_duplicates'] += 1
+            if status == 'duplicate' and self.enable_critic:
+                run['critic_calls_saved'] += 1
+            return 'duplicate'
+
+        entry, feedback = outcome['entry'], outcome['feedback']
+        if feedback:
+            self.stats['quality_scores'].append(feedback.quality_score)
+
+            logger.info(f"\n[CRITIC] Evaluation (#{outcome['target']['number']}):")
+            logger.info(f"   Quality: {feedback.quality_score:.1f}/10")
+            logger.info(f"   Scientific: {feedback.scientific_accuracy:.1f}/10")
+            logger.info(f"   Math: {feedback.mathematical_correctness:.1f}/10")
+            logger.info(f"   Diversity: {feedback.diversity_score:.1f}/10")
+            logger.info(f"   Recommendation: {feedback.recommendation}")
+
+            if feedback.quality_score < self.min_quality_score or feedback.recommendation == "REJECT":
+                run['rejected_by_critic'] += 1
+                run['consecutive_failures'] += 1
+                logger.warning(f"[X] REJECTED (score: {feedback.quality_score:.1f})")
+                return 'rejected_by_critic'
+
+            logger.info(f"[OK] ACCEPTED ✓")
+
+        # Save entry (buffered; durable at the next flush) with its sample record for exact resumes
+        target = outcome['target']
+        self.writer.write(entry, {
+            'number': target['number'],
+            'domain': target['domain'],
+            'subcategory': target['subcategory'],
+            'topics': target['topics'],
+            **self.token_ledger.pending(target['number']),
+        })
+
+        run['generated'] += 1
+        run['output_lines'] += 1
+        run['consecutive_failures'] = 0
+        self.stats['accepted'] += 1
+        if self.dedup_index is not None:
+            self.dedup_index.add(entry)
+        if self.feed_back_examples:
+            self._fed_back[target['number']] = entry
+        return 'accepted'
+
+    def _log_checkpoint(self, run: Dict, output_file: str, target_size: int):
+        generated = run['generated']
+        stats = self.diversity_manager.get_diversity_stats()
+        avg_quality = sum(self.stats['quality_scores']) / len(self.stats['quality_scores']) if self.stats['quality_scores'] else 0
+
+        logger.info(f"\n{'='*60}")
+        logger.info(f"CHECKPOINT: {generated}/{target_size}")
+        logger.info(f"Acceptance: {generated/(generated+run['failed']+run['rejected_by_critic']+run['duplicates']+run['local_rejected'])*100:.1f}%")
+        logger.info(f"Avg Quality: {avg_quality:.2f}/10")
+        logger.info(f"Unique Domains: {stats['unique_domains']}")
+        logger.info(f"Unique Subcategories: {stats['unique_subcategories']}")
+        logger.info(f"Domain mismatches: {self.stats['domain_mismatch']}")
+        logger.info(f"Near-duplicates: {run['duplicates']}, local rejects: {run['local_rejected']} "
+                    f"({run['critic_calls_saved']} critic calls saved)")
+        logger.info(f"Top domains: {stats['most_common_domains'][:3]}")
+        logger.info(f"Prompt prefix reuse (est.): {self.prefix_tracker.summary()}")
+        self._log_rate_metrics()
+        for line in self.token_ledger.summary_lines():
+            logger.info(line)
+        if self.response_cache is not None:
+            logger.info(f"Response cache: {self.response_cache.summary()}")
+        logger.info(f"{'='*60}\n")
+        # The snapshot's output line count must match what is on disk
+        self.writer.flush()
+        self._save_state(output_file, run)
+
+    def _generate_sequential(self, existing_data: List[Dict], target_size: int, num_examples: int,
+                             output_file: str, checkpoint_interval: int, run: Dict):
+        # With a batched critic, generate critic_batch_size targets, then run the local checks
+        # and the critic over them in one call each
+        chunk = self.critic_batch_size if self.enable_critic else 1
+        while self._has_next_target(target_size, run):
+            targets = []
+            while len(targets) < chunk and self._has_next_target(target_size, run):
+                targets.append(self._next_target(existing_data, num_examples, target_size, run))
+            outcomes = [self._run_target(target, run_critic=chunk == 1) for target in targets]
+            waiting = [outcome for outcome in outcomes if outcome.get('needs_critic')]
+            local_issues = self._local_issues_batch([outcome['entry'] for outcome in waiting])
+            for outcome, issues in zip(waiting, local_issues):
+                if issues:
+                    outcome['status'] = 'local_rejected'
+                    outcome['needs_critic'] = False
+            waiting = [outcome for outcome in waiting if outcome['needs_critic']]
+            if waiting:
+                feedbacks = self.validate_batch_with_critic(
+                    [(o['entry'], o['target']['examples'], o['target']['domain']) for o in waiting]
+                )
+                for outcome, feedback in zip(waiting, feedbacks):
+                    outcome['feedback'] = feedback
+
+            for outcome in outcomes:
+                self._record_outcome(outcome, run, output_file, target_size, checkpoint_interval)
+
+                # Safety check
+                if run['consecutive_failures'] >= run['max_consecutive_failures']:
+                    logger.error(f"\n[X] {run['max_consecutive_failures']} consecutive failures - stopping")
+                    return
+
+    async def _generate_concurrent(self, existing_data: List[Dict], target_size: int, num_examples: int,
+                                   output_file: str, checkpoint_interval: int, run: Dict, concurrency: int):
+        """
+        Keep up to `concurrency` target pipelines in flight. Targets are drawn in sample order when a
+        slot frees up; outcomes are recorded here, so the file has one writer, and in sample order, so
+        the output, near-duplicate decisions and fed-back examples do not depend on completion order.
+        With feed_back_examples, a target is only drawn once every sample feedback_lag or more before
+        it is recorded. With adaptive_rate, the LLM requests these pipelines make are further limited
+        by the AIMD limiter.
+        """
+        if self.enable_critic and self.critic_batch_size > 1:
+            if self.critic_batch_size > concurrency:
+                logger.warning(f"Critic batch size {self.critic_batch_size} > concurrency {concurrency}: "
+                               f"batches will flush on timeout")
+            self.critic_batcher = CriticBatcher(self.avalidate_batch_with_critic, self.critic_batch_size)
+        pending = set()
+        finished: Dict[int, Dict] = {}  # outcomes waiting for an earlier sample to be recorded
+        stopping = False
+        last_rate_report = time.time()
+        while pending or (self._has_next_target(target_size, run) and not stopping):
+            while (not stopping and self._has_next_target(target_size, run) and len(pending) < concurrency
+                   and self._feedback_ready(run)):
+                target = self._next_target(existing_data, num_examples, target_size, run)
+                pending.add(asyncio.ensure_future(self._arun_target(target)))
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                outcome = task.result()
+                finished[outcome['target']['number']] = outcome
+            # Unrecorded targets stay in _in_flight, so its lowest number is the next one to record
+            while finished and min(self._in_flight) in finished:
+                outcome = finished.pop(min(self._in_flight))
+                self._record_outcome(outcome, run, output_file, target_size, checkpoint_interval)
+                if run['consecutive_failures'] >= run['max_consecutive_failures']:
+                    break
+            if time.time() - last_rate_report >= RATE_REPORT_SECONDS:
+                self._log_rate_metrics()
+                last_rate_report = time.time()
+
+            # Safety check
+            if not stopping and run['consecutive_failures'] >= run['max_consecutive_failures']:
+                logger.error(f"\n[X] {run['max_consecutive_failures']} consecutive failures - stopping "
+                             f"(cancelling {len(pending)} in flight)")
+                stopping = True
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                pending = set()
+        self.critic_batcher = None
+
     def generate_dataset(
         self,
         existing_data: List[Dict],
         target_size: int = 10000,
         num_examples: int = 5,
         output_file: str = "extended_dataset.jsonl",
-        checkpoint_interval: int = 50
+        checkpoint_interval: int = 50,
+        concurrency: int = 1,
+        resume: bool = True
     ):
-        """Generate diverse dataset with domain rotation"""
-        
+        """
+        Generate diverse dataset with domain rotation.
+        concurrency > 1 keeps that many generate -> validate -> critic chains in flight (asyncio).
+        State is snapshotted to <output_file>.state.json at every checkpoint and on exit;
+        resume=True continues from it (remaining samples, rotation, stats).
+        """
+
         logger.info(f"\n{'='*60}")
         logger.info(f"ENHANCED DATASET GENERATION - DIVERSITY ENFORCED")
         logger.info(f"{'='*60}")
@@ -825,8 +1904,14 @@ class SimulationGenerator:
         logger.info(f"Domains: {len(DOMAIN_CATALOG)} major fields")
         logger.info(f"Subcategories: {sum(len(v['subcategories']) for v in DOMAIN_CATALOG.values())}")
         logger.info(f"Output: {output_file}")
+        logger.info(f"Concurrency: {concurrency}")
         logger.info(f"{'='*60}\n")
-        
+
+        # Open the writer first: it replays batches a crash left in segment files
+        self.writer = DatasetWriter(output_file, **self.writer_options)
+        if self.writer.recovered_segments:
+            logger.info(f"[NOTICE] Replayed {self.writer.recovered_segments} unfinished write segment(s)")
+
         # Check if output file exists and count existing entries
         starting_count = 0
         if Path(output_file).exists():
@@ -839,142 +1924,120 @@ class SimulationGenerator:
                 logger.warning(f"Could not count existing entries: {e}")
         else:
             logger.info(f"[NOTICE] Creating new output file: {output_file}")
-            # Create new file if it doesn't exist
+            # Create new file if it doesn't exist (sample records of a deleted output no longer apply)
             with open(output_file, 'w', encoding='utf-8') as f:
                 pass
-        
+            self.writer.samples_path.unlink(missing_ok=True)
+
+        output_entries = self._load_output_entries(output_file)
+        self._seed_dedup_index(existing_data, output_entries)
+        self.example_pool = ExamplePool(existing_data, selection=self.example_selection)
+        if self.feed_back_examples:
+            for entry in output_entries:
+                self.example_pool.add(entry)
+        # Samples between a target and the newest fed-back entry it may see: the targets in flight at once
+        self._fed_back = {}
+        self._feedback_lag = concurrency if concurrency > 1 else (self.critic_batch_size if self.enable_critic else 1)
+        logger.info(f"[OK] Example pool: {len(self.example_pool)} entries in {len(self.example_pool.by_domain)} domains "
+                    f"(selection: {self.example_selection}, feed back accepted: {self.feed_back_examples})")
+
+        # Generation loop
+        run = {
+            'seed': self.seed,
+            'drawn': 0,
+            'output_lines': len(output_entries),
+            'generated': 0,
+            'failed': 0,
+            'rejected_by_critic': 0,
+            'duplicates': 0,
+            'local_rejected': 0,
+            'critic_calls_saved': 0,
+            'consecutive_failures': 0,
+            'max_consecutive_failures': 15,
+        }
+        if resume:
+            self._restore_state(output_file, output_entries, run)
+        if not self._has_next_target(target_size, run):
+            logger.info(f"[OK] All {target_size} samples already processed - nothing to do")
+            self.writer.close()
+            return
+
+        if self.adaptive_rate:
+            self.rate_limiter = AdaptiveLimiter(
+                initial=min(concurrency, 4), max_limit=concurrency, target_latency=self.target_latency
+            )
+            logger.info(f"[OK] Adaptive rate control: up to {concurrency} requests in flight, "
+                        f"target p95 latency {self.target_latency:.0f}s")
+
         # Test API
         if not self.test_api_connection():
             logger.error("[X] API connection failed - aborting")
+            self.writer.close()
             return
-        
-        logger.info("[OK] API verified - starting generation\n")
-        
-        # Generation loop
-        generated = 0
-        failed = 0
-        rejected_by_critic = 0
-        consecutive_failures = 0
-        max_consecutive_failures = 15
-        
-        for i in range(target_size):
-            simulation_number = i + 1
-            
-            # Get next domain target from diversity manager
-            target_domain, target_subcategory = self.diversity_manager.get_next_domain_target()
-            topic_suggestions = self.diversity_manager.get_topic_suggestions(target_domain)
-            
-            logger.info(f"\n--- Sample {i+1}/{target_size} ---")
-            logger.info(f"Target: {target_domain} :: {target_subcategory}")
-            
-            # Select diverse examples (different from target domain)
-            examples = select_diverse_examples(
-                existing_data,
-                target_domain,
-                num_examples
-            )
-            
-            # Generate entry
-            entry = self.generate_single_entry(
-                examples,
-                target_domain,
-                target_subcategory,
-                topic_suggestions,
-                simulation_number
-            )
-            
-            if entry:
-                # Validate format
-                if not self._validate_ssd_format(entry):
-                    failed += 1
-                    consecutive_failures += 1
-                    logger.warning(f"[X] Format validation failed")
-                    continue
-                
-                # Critic validation
-                if self.enable_critic:
-                    feedback = self.validate_with_critic(
-                        entry, 
-                        examples,
-                        target_domain
-                    )
-                    
-                    if feedback:
-                        self.stats['quality_scores'].append(feedback.quality_score)
-                        
-                        logger.info(f"\n[CRITIC] Evaluation:")
-                        logger.info(f"   Quality: {feedback.quality_score:.1f}/10")
-                        logger.info(f"   Scientific: {feedback.scientific_accuracy:.1f}/10")
-                        logger.info(f"   Math: {feedback.mathematical_correctness:.1f}/10")
-                        logger.info(f"   Diversity: {feedback.diversity_score:.1f}/10")
-                        logger.info(f"   Recommendation: {feedback.recommendation}")
-                        
-                        if feedback.quality_score < self.min_quality_score or feedback.recommendation == "REJECT":
-                            rejected_by_critic += 1
-                            consecutive_failures += 1
-                            logger.warning(f"[X] REJECTED (score: {feedback.quality_score:.1f})")
-                            continue
-                        
-                        logger.info(f"[OK] ACCEPTED ✓")
-                
-                # Save entry
-                with open(output_file, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
-                
-                generated += 1
-                consecutive_failures = 0
-                self.stats['accepted'] += 1
-                
-                # Record for diversity tracking
-                self.diversity_manager.record_generated(
-                    target_domain,
-                    entry['output'].get('simulation_name', '')
-                )
-                
-                # Checkpoint
-                if generated % checkpoint_interval == 0:
-                    stats = self.diversity_manager.get_diversity_stats()
-                    avg_quality = sum(self.stats['quality_scores']) / len(self.stats['quality_scores']) if self.stats['quality_scores'] else 0
-                    
-                    logger.info(f"\n{'='*60}")
-                    logger.info(f"CHECKPOINT: {generated}/{target_size}")
-                    logger.info(f"Acceptance: {generated/(generated+failed+rejected_by_critic)*100:.1f}%")
-                    logger.info(f"Avg Quality: {avg_quality:.2f}/10")
-                    logger.info(f"Unique Domains: {stats['unique_domains']}")
-                    logger.info(f"Unique Subcategories: {stats['unique_subcategories']}")
-                    logger.info(f"Domain mismatches: {self.stats['domain_mismatch']}")
-                    logger.info(f"Top domains: {stats['most_common_domains'][:3]}")
-                    logger.info(f"{'='*60}\n")
+
+        first = self._carry[0]['number'] if self._carry else run['drawn'] + 1
+        logger.info(f"[OK] API verified - starting generation at sample {first}\n")
+
+        start_time = time.time()
+        try:
+            if concurrency > 1:
+                asyncio.run(self._generate_concurrent(
+                    existing_data, target_size, num_examples, output_file, checkpoint_interval, run, concurrency
+                ))
             else:
-                failed += 1
-                consecutive_failures += 1
-                logger.warning(f"[X] Generation failed")
-            
-            # Safety check
-            if consecutive_failures >= max_consecutive_failures:
-                logger.error(f"\n[X] {max_consecutive_failures} consecutive failures - stopping")
-                break
-        
+                self._generate_sequential(existing_data, target_size, num_examples, output_file, checkpoint_interval, run)
+        finally:
+            # Also on Ctrl+C / errors: buffered entries are written, unrecorded targets stay in the
+            # snapshot and are re-run on resume
+            self.writer.close()
+            self._save_state(output_file, run)
+        elapsed = time.time() - start_time
+
         # Final summary
         stats = self.diversity_manager.get_diversity_stats()
         avg_quality = sum(self.stats['quality_scores']) / len(self.stats['quality_scores']) if self.stats['quality_scores'] else 0
-        
+
         logger.info(f"\n{'='*80}")
         logger.info(f"GENERATION COMPLETE")
         logger.info(f"{'='*80}")
-        logger.info(f"[OK] Generated: {generated}")
-        logger.info(f"[X] Failed: {failed}")
-        logger.info(f"[X] Rejected by critic: {rejected_by_critic}")
+        logger.info(f"[OK] Generated: {run['generated']}")
+        logger.info(f"[X] Failed: {run['failed']}")
+        logger.info(f"[X] Rejected by critic: {run['rejected_by_critic']}")
         logger.info(f"[X] Domain mismatches: {self.stats['domain_mismatch']}")
+        logger.info(f"[X] Near-duplicates: {run['duplicates']}")
+        logger.info(f"[X] Local validation rejects: {run['local_rejected']}"
+                    f"{' ' + str(dict(self.ssd_checker.rule_counts)) if self.ssd_checker else ''}")
+        logger.info(f"[STAT] Critic calls saved: {run['critic_calls_saved']}")
+        if self.enable_critic:
+            per_accepted = max(run['generated'], 1)
+            logger.info(f"[STAT] Critic: {self.stats['critic_calls']} calls ({self.stats['critic_batches']} batched, "
+                        f"batch size {self.critic_batch_size}), {self.stats['critic_tokens']:,} tokens, "
+                        f"{self.stats['critic_seconds']:.1f}s")
+            logger.info(f"[STAT] Critic per accepted sample: {self.stats['critic_tokens'] / per_accepted:,.0f} tokens, "
+                        f"{self.stats['critic_seconds'] / per_accepted:.2f}s")
         logger.info(f"[STAT] Avg quality: {avg_quality:.2f}/10")
         logger.info(f"[STAT] Unique domains: {stats['unique_domains']}")
         logger.info(f"[STAT] Unique subcategories: {stats['unique_subcategories']}")
-        logger.info(f"[FILE] Output: {output_file}")
+        logger.info(f"[STAT] Wall time: {elapsed:.1f}s ({run['generated'] / elapsed * 60 if elapsed > 0 else 0:.1f} accepted/min)")
+        logger.info(f"[STAT] Prompt prefix reuse (est.): {self.prefix_tracker.summary()}")
+        if self.rate_limiter is not None:
+            logger.info(f"[STAT] Rate: {self.rate_limiter.describe()}")
+        for line in self.token_ledger.summary_lines():
+            logger.info(f"[STAT] {line}")
+        if self.response_cache is not None:
+            logger.info(f"[STAT] Response cache: {self.response_cache.summary()}")
+        logger.info(f"[FILE] Output: {output_file} ({self.writer.flushes} buffered writes)")
+        if self.writer.shard_format:
+            logger.info(f"[FILE] Shards: {self.writer.shard_dir} ({len(self.writer.index['shards'])} shards, "
+                        f"{self.writer.index['total_entries']} entries)")
         logger.info(f"\nDomain Distribution:")
         for domain, count in stats['most_common_domains']:
             logger.info(f"  {domain}: {count}")
+        logger.info(f"\nTokens by Domain:")
+        for line in self.token_ledger.domain_lines():
+            logger.info(line)
         logger.info(f"{'='*80}\n")
-    
+
     def _validate_ssd_format(self, entry: Dict) -> bool:
         """Validate SSD format"""
         try:
@@ -1042,7 +2105,24 @@ def main():
     MODEL_NAME = "Qwen/Qwen3-30B-A3B-GPTQ-Int4"
     NUM_EXAMPLES = 5
     TEMPERATURE = 0.9
-    CHECKPOINT_INTERVAL = 50
+    CHECKPOINT_INTERVAL = 50  # accepted entries between checkpoint logs + state snapshots
+    RESUME = True  # continue from <output>.state.json if present
+    CONCURRENCY = 16  # generate -> critic chains in flight; 1 = sequential
+    ADAPTIVE_RATE = True  # AIMD limit (up to CONCURRENCY requests) + jittered backoff on 429/5xx/timeouts
+    TARGET_LATENCY = 60.0  # seconds; p95 request latency above this lowers the limit
+    RESPONSE_CACHE = "llm_response_cache.sqlite"  # replays / resumes reuse stored responses; None disables
+    CACHE_TTL_DAYS = 30
+    CACHE_MAX_MB = 2048
+    SEED = None  # set (e.g. 42) for reproducible runs (at any CONCURRENCY), which the response cache then replays for free
+    WRITE_BUFFER_ENTRIES = 64  # accepted entries buffered per fsync'd append (also flushed at checkpoints)
+    WRITE_BUFFER_SECONDS = 30.0
+    SHARD_FORMAT = None  # "zstd": also write <output>.shards/shard-*.jsonl.zst + index.json for streaming readers
+    SHARD_ENTRIES = 10000
+    DEDUP_THRESHOLD = 0.7  # MinHash Jaccard above which an entry is a near-duplicate; 0 disables
+    EXAMPLE_SELECTION = "random"  # "random" or "embedding" (dissimilar to the target domain)
+    FEED_BACK_EXAMPLES = True  # accepted entries join the few-shot example pool
+    CRITIC_BATCH_SIZE = 4  # entries scored per critic call; 1 = one call per entry
+    GROUP_BY_DOMAIN = False  # rotate domain by domain so in-flight prompts also share the domain section
     
     logger.info("="*80)
     logger.info("ENHANCED DATASET GENERATION - DIVERSITY ENFORCED")
@@ -1054,6 +2134,7 @@ def main():
     logger.info(f"VLLM: {VLLM_BASE_URL}")
     logger.info(f"Model: {MODEL_NAME}")
     logger.info(f"Temperature: {TEMPERATURE}")
+    logger.info(f"Concurrency: {CONCURRENCY}")
     logger.info("="*80)
     
     # Load data
@@ -1080,7 +2161,23 @@ def main():
             model_name=MODEL_NAME,
             temperature=TEMPERATURE,
             enable_critic=True,
-            min_quality_score=7.0
+            min_quality_score=7.0,
+            dedup_threshold=DEDUP_THRESHOLD,
+            example_selection=EXAMPLE_SELECTION,
+            feed_back_examples=FEED_BACK_EXAMPLES,
+            local_validation=True,
+            critic_batch_size=CRITIC_BATCH_SIZE,
+            group_by_domain=GROUP_BY_DOMAIN,
+            adaptive_rate=ADAPTIVE_RATE,
+            target_latency=TARGET_LATENCY,
+            response_cache=str(script_dir / RESPONSE_CACHE) if RESPONSE_CACHE else None,
+            cache_ttl_days=CACHE_TTL_DAYS,
+            cache_max_mb=CACHE_MAX_MB,
+            write_buffer_entries=WRITE_BUFFER_ENTRIES,
+            write_buffer_seconds=WRITE_BUFFER_SECONDS,
+            shard_format=SHARD_FORMAT,
+            shard_entries=SHARD_ENTRIES,
+            seed=SEED
         )
         logger.info("[OK] Generator initialized")
     except Exception as e:
@@ -1094,7 +2191,9 @@ def main():
             target_size=TARGET_SIZE,
             num_examples=NUM_EXAMPLES,
             output_file=str(output_path),
-            checkpoint_interval=CHECKPOINT_INTERVAL
+            checkpoint_interval=CHECKPOINT_INTERVAL,
+            concurrency=CONCURRENCY,
+            resume=RESUME
         )
         logger.info(f"[OK] Complete! Output: {output_path}")
     except KeyboardInterrupt:
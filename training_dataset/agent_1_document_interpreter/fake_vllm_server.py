@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the vLLM OpenAI-compatible server, for exercising extend_dataset.py
+(adaptive rate control, retries, concurrency) without a GPU.
+
+Serves /v1/models and /v1/chat/completions with canned but valid replies: SSD entries for the
+requested TARGET DOMAIN, single critic evaluations, and batched critic evaluations (one per ENTRY).
+Load and faults are injected:
+- latency = --latency + --latency-per-request * (requests in flight), plus up to --jitter
+- requests beyond --capacity in flight get 429
+- --error-rate of requests get a random 500/502/503
+- --hang-rate of requests sleep --hang seconds (client timeouts)
+
+With --prefix-cache-blocks > 0 the server also models automatic prefix caching (vLLM
+--enable-prefix-caching): the rendered prompt is cut into --block-chars blocks, each keyed by a
+hash of the prompt up to its end, and the leading blocks found in an LRU of that many blocks are
+reused. Each request then pays --prefill-per-kchar seconds per 1000 prompt characters NOT reused;
+reused characters are reported as usage.prompt_tokens_details.cached_tokens and in the counts.
+
+Usage:
+    python fake_vllm_server.py --port 8001 --capacity 8 --error-rate 0.02
+    # then point VLLM_BASE_URL in extend_dataset.py main() at http://127.0.0.1:8001/v1
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+WORDS = ("oscillating coupled damped driven nonlinear thermal transient steady diffusive reactive "
+         "stochastic layered porous elastic viscous charged rotating granular turbulent periodic").split()
+
+
+class FakeVLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, args):
+        super().__init__(address, FakeVLLMHandler)
+        self.args = args
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counts = {'requests': 0, 'ok': 0, '429': 0, '5xx': 0, 'hung': 0, 'prompt_chars': 0, 'cached_chars': 0}
+        self.prefix_cache = PrefixCache(args.prefix_cache_blocks, args.block_chars) if args.prefix_cache_blocks else None
+
+
+class PrefixCache:
+    """LRU of prompt blocks keyed by a chained hash, so a block only matches after an identical prefix"""
+
+    def __init__(self, capacity: int, block_chars: int):
+        self.capacity = capacity
+        self.block_chars = block_chars
+        self.blocks: OrderedDict = OrderedDict()
+
+    def match_and_insert(self, text: str) -> int:
+        """Characters served from cache (leading full blocks already present); all blocks are then cached"""
+        digest = hashlib.blake2b(digest_size=16)
+        cached, hit = 0, True
+        for start in range(0, len(text) - self.block_chars + 1, self.block_chars):
+            digest.update(text[start:start + self.block_chars].encode('utf-8'))
+            key = digest.digest()
+            if key in self.blocks:
+                self.blocks.move_to_end(key)
+                cached += self.block_chars if hit else 0
+                continue
+            hit = False
+            self.blocks[key] = None
+            if len(self.blocks) > self.capacity:
+                self.blocks.popitem(last=False)
+        return cached
+
+
+def _prompt_text(body: dict) -> str:
+    """Messages rendered roughly as a chat template would, in order"""
+    return "".join(f"<|{m.get('role')}|>\n{m.get('content')}\n" for m in body.get('messages') or [])
+
+
+def _entry(domain: str, subcategory: str) -> dict:
+    words = " ".join(random.choice(WORDS) for _ in range(24))
+    name = f"{subcategory.title()} Model {uuid.uuid4().hex[:8]}"
+    return {
+        "instruction": "Convert the simulation description into the SSD JSON format.",
+        "input": f"Simulate a {words} system in {subcategory} ({domain}) and track how its state evolves over time.",
+        "output": {
+            "simulation_name": name,
+            "domain": domain,
+            "description": f"{subcategory} model with first-order relaxation",
+            "assumptions": ["Well-mixed system", "Constant parameters"],
+            "entities": [{"name": "system"}],
+            "constants": [],
+            "parameters": [
+                {"name": "rate constant", "symbol": "k", "unit": "1/s", "range": [0.01, 1.0]},
+                {"name": "equilibrium value", "symbol": "u_eq", "unit": "1", "range": [0.0, 10.0]},
+            ],
+            "equations": [{"description": "Relaxation", "expression": "du/dt = -k * (u - u_eq)"}],
+            "initial_conditions": {"u": 0.0},
+            "outputs": ["u"],
+            "simulation_controls": ["rate constant", "equilibrium value"],
+            "constraints": [],
+        },
+    }
+
+
+def _evaluation(index: int = None) -> dict:
+    score = random.choice([8.5, 8.0, 7.5, 4.0])
+    evaluation = {
+        "is_valid": score >= 7.0, "quality_score": score, "scientific_accuracy": score,
+        "format_compliance": 9.0, "diversity_score": score, "mathematical_correctness": score,
+        "completeness": 8.0, "issues": [] if score >= 7.0 else ["Too close to the examples"],
+        "strengths": ["Consistent units"], "recommendation": "ACCEPT" if score >= 7.0 else "REJECT",
+        "feedback_summary": "Fake evaluation",
+    }
+    if index is not None:
+        evaluation["entry_index"] = index
+    return evaluation
+
+
+def _reply(body: dict) -> tuple:
+    """(schema name or None, payload) for a chat completion request"""
+    messages = body.get('messages') or []
+    system = next((str(m.get('content')) for m in messages if m.get('role') == 'system'), "")
+    last = str(messages[-1].get('content')) if messages else ""
+    tools = body.get('tools') or []
+    schema = (body.get('response_format') or {}).get('json_schema') or {}
+    name = tools[0]['function']['name'] if tools else schema.get('name')
+
+    if name is None:
+        if "Respond: OK" in last:
+            return None, "OK"
+        name = "BatchValidationFeedback" if "evaluations" in last else (
+            "ValidationFeedback" if "reviewer" in system.lower() else "DatasetEntry")
+    if name == "BatchValidationFeedback":
+        count = len(re.findall(r"^ENTRY (\d+)$", last, flags=re.MULTILINE)) or 1
+        return name, {"evaluations": [_evaluation(i) for i in range(1, count + 1)]}
+    if name == "ValidationFeedback":
+        return name, _evaluation()
+    # Also understands the single-message layout used before the static-prefix prompts
+    domain = re.search(r"(?:TARGET DOMAIN|MUST be in the domain): (.+)", last)
+    subcategory = re.search(r"(?:TARGET SUBCATEGORY|MUST focus on): (.+)", last)
+    return name, _entry(domain.group(1).strip() if domain else "Physics",
+                        subcategory.group(1).strip() if subcategory else "General")
+
+
+class FakeVLLMHandler(BaseHTTPRequestHandler):
+    server: FakeVLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send(200, {"object": "list", "data": [{"id": self.server.args.model, "object": "model"}]})
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        server, args = self.server, self.server.args
+        with server.lock:
+            server.counts['requests'] += 1
+            if server.in_flight >= args.capacity:
+                server.counts['429'] += 1
+                overloaded = True
+            else:
+                server.in_flight += 1
+                overloaded = False
+        if overloaded:
+            self._send(429, {"error": {"message": "Too many requests", "type": "rate_limit"}})
+            return
+        try:
+            roll = random.random()
+            delay = args.latency + args.latency_per_request * server.in_flight + random.uniform(0, args.jitter)
+            prompt = _prompt_text(body)
+            cached_chars = 0
+            if server.prefix_cache is not None:
+                with server.lock:
+                    cached_chars = server.prefix_cache.match_and_insert(prompt)
+                    server.counts['prompt_chars'] += len(prompt)
+                    server.counts['cached_chars'] += cached_chars
+                delay += args.prefill_per_kchar * (len(prompt) - cached_chars) / 1000
+            if roll < args.hang_rate:
+                with server.lock:
+                    server.counts['hung'] += 1
+                time.sleep(args.hang)
+                return
+            time.sleep(delay)
+            if roll < args.hang_rate + args.error_rate:
+                with server.lock:
+                    server.counts['5xx'] += 1
+                self._send(random.choice([500, 502, 503]), {"error": {"message": "Injected server error"}})
+                return
+
+            name, payload = _reply(body)
+            content = payload if isinstance(payload, str) else json.dumps(payload)
+            message = {"role": "assistant", "content": content}
+            if body.get('tools'):
+                message = {"role": "assistant", "content": None, "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                    "function": {"name": name, "arguments": content},
+                }]}
+            prompt_tokens = len(prompt) // 4
+            completion_tokens = len(content) // 4
+            with server.lock:
+                server.counts['ok'] += 1
+            self._send(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get('model', args.model),
+                "choices": [{"index": 0, "message": message,
+                             "finish_reason": "tool_calls" if body.get('tools') else "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens,
+                          "prompt_tokens_details": {"cached_tokens": cached_chars // 4}},
+            })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake vLLM chat completions server with injected latency and errors")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--model", default="Qwen/Qwen3-30B-A3B-GPTQ-Int4")
+    parser.add_argument("--latency", type=float, default=0.5, help="Base seconds per request")
+    parser.add_argument("--latency-per-request", type=float, default=0.05, help="Extra seconds per request in flight")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--capacity", type=int, default=8, help="Requests in flight before answering 429")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Fraction of 5xx responses")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--hang", type=float, default=300.0, help="Seconds a hanging request sleeps")
+    parser.add_argument("--prefix-cache-blocks", type=int, default=0, help="Prefix cache size in blocks; 0 disables")
+    parser.add_argument("--block-chars", type=int, default=64, help="Prompt characters per cache block (~16 tokens)")
+    parser.add_argument("--prefill-per-kchar", type=float, default=0.0,
+                        help="Extra seconds per 1000 prompt characters not served from the prefix cache")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    server = FakeVLLMServer((args.host, args.port), args)
+    print(f"Fake vLLM server on http://{args.host}:{args.port}/v1 (capacity {args.capacity}, "
+          f"error rate {args.error_rate}, hang rate {args.hang_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Requests: {server.counts}")
+        if server.counts['prompt_chars']:
+            print(f"Prefix cache reuse: {server.counts['cached_chars'] / server.counts['prompt_chars']:.1%} of prompt characters")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Adaptive concurrency (AIMD) and jittered backoff for calls to the vLLM server.
+
+Every LLM request goes through AdaptiveLimiter.call / call_sync:
+- at most `limit` requests are in flight (async path)
+- limit += 1 per `limit` successful calls within their latency target (additive increase)
+- limit *= DECREASE_FACTOR on an overload signal - 429, 408, 5xx, timeout, connection error, or
+  p95 latency over target - at most once per round trip: only calls started after the last
+  decrease can trigger the next one, and the latency p95 is taken over those calls only, so
+  slow calls from before a decrease cannot cut the limit again
+- latency targets are per call (target_latency argument), so long batched calls can carry a
+  proportionally longer target than single ones
+- overload errors are retried with full-jitter exponential backoff; other errors propagate at once
+
+Metrics over a sliding window: requests/sec, p95 latency, error rate, current limit, in flight.
+"""
+
+import asyncio
+import random
+import time
+from collections import Counter, deque
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import numpy as np
+
+
+DECREASE_FACTOR = 0.5
+MIN_LATENCY_SAMPLES = 3  # calls since the last decrease needed before latency can trigger one
+METRICS_WINDOW_SECONDS = 60.0
+
+T = TypeVar("T")
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """429 / 408 / 5xx responses, timeouts and connection errors (openai, httpx or builtin)"""
+    status = _status_code(exc)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    name = type(exc).__name__
+    return 'Timeout' in name or 'Connection' in name
+
+
+class AdaptiveLimiter:
+    """AIMD in-flight limit + retry with jittered exponential backoff + sliding-window metrics"""
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        target_latency: float = 60.0,
+        decrease_factor: float = DECREASE_FACTOR,
+        max_retries: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        window_seconds: float = METRICS_WINDOW_SECONDS,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.window_seconds = window_seconds
+
+        self.in_flight = 0
+        self.totals: Counter = Counter()
+        self._samples: deque = deque()  # (finished_at, latency, ok)
+        self._created = time.monotonic()
+        self._last_decrease = float('-inf')
+        self._fresh_ratios: List[float] = []  # latency / target of successful calls started after the last decrease
+        self._condition: Optional[asyncio.Condition] = None  # created in the running event loop
+        # Own RNG: backoff jitter must not shift the generator's random state
+        self._rng = random.Random()
+
+    # ----- AIMD -----
+
+    def _record(self, started: float, ok: bool, overload: bool = False, target_latency: Optional[float] = None):
+        now = time.monotonic()
+        latency = now - started
+        self._samples.append((now, latency, ok))
+        self._trim(now)
+        self.totals['requests'] += 1
+        if not ok:
+            self.totals['overload_errors' if overload else 'errors'] += 1
+
+        # Calls already in flight at the last decrease saw the old limit: they neither cut it again
+        # nor count toward the latency p95
+        fresh = started >= self._last_decrease
+        target = target_latency or self.target_latency
+        slow = False
+        if ok and fresh and target:
+            self._fresh_ratios.append(latency / target)
+            slow = (len(self._fresh_ratios) >= MIN_LATENCY_SAMPLES
+                    and float(np.percentile(self._fresh_ratios, 95)) > 1.0)
+        if (overload or slow) and fresh:
+            self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+            self._last_decrease = now
+            self._fresh_ratios = []
+            self.totals['decreases'] += 1
+        elif ok and (not target or latency <= target):
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max_delay, base_delay * 2^attempt)]"""
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    # ----- Calls -----
+
+    async def _acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def _release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def call(self, make_call: Callable[[], Awaitable[T]], target_latency: Optional[float] = None) -> T:
+        """
+        Await make_call() within the in-flight limit, retrying overload errors with backoff.
+        target_latency overrides the default latency target for this call.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            started = time.monotonic()
+            try:
+                result = await make_call()
+            except Exception as e:
+                overload = is_overload_error(e)
+                self._record(started, ok=False, overload=overload, target_latency=target_latency)
+                if not overload or attempt == self.max_retries:
+                    raise
+            else:
+                self._record(started, ok=True, target_latency=target_latency)
+                return result
+            finally:
+                await self._release()
+            self.totals['retries'] += 1
+            await asyncio.sleep(self.backoff_delay(attempt))
+
+    def call_sync(self, make_call: Callable[[], T], target_latency: Optional[float] = None) -> T:
+        """Blocking variant for the sequential pipeline (one request at a time, no slot gating)"""
+        for attempt in range(self.max_retries + 1):
+            self.in_flight += 1
+            started = time.monotonic()
+            try:
+                result = make_call()
+            except Exception as e:
+                overload = is_overload_error(e)
+                self._record(started, ok=False, overload=overload, target_latency=target_latency)
+                if not overload or attempt == self.max_retries:
+                    raise
+            else:
+                self._record(started, ok=True, target_latency=target_latency)
+                return result
+            finally:
+                self.in_flight -= 1
+            self.totals['retries'] += 1
+            time.sleep(self.backoff_delay(attempt))
+
+    # ----- Metrics -----
+
+    def _trim(self, now: float):
+        while self._samples and self._samples[0][0] < now - self.window_seconds:
+            self._samples.popleft()
+
+    def p95_latency(self) -> float:
+        latencies = [latency for _, latency, ok in self._samples if ok]
+        return float(np.percentile(latencies, 95)) if latencies else 0.0
+
+    def metrics(self) -> Dict:
+        now = time.monotonic()
+        self._trim(now)
+        span = max(min(self.window_seconds, now - self._created), 1e-6)
+        count = len(self._samples)
+        errors = sum(1 for _, _, ok in self._samples if not ok)
+        return {
+            'requests_per_sec': count / span,
+            'p95_latency': self.p95_latency(),
+            'error_rate': errors / count if count else 0.0,
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'retries': self.totals['retries'],
+            'decreases': self.totals['decreases'],
+        }
+
+    def describe(self) -> str:
+        m = self.metrics()
+        return (f"limit {m['limit']} (in flight {m['in_flight']}) | {m['requests_per_sec']:.2f} req/s | "
+                f"p95 {m['p95_latency']:.1f}s | errors {m['error_rate']:.1%} | "
+                f"{m['retries']} retries, {m['decreases']} decreases")
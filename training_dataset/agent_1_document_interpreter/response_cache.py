@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Persistent SQLite cache of LLM responses for extend_dataset.py.
+
+Key: sha256 over (model, temperature, max_tokens, call kind, variant, prompt messages). The
+generator passes "<sample>:<attempt>" as variant, so a retry gets a fresh response while a replay
+of the same run (same seed, or a resume) gets exactly the responses it saw before; critic calls use
+no variant, so an entry that was already judged is never re-sent. Evaluations from a batched critic
+call are also stored under each entry's single-critic key, so a replay that batches the entries
+differently still hits.
+Values are the raw AIMessage plus, for structured calls, the parsed object. Entries older than
+ttl_seconds are ignored and purged; when the stored values exceed max_bytes the least recently
+used are evicted down to 90% of it.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import messages_from_dict, message_to_dict
+
+
+EVICT_CHECK_INTERVAL = 100  # puts between size checks
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+
+def cache_key(model: str, temperature: float, max_tokens: Optional[int], kind: str,
+              variant: str, messages: List) -> str:
+    payload = json.dumps({
+        'model': model,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'kind': kind,
+        'variant': variant,
+        'messages': [[m.type, m.content] for m in messages],
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Key -> cached chat result; structured results are rebuilt with the given schema"""
+
+    def __init__(self, path: str, ttl_seconds: float = 30 * 86400, max_bytes: int = 2 * 1024 ** 3):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._puts = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        self._purge_expired()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        """Whether get(key) would hit (not counted as a lookup)"""
+        return self.db.execute(
+            "SELECT 1 FROM responses WHERE key = ? AND created_at >= ?", (key, time.time() - self.ttl_seconds)
+        ).fetchone() is not None
+
+    def get(self, key: str, schema=None) -> Optional[Any]:
+        """Cached result, or None on a miss. Hits carry response_metadata['cache_hit'] = True"""
+        now = time.time()
+        row = self.db.execute(
+            "SELECT value FROM responses WHERE key = ? AND created_at >= ?", (key, now - self.ttl_seconds)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self.db.commit()
+        self.hits += 1
+
+        value = json.loads(row[0])
+        raw = messages_from_dict([value['raw']])[0]
+        raw.response_metadata = {**raw.response_metadata, 'cache_hit': True}
+        if 'parsed' not in value:
+            return raw
+        parsed = schema.model_validate(value['parsed']) if value['parsed'] is not None else None
+        return {'raw': raw, 'parsed': parsed, 'parsing_error': value.get('parsing_error')}
+
+    def put(self, key: str, result: Any):
+        if isinstance(result, dict):
+            parsed = result.get('parsed')
+            value: Dict = {
+                'raw': message_to_dict(result['raw']),
+                'parsed': parsed.model_dump() if parsed is not None else None,
+                'parsing_error': str(result['parsing_error']) if result.get('parsing_error') else None,
+            }
+        else:
+            value = {'raw': message_to_dict(result)}
+        text = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, text, len(text), now, now)
+        )
+        self.db.commit()
+        self._puts += 1
+        if self._puts % EVICT_CHECK_INTERVAL == 0:
+            self._evict()
+
+    def _purge_expired(self):
+        cursor = self.db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self.evicted += cursor.rowcount
+        self.db.commit()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under 90% of max_bytes"""
+        self._purge_expired()
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if freed >= excess:
+                break
+            doomed.append((key,))
+            freed += size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.db.commit()
+        self.evicted += len(doomed)
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        return (f"{self.hits}/{lookups} hits ({self.hits / lookups:.0%})" if lookups else "no lookups") + \
+               f", {len(self)} stored, {self.evicted} evicted"
+
+    def close(self):
+        self.db.close()
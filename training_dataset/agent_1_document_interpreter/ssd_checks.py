@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Deterministic local checks for generated SSD entries, run before the LLM critic.
+
+Catches what the critic would reject anyway, without spending a call:
+- output does not validate against SimulationOutput
+- parameter range that is not [min, max] with finite min <= max
+- constants with non-finite or implausible magnitudes, or well-known constants
+  (speed of light, g, Planck, ...) off by more than a power-of-ten unit prefix
+- equations using symbols defined nowhere in the entry
+- simulation_controls that mostly name no parameter or constant
+
+Numeric checks run as numpy arrays over the whole batch; symbol checks are set lookups.
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Set
+
+import numpy as np
+from pydantic import ValidationError
+
+from ssd_schema import SimulationOutput
+
+
+# |value| outside this band is implausible for a physical constant (0 is allowed)
+MIN_CONSTANT_MAGNITUDE = 1e-45
+MAX_CONSTANT_MAGNITUDE = 1e45
+
+# name fragment -> reference SI value; checked up to a power-of-ten factor (cm vs m, kJ vs J)
+KNOWN_CONSTANTS = {
+    "speed of light": 2.99792458e8,
+    "gravitational acceleration": 9.80665,
+    "acceleration due to gravity": 9.80665,
+    "gravitational constant": 6.67430e-11,
+    "reduced planck": 1.054571817e-34,
+    "planck": 6.62607015e-34,
+    "boltzmann": 1.380649e-23,
+    "avogadro": 6.02214076e23,
+    "gas constant": 8.314462618,
+    "elementary charge": 1.602176634e-19,
+    "electron mass": 9.1093837e-31,
+    "proton mass": 1.67262192e-27,
+    "vacuum permittivity": 8.8541878128e-12,
+    "permittivity of free space": 8.8541878128e-12,
+    "stefan boltzmann": 5.670374419e-8,
+}
+KNOWN_CONSTANT_TOLERANCE = 0.03
+_KNOWN_CONSTANT_KEYS = sorted(KNOWN_CONSTANTS, key=len, reverse=True)  # "reduced planck" before "planck"
+
+# Identifiers that never need a definition: functions, operators, common independent variables
+BUILTIN_SYMBOLS = {
+    "sin", "cos", "tan", "asin", "acos", "atan", "arcsin", "arccos", "arctan", "sinh", "cosh", "tanh",
+    "exp", "log", "ln", "log10", "log2", "sqrt", "abs", "sum", "max", "min", "mod", "floor", "ceil",
+    "round", "sign", "if", "else", "and", "or", "not", "for", "where", "when", "otherwise", "int",
+    "integral", "lim", "pi", "e", "d", "dt", "dx", "dy", "dz", "t", "x", "y", "z", "i", "j", "n", "s", "tau",
+    "delta", "nabla", "partial", "inf", "infinity", "true", "false", "π", "Δ", "∂", "∇", "∞", "Σ", "∑",
+}
+MAX_UNDEFINED_SYMBOLS = 2
+
+# LaTeX commands that are symbols themselves; others (\\frac, \\cdot, ...) are dropped
+LATEX_SYMBOL_COMMANDS = {
+    "alpha", "beta", "gamma", "delta", "epsilon", "theta", "lambda", "mu", "nu", "rho", "sigma",
+    "tau", "phi", "omega", "Delta", "Omega",
+}
+
+_LATEX_COMMAND_RE = re.compile(r"\\([A-Za-z]+)")
+_NUMBER_RE = re.compile(r"(?<![\w.])\d+(?:\.\d*)?(?:[eE][-+]?\d+)?")
+_IDENTIFIER_RE = re.compile(r"[^\W\d]\w*")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def expression_symbols(expression: str) -> List[str]:
+    """Identifiers in an equation expression (LaTeX commands, braces and numbers stripped)"""
+    text = _LATEX_COMMAND_RE.sub(lambda m: m.group(1) if m.group(1) in LATEX_SYMBOL_COMMANDS else " ", str(expression))
+    text = text.replace("_{", "_").replace("{", " ").replace("}", " ")
+    text = _NUMBER_RE.sub(" ", text)
+    return _IDENTIFIER_RE.findall(text)
+
+
+def _is_defined(symbol: str, defined: Set[str]) -> bool:
+    if symbol in defined or symbol.lower() in defined or symbol in BUILTIN_SYMBOLS or symbol.lower() in BUILTIN_SYMBOLS:
+        return True
+    # Derivatives and differences: dN, dN_dt, ΔT, delta_x
+    for prefix in ("d", "Δ", "delta_", "Delta_", "∂"):
+        if symbol.startswith(prefix) and len(symbol) > len(prefix) and _is_defined(symbol[len(prefix):], defined):
+            return True
+    # Indexed symbols and operators: z_i, sum_j, integral_0
+    base, _, index = symbol.partition("_")
+    if index and (len(index) == 1 or index.isdigit()) and _is_defined(base, defined):
+        return True
+    # Juxtaposed single-letter symbols: mgh = m * g * h
+    if len(symbol) <= 4 and "_" not in symbol and all(c in defined or c in BUILTIN_SYMBOLS for c in symbol):
+        return True
+    return False
+
+
+def _words(text: str) -> Set[str]:
+    return set(_WORD_RE.findall(str(text).lower()))
+
+
+class SSDChecker:
+    """Local pre-critic validator; keeps per-rule rejection counts across calls"""
+
+    def __init__(self, max_undefined_symbols: int = MAX_UNDEFINED_SYMBOLS):
+        self.max_undefined_symbols = max_undefined_symbols
+        self.checked = 0
+        self.rejected = 0
+        self.rule_counts: Counter = Counter()
+
+    def check(self, entry: Dict) -> List[str]:
+        return self.check_batch([entry])[0]
+
+    def check_batch(self, entries: List[Dict]) -> List[List[str]]:
+        """Issues per entry (empty list = passes)"""
+        issues: List[List[str]] = [[] for _ in entries]
+        outputs = []
+        for i, entry in enumerate(entries):
+            output = entry.get('output')
+            try:
+                SimulationOutput.model_validate(output)
+            except ValidationError as e:
+                first = e.errors()[0]
+                issues[i].append(f"schema: {'.'.join(str(p) for p in first['loc'])}: {first['msg']}")
+            outputs.append(output if isinstance(output, dict) else {})
+
+        self._check_ranges(outputs, issues)
+        self._check_constants(outputs, issues)
+        for i, output in enumerate(outputs):
+            if not issues[i]:
+                issues[i].extend(self._check_symbols(output))
+
+        self.checked += len(entries)
+        for entry_issues in issues:
+            if entry_issues:
+                self.rejected += 1
+                self.rule_counts.update({issue.split(':', 1)[0] for issue in entry_issues})
+        return issues
+
+    def _check_ranges(self, outputs: List[Dict], issues: List[List[str]]):
+        owners, names, rows = [], [], []
+        for i, output in enumerate(outputs):
+            for param in output.get('parameters') or []:
+                if not isinstance(param, dict):
+                    continue
+                value = param.get('range')
+                if not isinstance(value, (list, tuple)) or len(value) != 2:
+                    issues[i].append(f"range: {param.get('symbol') or param.get('name')} is not [min, max]")
+                    continue
+                try:
+                    rows.append([float(value[0]), float(value[1])])
+                except (TypeError, ValueError):
+                    issues[i].append(f"range: {param.get('symbol') or param.get('name')} has non-numeric bounds")
+                    continue
+                owners.append(i)
+                names.append(param.get('symbol') or param.get('name'))
+        if not rows:
+            return
+        ranges = np.array(rows, dtype=np.float64)
+        bad = ~np.isfinite(ranges).all(axis=1) | (ranges[:, 0] > ranges[:, 1])
+        for k in np.flatnonzero(bad):
+            issues[owners[k]].append(f"range: {names[k]} has min > max or non-finite bounds {rows[k]}")
+
+    def _check_constants(self, outputs: List[Dict], issues: List[List[str]]):
+        owners, names, values, references = [], [], [], []
+        for i, output in enumerate(outputs):
+            for const in output.get('constants') or []:
+                if not isinstance(const, dict):
+                    continue
+                try:
+                    value = float(const.get('value'))
+                except (TypeError, ValueError):
+                    continue  # reported by the schema check
+                name = str(const.get('name', ''))
+                normalized = re.sub(r"[_\-\s]+", " ", name.lower())
+                reference = next((KNOWN_CONSTANTS[k] for k in _KNOWN_CONSTANT_KEYS if k in normalized), math.nan)
+                owners.append(i)
+                names.append(const.get('symbol') or name)
+                values.append(value)
+                references.append(reference)
+        if not values:
+            return
+        values_arr = np.array(values, dtype=np.float64)
+        magnitude = np.abs(values_arr)
+        implausible = ~np.isfinite(values_arr) | ((magnitude > 0) & ((magnitude < MIN_CONSTANT_MAGNITUDE) | (magnitude > MAX_CONSTANT_MAGNITUDE)))
+        # Known constants: value / reference must be a power of ten within tolerance (unit prefixes allowed)
+        references_arr = np.array(references, dtype=np.float64)
+        known = np.isfinite(references_arr) & (magnitude > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            exponent = np.log10(magnitude / np.where(known, references_arr, 1.0))
+        off = np.abs(10 ** (exponent - np.round(exponent)) - 1.0) > KNOWN_CONSTANT_TOLERANCE
+        wrong = known & off & ~implausible
+        for k in np.flatnonzero(implausible | wrong):
+            issues[owners[k]].append(f"constant: {names[k]} = {values[k]} is implausible")
+
+    def _check_symbols(self, output: Dict) -> List[str]:
+        issues = []
+        defined: Set[str] = set()
+        vocabulary: Set[str] = set()
+        for item in (output.get('parameters') or []) + (output.get('constants') or []):
+            symbol = str(item.get('symbol', '')).replace("{", "").replace("}", "").replace("\\", "")
+            defined.update(expression_symbols(symbol))
+            defined.add(symbol)
+            vocabulary |= _words(item.get('name', '')) | _words(symbol)
+        for entity in output.get('entities') or []:
+            if not isinstance(entity, dict):
+                continue
+            defined.update(expression_symbols(entity.get('name', '')))
+            # Entity properties ({"mass": {"symbol": "m", ...}}) define symbols too
+            for prop, value in entity.items():
+                if isinstance(value, dict) and value.get('symbol'):
+                    defined.update(expression_symbols(value['symbol']))
+                    vocabulary |= _words(prop) | _words(value['symbol'])
+        initial = output.get('initial_conditions') or {}
+        if isinstance(initial, dict):
+            for key in initial:
+                defined.update(expression_symbols(key))
+        for text in (output.get('outputs') or []):
+            defined.update(expression_symbols(text))
+
+        equations = [eq for eq in output.get('equations') or [] if isinstance(eq, dict)]
+        # Left-hand sides define derived variables
+        for eq in equations:
+            expression = str(eq.get('expression', ''))
+            if "=" in expression:
+                defined.update(expression_symbols(expression.split("=", 1)[0]))
+
+        undefined = []
+        for eq in equations:
+            for symbol in expression_symbols(eq.get('expression', '')):
+                if not _is_defined(symbol, defined) and symbol not in undefined:
+                    undefined.append(symbol)
+        if len(undefined) > self.max_undefined_symbols:
+            issues.append(f"symbols: equations use undefined symbols {undefined[:8]}")
+
+        controls = output.get('simulation_controls') or []
+        unknown_controls = [
+            control for control in controls
+            if not (_words(control) & vocabulary) and str(control).strip() not in defined
+        ]
+        # Controls may include generic knobs (time step, duration); reject when most name nothing
+        if controls and len(unknown_controls) * 2 > len(controls):
+            issues.append(f"controls: {unknown_controls[:5]} match no parameter or constant")
+        return issues
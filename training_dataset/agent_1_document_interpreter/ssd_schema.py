@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+SSD (Scientific Simulation Document) output schema.
+
+Pydantic models for the structured Agent 1 output. Used by extend_dataset.py for
+structured generation and validation, and by finetuning/agent_1_document_interpreter/
+schema_decoding.py to constrain inference to this schema. Kept free of LangChain and
+logging setup so it is cheap to import.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+
+class Entity(BaseModel):
+    """Represents a physical entity in the simulation"""
+    name: str = Field(description="Name of the entity")
+    mass: Optional[Dict[str, Any]] = Field(None, description="Mass properties")
+    capacitance: Optional[Dict[str, Any]] = Field(None, description="Capacitance properties")
+    resistance: Optional[Dict[str, Any]] = Field(None, description="Resistance properties")
+    count: Optional[Dict[str, Any]] = Field(None, description="Count properties")
+
+
+class Constant(BaseModel):
+    """Represents a physical constant"""
+    name: str = Field(description="Name of the constant")
+    symbol: str = Field(description="Symbol for the constant")
+    value: float = Field(description="Numerical value")
+    unit: str = Field(description="Unit of measurement")
+
+
+class Parameter(BaseModel):
+    """Represents a simulation parameter"""
+    name: str = Field(description="Name of the parameter")
+    symbol: str = Field(description="Mathematical symbol")
+    unit: str = Field(description="Unit of measurement")
+    range: List[float] = Field(description="Valid range [min, max]")
+
+
+class Equation(BaseModel):
+    """Represents a mathematical equation"""
+    description: str = Field(description="Description of what the equation represents")
+    expression: str = Field(description="Mathematical expression")
+    condition: Optional[str] = Field(None, description="Condition for applicability")
+
+
+class SimulationOutput(BaseModel):
+    """Structured output for a simulation description - SSD Format"""
+    simulation_name: str = Field(description="Unique identifier for the simulation")
+    domain: str = Field(description="Scientific/engineering domain")
+    description: str = Field(description="Brief description of the simulation")
+    assumptions: List[str] = Field(description="List of assumptions made")
+    entities: List[Entity] = Field(default_factory=list, description="Physical entities")
+    constants: List[Constant] = Field(default_factory=list, description="Physical constants")
+    parameters: List[Parameter] = Field(description="Configurable parameters")
+    equations: List[Equation] = Field(description="Mathematical equations")
+    initial_conditions: Dict[str, Any] = Field(description="Initial conditions")
+    outputs: List[str] = Field(description="Output variables")
+    simulation_controls: List[str] = Field(description="User-controllable parameters")
+    constraints: Optional[List[str]] = Field(default_factory=list, description="System constraints")
+    
+    @field_validator('simulation_name')
+    @classmethod
+    def validate_simulation_name(cls, v):
+        if not v or not v.strip():
+            raise ValueError("Simulation name cannot be empty")
+        return v.strip()
+    
+    @field_validator('domain')
+    @classmethod
+    def validate_domain(cls, v):
+        if not v or not v.strip():
+            raise ValueError("Domain cannot be empty")
+        return v.strip()
@@ -0,0 +1,34 @@
+import json
+
+from dataset_writer import DatasetWriter
+
+
+def test_sample_records_follow_output_lines_across_reopen(tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_text(json.dumps({"seed": True}) + "\n")  # a line without a record
+    writer = DatasetWriter(str(output), flush_entries=2)
+    writer.write({"n": 1}, {"number": 7})
+    writer.write({"n": 2})
+    writer.write({"n": 3}, {"number": 9})
+    writer.close()
+
+    reopened = DatasetWriter(str(output))
+    reopened.write({"n": 4}, {"number": 12})
+    reopened.close()
+    assert reopened.sample_records() == {1: {"number": 7}, 3: {"number": 9}, 4: {"number": 12}}
+    assert len(output.read_text().splitlines()) == 5
+
+
+def test_records_of_a_lost_batch_are_superseded(tmp_path):
+    output = tmp_path / "out.jsonl"
+    writer = DatasetWriter(str(output))
+    writer.write({"n": 1}, {"number": 1})
+    writer.close()
+    # Crash after the sidecar append but before the batch reached the output, mid-record
+    with open(writer.samples_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"line": 1, "number": 2}) + "\n" + '{"line": 2, "num')
+
+    reopened = DatasetWriter(str(output))
+    reopened.write({"n": 3}, {"number": 3})
+    reopened.close()
+    assert reopened.sample_records() == {0: {"number": 1}, 1: {"number": 3}}
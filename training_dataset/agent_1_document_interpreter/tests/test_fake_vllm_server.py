@@ -0,0 +1,23 @@
+from fake_vllm_server import PrefixCache, _prompt_text
+
+
+def test_prefix_cache_reuses_leading_blocks_only():
+    cache = PrefixCache(capacity=100, block_chars=4)
+    assert cache.match_and_insert("aaaabbbbcccc") == 0
+    assert cache.match_and_insert("aaaabbbbcccc") == 12
+    # Shared first block, then divergence: later identical blocks do not count
+    assert cache.match_and_insert("aaaaxxxxcccc") == 4
+    # Partial trailing block is never cached
+    assert cache.match_and_insert("aaaabbbbcc") == 8
+
+
+def test_prefix_cache_evicts_least_recently_used():
+    cache = PrefixCache(capacity=2, block_chars=4)
+    cache.match_and_insert("aaaabbbb")
+    cache.match_and_insert("cccc")  # evicts the "aaaa" block
+    assert cache.match_and_insert("aaaabbbb") == 0
+
+
+def test_prompt_text_keeps_message_order():
+    body = {"messages": [{"role": "system", "content": "S"}, {"role": "user", "content": "U"}]}
+    assert _prompt_text(body).index("S") < _prompt_text(body).index("U")
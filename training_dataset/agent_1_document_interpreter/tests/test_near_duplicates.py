@@ -0,0 +1,41 @@
+from near_duplicates import NearDuplicateIndex
+
+WORDS = (
+    "a damped spring mass system with stiffness k and damping c is driven by a sinusoidal "
+    "force the displacement x of the mass is integrated over ten seconds and the peak "
+    "amplitude is compared against the analytic steady state response of the oscillator"
+).split()
+
+
+def _entry(words, name):
+    return {
+        "input": " ".join(words),
+        "output": {
+            "simulation_name": name,
+            "equations": [{"expression": "m * x'' + c * x' + k * x = F0 * sin(w * t)"}],
+        },
+    }
+
+
+def test_near_identical_entries_are_caught():
+    for seed in range(20):
+        index = NearDuplicateIndex(seed=seed)
+        index.add(_entry(WORDS, "original"))
+        # One word changed in a ~45-word description
+        edited = list(WORDS)
+        edited[seed % len(edited)] = "modified"
+        match = index.query(_entry(edited, "edited"))
+        assert match is not None, seed
+        assert match[0] == "original" and match[1] >= index.threshold
+
+
+def test_unrelated_entry_is_not_flagged():
+    index = NearDuplicateIndex()
+    index.add(_entry(WORDS, "original"))
+    other = "a heat equation on a unit rod with fixed end temperatures solved by finite differences".split()
+    assert index.query({"input": " ".join(other), "output": {"equations": ["u_t = alpha * u_xx"]}}) is None
+
+
+def test_band_midpoint_sits_below_threshold():
+    index = NearDuplicateIndex()
+    assert (1 / index.bands) ** (1 / index.rows) < index.threshold - 0.2
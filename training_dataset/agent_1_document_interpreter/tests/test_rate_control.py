@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_control import AdaptiveLimiter, is_overload_error
+
+
+class FakeStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+async def _sleep_call(seconds):
+    await asyncio.sleep(seconds)
+    return seconds
+
+
+def test_latency_spike_cuts_limit_once_and_recovers():
+    # 16 slow calls in flight together, then a healthy server: only calls started after the
+    # decrease may judge latency, so the stale slow samples must not keep halving the limit
+    limiter = AdaptiveLimiter(initial=16, max_limit=16, target_latency=0.1, window_seconds=3.0)
+
+    async def scenario():
+        await asyncio.gather(*(limiter.call(lambda: _sleep_call(0.3)) for _ in range(16)))
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline:
+            await asyncio.gather(*(limiter.call(lambda: _sleep_call(0.01)) for _ in range(8)))
+
+    asyncio.run(scenario())
+    assert limiter.totals['decreases'] == 1
+    assert limiter.limit >= 8  # halved once, then additive recovery
+
+
+def test_per_call_target_keeps_slow_batched_calls_from_cutting():
+    limiter = AdaptiveLimiter(initial=4, max_limit=8, target_latency=0.05)
+
+    async def scenario():
+        for _ in range(5):
+            await asyncio.gather(*(limiter.call(lambda: _sleep_call(0.1), target_latency=0.4) for _ in range(4)))
+
+    asyncio.run(scenario())
+    assert limiter.totals['decreases'] == 0
+    assert limiter.limit > 4
+
+
+def test_overload_errors_retry_and_decrease_once_per_round_trip():
+    limiter = AdaptiveLimiter(initial=8, max_limit=8, base_delay=0.001, max_retries=3)
+    failures = {'left': 8}
+
+    async def flaky():
+        await asyncio.sleep(0.01)
+        if failures['left'] > 0:
+            failures['left'] -= 1
+            raise FakeStatusError(429)
+        return 'ok'
+
+    async def scenario():
+        return await asyncio.gather(*(limiter.call(flaky) for _ in range(8)))
+
+    assert asyncio.run(scenario()) == ['ok'] * 8
+    assert limiter.totals['retries'] == 8
+    assert limiter.totals['decreases'] == 1  # all 8 failures started before the first decrease
+
+
+def test_non_overload_errors_propagate_without_retry():
+    limiter = AdaptiveLimiter(base_delay=0.001)
+
+    def bad_request():
+        raise FakeStatusError(400)
+
+    with pytest.raises(FakeStatusError):
+        limiter.call_sync(bad_request)
+    assert limiter.totals['retries'] == 0
+    assert limiter.totals['decreases'] == 0
+
+
+def test_is_overload_error():
+    assert is_overload_error(FakeStatusError(429))
+    assert is_overload_error(FakeStatusError(503))
+    assert is_overload_error(TimeoutError())
+    assert not is_overload_error(FakeStatusError(400))
+    assert not is_overload_error(ValueError())
@@ -0,0 +1,62 @@
+import logging
+import threading
+
+import pytest
+
+import fake_vllm_server
+
+
+@pytest.fixture
+def server():
+    args = fake_vllm_server.parse_args([
+        "--latency", "0", "--latency-per-request", "0", "--jitter", "0.05", "--error-rate", "0", "--capacity", "64",
+    ])
+    server = fake_vllm_server.FakeVLLMServer(("127.0.0.1", 0), args)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _seed_examples(ed):
+    examples = []
+    for domain, info in ed.DOMAIN_CATALOG.items():
+        for subcategory in info['subcategories'][:2]:
+            entry = fake_vllm_server._entry(domain, subcategory)
+            entry['output']['simulation_name'] = f"Seed {len(examples)}"
+            examples.append(entry)
+    return examples
+
+
+def _run(ed, server, examples, cache_path, output_file):
+    generator = ed.SimulationGenerator(
+        vllm_base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+        model_name=server.args.model,
+        feed_back_examples=True,
+        critic_batch_size=4,
+        adaptive_rate=False,
+        response_cache=str(cache_path),
+        seed=7,
+    )
+    generator.generate_dataset(examples, target_size=24, num_examples=3, output_file=str(output_file),
+                               concurrency=8, resume=False)
+    return generator.response_cache
+
+
+def test_seeded_concurrent_run_replays_from_cache(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the module opens its log file in the working directory
+    import extend_dataset as ed
+    monkeypatch.setattr(ed.logger, "level", logging.ERROR)
+    examples = _seed_examples(ed)
+
+    first = _run(ed, server, examples, tmp_path / "cache.sqlite", tmp_path / "first.jsonl")
+    assert first.hits == 0
+    requests = server.counts['requests']
+
+    # Same seed, completion order shuffled by the server's jitter: every prompt (and so every response) repeats
+    replay = _run(ed, server, examples, tmp_path / "cache.sqlite", tmp_path / "replay.jsonl")
+    assert replay.misses == 0
+    assert replay.hits == 48  # 24 generations + 24 per-entry critic evaluations
+    assert server.counts['requests'] == requests + 1  # only the API connection test
+    assert (tmp_path / "replay.jsonl").read_text() == (tmp_path / "first.jsonl").read_text()
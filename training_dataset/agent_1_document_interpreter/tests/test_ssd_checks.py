@@ -0,0 +1,108 @@
+import copy
+
+import pytest
+
+from ssd_checks import SSDChecker, expression_symbols
+
+VALID = {
+    "output": {
+        "simulation_name": "Falling Body",
+        "domain": "physics",
+        "description": "Point mass falling with linear drag",
+        "assumptions": ["Constant gravity"],
+        "entities": [{"name": "body", "mass": {"symbol": "m", "value": 1.0}}],
+        "constants": [
+            {"name": "gravitational acceleration", "symbol": "g", "value": 9.81, "unit": "m/s^2"},
+        ],
+        "parameters": [
+            {"name": "drag coefficient", "symbol": "b", "unit": "kg/s", "range": [0.0, 2.0]},
+            {"name": "initial height", "symbol": "h_0", "unit": "m", "range": [1.0, 100.0]},
+        ],
+        "equations": [
+            {"description": "Velocity", "expression": "dv/dt = -g - (b / m) * v"},
+            {"description": "Height", "expression": "dh/dt = v"},
+        ],
+        "initial_conditions": {"v": 0.0, "h": "h_0"},
+        "outputs": ["h", "v"],
+        "simulation_controls": ["drag coefficient", "initial height"],
+    }
+}
+
+
+def _variant(**changes):
+    entry = copy.deepcopy(VALID)
+    entry["output"].update(changes)
+    return entry
+
+
+def _rules(issues):
+    return {issue.split(":", 1)[0] for issue in issues}
+
+
+def test_valid_entry_passes():
+    assert SSDChecker().check(VALID) == []
+
+
+def test_schema_violation_is_reported():
+    entry = copy.deepcopy(VALID)
+    del entry["output"]["equations"]
+    assert _rules(SSDChecker().check(entry)) == {"schema"}
+
+
+@pytest.mark.parametrize("bounds", [[2.0, 1.0], [0.0, float("inf")], [1.0]])
+def test_bad_ranges_are_rejected(bounds):
+    params = copy.deepcopy(VALID["output"]["parameters"])
+    params[0]["range"] = bounds
+    assert "range" in _rules(SSDChecker().check(_variant(parameters=params)))
+
+
+@pytest.mark.parametrize("value, ok", [
+    (9.81, True),
+    (981.0, True),   # cm/s^2: off by a unit prefix
+    (9.0, False),
+    (50.0, False),
+])
+def test_known_constants_allow_unit_prefixes_only(value, ok):
+    constants = [{"name": "Gravitational_Acceleration", "symbol": "g", "value": value, "unit": "m/s^2"}]
+    issues = SSDChecker().check(_variant(constants=constants))
+    assert ("constant" not in _rules(issues)) == ok
+
+
+def test_implausible_constant_magnitude_is_rejected():
+    constants = VALID["output"]["constants"] + [{"name": "scale", "symbol": "s0", "value": 1e60, "unit": "1"}]
+    assert "constant" in _rules(SSDChecker().check(_variant(constants=constants)))
+
+
+def test_reduced_planck_is_not_matched_as_planck():
+    constants = [{"name": "reduced Planck constant", "symbol": "hbar", "value": 1.0546e-34, "unit": "J s"}]
+    assert "constant" not in _rules(SSDChecker().check(_variant(constants=constants)))
+
+
+def test_undefined_symbols_over_the_limit_are_rejected():
+    equations = VALID["output"]["equations"] + [{"description": "Extra", "expression": "F = q * E_field + w * Q"}]
+    issues = SSDChecker(max_undefined_symbols=2).check(_variant(equations=equations))
+    assert _rules(issues) == {"symbols"}
+    # Within the limit: F is defined by its own left-hand side, so only q, E_field, w, Q are unknown
+    assert SSDChecker(max_undefined_symbols=4).check(_variant(equations=equations)) == []
+
+
+def test_derivatives_indices_and_latex_resolve_to_defined_symbols():
+    assert expression_symbols(r"\frac{dv}{dt} = -\mu v_{0}") == ["dv", "dt", "mu", "v_0"]
+    equations = [{"description": "Decay", "expression": r"\frac{dv}{dt} = -g * \Delta h_i"}]
+    assert SSDChecker().check(_variant(equations=equations)) == []
+
+
+def test_controls_that_name_nothing_are_rejected():
+    assert "controls" in _rules(SSDChecker().check(_variant(simulation_controls=["wind speed", "colour"])))
+    # A generic knob next to a named parameter is fine
+    assert SSDChecker().check(_variant(simulation_controls=["drag coefficient", "time step"])) == []
+
+
+def test_check_batch_matches_single_checks_and_counts_rules():
+    bad_range = copy.deepcopy(VALID["output"]["parameters"])
+    bad_range[1]["range"] = [5.0, 1.0]
+    entries = [VALID, _variant(parameters=bad_range), _variant(simulation_controls=["colour"])]
+    batch_checker = SSDChecker()
+    assert batch_checker.check_batch(entries) == [SSDChecker().check(entry) for entry in entries]
+    assert (batch_checker.checked, batch_checker.rejected) == (3, 2)
+    assert batch_checker.rule_counts == {"range": 1, "controls": 1}
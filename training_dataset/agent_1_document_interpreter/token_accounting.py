@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Token accounting for the dataset extension pipeline.
+
+Every LLM call is charged to a stage (generation, domain_mismatch, generation_error, critic,
+critic_batch, api_test) using the server's usage metadata, or a local tokenizer estimate when the
+response has none. Calls are also charged to the sample(s) they served; when a sample's outcome is
+recorded its tokens are settled into per-outcome, per-domain and per-subcategory totals.
+Samples accepted after the last snapshot of a crashed run are settled on resume from the tokens
+recorded with their output entry (stage 'adopted').
+Tokens per accepted sample = all tokens spent (every stage, every outcome) / accepted samples.
+"""
+
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# Generation calls whose output was thrown away and retried
+RETRY_STAGES = ('domain_mismatch', 'generation_error')
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Local token count: tiktoken cl100k_base when available, else ~4 characters per token"""
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False  # encoding file unavailable (offline) - do not retry
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4
+
+
+def message_usage(raw, messages: List) -> Tuple[int, int, bool]:
+    """(prompt tokens, completion tokens, estimated) for one chat call; responses served from cache cost nothing"""
+    if (getattr(raw, 'response_metadata', None) or {}).get('cache_hit'):
+        return 0, 0, False
+    usage = getattr(raw, 'usage_metadata', None) or {}
+    if usage.get('input_tokens') or usage.get('output_tokens'):
+        return usage.get('input_tokens', 0), usage.get('output_tokens', 0), False
+    token_usage = (getattr(raw, 'response_metadata', None) or {}).get('token_usage') or {}
+    if token_usage.get('prompt_tokens') or token_usage.get('completion_tokens'):
+        return token_usage.get('prompt_tokens', 0), token_usage.get('completion_tokens', 0), False
+    prompt = sum(estimate_tokens(str(m.content)) for m in messages)
+    completion = estimate_tokens(str(getattr(raw, 'content', '') or '')) + sum(
+        estimate_tokens(str(call.get('args', ''))) for call in getattr(raw, 'tool_calls', None) or []
+    )
+    return prompt, completion, True
+
+
+class TokenLedger:
+    """Per-stage totals plus per-sample tokens settled by outcome, domain and subcategory"""
+
+    def __init__(self):
+        self.by_stage: Dict[str, Counter] = defaultdict(Counter)
+        self.by_outcome: Dict[str, Counter] = defaultdict(Counter)
+        self.by_domain: Dict[str, Counter] = defaultdict(Counter)
+        self.by_subcategory: Dict[str, Counter] = defaultdict(Counter)
+        self.open: Dict[int, Counter] = defaultdict(Counter)  # sample number -> tokens not yet settled
+        self._entry_owner: Dict[int, int] = {}  # id(entry) -> sample number, while the entry is in flight
+
+    # ----- Charging -----
+
+    def bind(self, entry: Dict, number: int):
+        """Critic calls only see the entry; remember which sample it belongs to"""
+        self._entry_owner[id(entry)] = number
+
+    def owners(self, entries: Iterable[Dict]) -> List[Optional[int]]:
+        return [self._entry_owner.get(id(entry)) for entry in entries]
+
+    def charge(self, stage: str, prompt_tokens: int, completion_tokens: int,
+               numbers: Iterable[Optional[int]] = (), estimated: bool = False) -> int:
+        """Record one call; its tokens are split evenly over the samples it served. Returns total tokens"""
+        total = prompt_tokens + completion_tokens
+        stage_counts = self.by_stage[stage]
+        stage_counts['calls'] += 1
+        stage_counts['prompt_tokens'] += prompt_tokens
+        stage_counts['completion_tokens'] += completion_tokens
+        stage_counts['estimated_calls'] += int(estimated)
+        numbers = [n for n in numbers if n is not None]
+        for i, number in enumerate(numbers):
+            # Integer split; the first sample takes the remainder
+            prompt_share = prompt_tokens // len(numbers) + (prompt_tokens % len(numbers) if i == 0 else 0)
+            completion_share = completion_tokens // len(numbers) + (completion_tokens % len(numbers) if i == 0 else 0)
+            counts = self.open[number]
+            counts['prompt_tokens'] += prompt_share
+            counts['completion_tokens'] += completion_share
+            counts['tokens'] += prompt_share + completion_share
+        return total
+
+    def pending(self, number: int) -> Dict[str, int]:
+        """Prompt / completion tokens charged to a sample that is not settled yet"""
+        counts = self.open.get(number, Counter())
+        return {'prompt_tokens': counts['prompt_tokens'], 'completion_tokens': counts['completion_tokens']}
+
+    def adopt(self, number: int, tokens: Dict[str, int], domain: str, subcategory: str):
+        """
+        Settle an accepted sample whose calls were made after the last snapshot (recovered from the
+        output on resume): charge what the snapshot does not already hold to the 'adopted' stage
+        """
+        already = self.pending(number)
+        self.charge('adopted', tokens.get('prompt_tokens', 0) - already['prompt_tokens'],
+                    tokens.get('completion_tokens', 0) - already['completion_tokens'], [number])
+        self.settle(number, 'accepted', domain, subcategory)
+
+    def settle(self, number: int, outcome: str, domain: str, subcategory: str):
+        """Move a sample's tokens into the outcome / domain / subcategory totals"""
+        tokens = self.open.pop(number, Counter())['tokens']
+        accepted = int(outcome == 'accepted')
+        for counts in (self.by_outcome[outcome], self.by_domain[domain],
+                       self.by_subcategory[f"{domain} :: {subcategory}"]):
+            counts['samples'] += 1
+            counts['accepted'] += accepted
+            counts['tokens'] += tokens
+
+    def release(self, entries: Iterable[Dict]):
+        for entry in entries:
+            self._entry_owner.pop(id(entry), None)
+
+    # ----- Reporting -----
+
+    def total_tokens(self) -> int:
+        return sum(c['prompt_tokens'] + c['completion_tokens'] for c in self.by_stage.values())
+
+    def accepted(self) -> int:
+        return self.by_outcome['accepted']['samples']
+
+    def tokens_per_accepted(self) -> float:
+        return self.total_tokens() / max(self.accepted(), 1)
+
+    def summary_lines(self, top_domains: int = 5) -> List[str]:
+        total = self.total_tokens()
+        prompt = sum(c['prompt_tokens'] for c in self.by_stage.values())
+        estimated = sum(c['estimated_calls'] for c in self.by_stage.values())
+        calls = sum(c['calls'] for c in self.by_stage.values())
+        lines = [f"Tokens: {total:,} ({prompt:,} prompt / {total - prompt:,} completion, "
+                 f"{estimated}/{calls} calls estimated) | {self.tokens_per_accepted():,.0f} tokens per accepted sample"]
+        lines.append("  By stage: " + ", ".join(
+            f"{stage} {c['prompt_tokens'] + c['completion_tokens']:,} ({c['calls']} calls)"
+            for stage, c in sorted(self.by_stage.items(), key=lambda kv: -(kv[1]['prompt_tokens'] + kv[1]['completion_tokens']))
+        ))
+        retry_tokens = sum(self.by_stage[s]['prompt_tokens'] + self.by_stage[s]['completion_tokens']
+                           for s in RETRY_STAGES if s in self.by_stage)
+        if total:
+            lines.append(f"  Retried generations: {retry_tokens:,} tokens ({retry_tokens / total:.1%})")
+        lines.append("  By outcome: " + ", ".join(
+            f"{outcome} {c['tokens']:,} ({c['samples']} samples)"
+            for outcome, c in sorted(self.by_outcome.items(), key=lambda kv: -kv[1]['tokens'])
+        ))
+        ranked = sorted(self.by_domain.items(), key=lambda kv: -kv[1]['tokens'] / max(kv[1]['accepted'], 1))
+        if ranked:
+            lines.append("  Most tokens per accepted sample: " + ", ".join(
+                f"{domain} {c['tokens'] / max(c['accepted'], 1):,.0f} ({c['accepted']}/{c['samples']} accepted)"
+                for domain, c in ranked[:top_domains]
+            ))
+        return lines
+
+    def domain_lines(self) -> List[str]:
+        return [
+            f"  {domain}: {c['tokens']:,} tokens, {c['accepted']}/{c['samples']} accepted, "
+            f"{c['tokens'] / max(c['accepted'], 1):,.0f} per accepted"
+            for domain, c in sorted(self.by_domain.items(), key=lambda kv: -kv[1]['tokens'])
+        ]
+
+    # ----- Snapshots -----
+
+    def state_dict(self) -> Dict:
+        return {
+            name: {key: dict(counts) for key, counts in getattr(self, name).items()}
+            for name in ('by_stage', 'by_outcome', 'by_domain', 'by_subcategory', 'open')
+        }
+
+    def load_state_dict(self, state: Dict):
+        for name, table in state.items():
+            restored = defaultdict(Counter, {key: Counter(counts) for key, counts in table.items()})
+            if name == 'open':
+                restored = defaultdict(Counter, {int(key): counts for key, counts in restored.items()})
+            setattr(self, name, restored)